@@ -1 +1,525 @@
-(()=>{function e(e,t){for(var i=0;i<t.length;i++){var s=t[i];s.enumerable=s.enumerable||!1,s.configurable=!0,"value"in s&&(s.writable=!0),Object.defineProperty(e,s.key,s)}}var t=function(){function t(e,i){var s=this;!function(e,t){if(!(e instanceof t))throw new TypeError("Cannot call a class as a function")}(this,t),this.size=5*e,this.streetSize=4,this.firstStreet=i,this.firstStreetOriginal=i,this.distanceBetweenStreets=51,this.numberOfStreets=5,this.vehicles=[],this.trafficLights=[],this.withBikeLane=!1,this.cameraOffset={x:0,y:0},this.cameraZoom=1,this.minZoom=1,this.maxZoom=10,this.scrollSensitivity=8e-4,this.isDragging=!1,this.dragStart={x:0,y:0},this.initialPinchDistance=null,this.lastZoom=this.cameraZoom,this.canvas=document.createElement("canvas"),this.canvas.style="width: 100%; max-width: 600px; border: 1px solid black; margin: 1rem 0 5rem;",document.getElementById("elements").appendChild(this.canvas),this.context=this.canvas.getContext("2d"),this.canvas.addEventListener("mousedown",(function(e){return s.onPointerDown(e)})),this.canvas.addEventListener("touchstart",(function(e){return s.handleTouch(e,s.onPointerDown)})),this.canvas.addEventListener("mouseup",(function(e){return s.onPointerUp(e)})),this.canvas.addEventListener("touchend",(function(e){return s.handleTouch(e,s.onPointerUp)})),this.canvas.addEventListener("mousemove",(function(e){return s.onPointerMove(e)})),this.canvas.addEventListener("touchmove",(function(e){return s.handleTouch(e,s.onPointerMove)})),this.canvas.addEventListener("wheel",(function(e){e.preventDefault(),s.adjustZoom(e.deltaY*s.scrollSensitivity)})),this.canvas.addEventListener("mouseleave",(function(e){return s.onPointerUp(e)})),this.imageBike=new Image,this.imageBike.src="/local/TrafficGrid/frontend/bike.svg",this.imageCar=new Image,this.imageCar.src="/local/TrafficGrid/frontend/car.svg",this.draw(this.context)}var i,s,a;return i=t,(s=[{key:"draw",value:function(e){var t=this;this.canvas.width=this.size,this.canvas.height=this.size,e.translate(this.size/2,this.size/2),e.scale(this.cameraZoom,this.cameraZoom),e.translate(-this.size/2+this.cameraOffset.x,-this.size/2+this.cameraOffset.y),e.clearRect(0,0,this.size,this.size),e.lineWidth=1,e.strokeStyle="#666";var i=5*this.firstStreet;e.beginPath();for(var s=0;s<this.numberOfStreets;s++)e.moveTo(i,0),e.lineTo(i,this.size),e.moveTo(0,i),e.lineTo(this.size,i),i+=5*this.streetSize,e.moveTo(i,0),e.lineTo(i,this.size),e.moveTo(0,i),e.lineTo(this.size,i),i+=5*this.distanceBetweenStreets;e.stroke();var a=this.distanceBetweenStreets+this.streetSize;i=5*(this.firstStreet+this.streetSize/2);for(var n=0;n<this.numberOfStreets;n++)e.beginPath(),e.setLineDash([10,10]),e.lineDashOffset=10,e.strokeStyle="#666",e.moveTo(i,0),e.lineTo(i,this.size),e.moveTo(0,i),e.lineTo(this.size,i),e.stroke(),this.withBikeLane&&(e.beginPath(),e.setLineDash([5,5]),e.lineDashOffset=0,e.strokeStyle="#d67d00",e.moveTo(i-10,0),e.lineTo(i-10,this.size),e.moveTo(i+10,0),e.lineTo(i+10,this.size),e.moveTo(0,i-10),e.lineTo(this.size,i-10,this.size),e.moveTo(0,i+10),e.lineTo(this.size,i+10),e.stroke()),i+=5*a;e.stroke(),e.setLineDash([]);for(var r=0;r<this.numberOfStreets;r++)for(var o=0;o<this.numberOfStreets;o++)e.clearRect(5*(r*a+this.firstStreet),5*(o*a+this.firstStreet),5*this.streetSize,5*this.streetSize);this.vehicles.forEach((function(i){var s,a,n,r=i.x,o=i.y;if(0===i.type)switch(s=t.imageCar,n="blue",a=2,i.dir){case 0:r-=1,o-=1;break;case 1:o-=1;break;case 2:break;case 3:r-=1}else 1===i.type&&(s=t.imageBike,a=1,n="orange");a*=5,e.fillStyle=n,e.fillRect(5*r,5*o,a,a),e.save(),e.translate(5*r+a/2,5*o+a/2),e.rotate((-1+i.dir)*Math.PI/2),e.translate(5*-r-a/2,5*-o-a/2),e.drawImage(s,5*r,5*o,a,a),e.restore()})),this.trafficLights.forEach((function(i){e.lineWidth=3,e.strokeStyle=1===i.state?"red":"green",e.beginPath(),e.moveTo(5*i.x,5*i.y),e.lineTo(5*i.x,5*(i.y+t.streetSize)),e.moveTo(5*(i.x+t.streetSize),5*i.y),e.lineTo(5*(i.x+t.streetSize),5*(i.y+t.streetSize)),e.stroke(),e.strokeStyle=0===i.state?"red":"green",e.beginPath(),e.moveTo(5*i.x,5*i.y),e.lineTo(5*(i.x+t.streetSize),5*i.y),e.moveTo(5*i.x,5*(i.y+t.streetSize)),e.lineTo(5*(i.x+t.streetSize),5*(i.y+t.streetSize)),e.stroke(),t.withBikeBox&&(e.lineWidth=1.5,e.strokeStyle="#666",e.beginPath(),e.moveTo(5*(i.x-1),5*(i.y+t.streetSize/2)),e.lineTo(5*(i.x-1),5*(i.y+t.streetSize-1)),e.moveTo(5*(i.x+t.streetSize+1),5*(i.y+1)),e.lineTo(5*(i.x+t.streetSize+1),5*(i.y+t.streetSize/2)),e.moveTo(5*(i.x+1),5*(i.y-1)),e.lineTo(5*(i.x+t.streetSize/2),5*(i.y-1)),e.moveTo(5*(i.x+t.streetSize/2),5*(i.y+t.streetSize+1)),e.lineTo(5*(i.x+t.streetSize-1),5*(i.y+t.streetSize+1)),e.stroke())})),window.requestAnimationFrame((function(){return t.draw(e)}))}},{key:"getEventLocation",value:function(e){return e.touches&&1==e.touches.length?{x:e.touches[0].clientX,y:e.touches[0].clientY}:e.clientX&&e.clientY?{x:e.clientX,y:e.clientY}:{x:0,y:0}}},{key:"onPointerDown",value:function(e){this.isDragging=!0,this.dragStart.x=this.getEventLocation(e).x/this.cameraZoom-this.cameraOffset.x,this.dragStart.y=this.getEventLocation(e).y/this.cameraZoom-this.cameraOffset.y}},{key:"onPointerUp",value:function(e){this.isDragging=!1,this.initialPinchDistance=null,this.lastZoom=this.cameraZoom}},{key:"onPointerMove",value:function(e){this.isDragging&&this.setCameraOffset(this.getEventLocation(e).x/this.cameraZoom-this.dragStart.x,this.getEventLocation(e).y/this.cameraZoom-this.dragStart.y)}},{key:"setCameraOffset",value:function(e,t){var i=this.size*(this.cameraZoom-1)/(2*this.cameraZoom);e=Math.sign(e)*Math.min(i,Math.abs(e)),t=Math.sign(t)*Math.min(i,Math.abs(t)),this.cameraOffset.x=e,this.cameraOffset.y=t}},{key:"handleTouch",value:function(e,t){e.preventDefault(),1==e.touches.length?t.call(this,e):"touchmove"==e.type&&2==e.touches.length&&(this.isDragging=!1,this.handlePinch(e))}},{key:"handlePinch",value:function(e){e.preventDefault();var t=e.touches[0].clientX,i=e.touches[0].clientY,s=e.touches[1].clientX,a=e.touches[1].clientY,n=Math.pow(t-s,2)+Math.pow(i-a,2);null==this.initialPinchDistance?this.initialPinchDistance=n:this.adjustZoom(null,n/this.initialPinchDistance)}},{key:"adjustZoom",value:function(e,t){this.isDragging||(e?this.cameraZoom-=e:t&&(this.cameraZoom=t*this.lastZoom),this.cameraZoom=Math.min(this.cameraZoom,this.maxZoom),this.cameraZoom=Math.max(this.cameraZoom,this.minZoom),this.setCameraOffset(this.cameraOffset.x,this.cameraOffset.y))}},{key:"render",value:function(e){this.withBikeLane=e.with_bike_lane,this.withBikeBox=e.with_bike_box,this.vehicles=e.vehicles,this.trafficLights=e.traffic_lights,this.withBikeLane?(this.streetSize=6,this.firstStreet=this.firstStreetOriginal-1,this.distanceBetweenStreets=50):(this.streetSize=4,this.firstStreet=this.firstStreetOriginal,this.distanceBetweenStreets=51)}},{key:"reset",value:function(){this.vehicles=[],this.trafficLights=[]}}])&&e(i.prototype,s),a&&e(i,a),Object.defineProperty(i,"prototype",{writable:!1}),t}();window.TrafficModel=t})();
\ No newline at end of file
+(() => {
+    const GRID2PX_FACTOR = 5;
+    const MAX_CANVAS_SIZE = 4000;
+
+    // Bit layout of the packed vehicle state in delta frames: x | y << 14 | type << 28 | dir << 29
+    const COORDINATE_BITS = 14;
+    const COORDINATE_MASK = (1 << COORDINATE_BITS) - 1;
+
+    function decodeInt32Array(base64) {
+        // Decode a base64 string of little-endian 32-bit integers
+        const bytes = Uint8Array.from(atob(base64), (c) => c.charCodeAt(0));
+        return new Int32Array(bytes.buffer);
+    }
+
+    class TrafficModel {
+        constructor() {
+            // Street layout, which is sent with the first frame
+            this.scale = GRID2PX_FACTOR;
+            this.size = 0;
+            this.streetSize = 0;
+            this.firstStreet = 0;
+            this.distanceBetweenStreets = 0;
+            this.numberOfStreets = 0;
+
+            // Storage for all vehicles and traffic lights
+            this.vehicles = [];
+            this.vehiclesById = new Map();
+            this.trafficLights = [];
+            this.withBikeLane = false;
+
+            // Parameters for moving and zooming the map
+            this.cameraOffset = { x: 0, y: 0 };
+            this.cameraZoom = 1;
+            this.minZoom = 1;
+            this.maxZoom = 10;
+            this.scrollSensitivity = 0.0008;
+            this.isDragging = false;
+            this.dragStart = { x: 0, y: 0 };
+            this.initialPinchDistance = null;
+            this.lastZoom = this.cameraZoom;
+
+            // Create canvas and add it to the DOM
+            this.canvas = document.createElement("canvas");
+            this.canvas.style =
+                "width: 100%; max-width: 600px; border: 1px solid black; margin: 1rem 0 5rem;";
+            const elements = document.getElementById("elements");
+            elements.appendChild(this.canvas);
+
+            // Create the context and the drawing controller:
+            this.context = this.canvas.getContext("2d");
+
+            // Register vent listeners for zooming and moving the map.
+            this.canvas.addEventListener("mousedown", (e) => this.onPointerDown(e));
+            this.canvas.addEventListener("touchstart", (e) =>
+                this.handleTouch(e, this.onPointerDown)
+            );
+            this.canvas.addEventListener("mouseup", (e) => this.onPointerUp(e));
+            this.canvas.addEventListener("touchend", (e) =>
+                this.handleTouch(e, this.onPointerUp)
+            );
+            this.canvas.addEventListener("mousemove", (e) => this.onPointerMove(e));
+            this.canvas.addEventListener("touchmove", (e) =>
+                this.handleTouch(e, this.onPointerMove)
+            );
+            this.canvas.addEventListener("wheel", (e) => {
+                e.preventDefault();
+                this.adjustZoom(e.deltaY * this.scrollSensitivity);
+            });
+            this.canvas.addEventListener("mouseleave", (e) => this.onPointerUp(e));
+
+            this.imageBike = new Image();
+            this.imageBike.src = "/local/TrafficGrid/frontend/bike.svg";
+            this.imageCar = new Image();
+            this.imageCar.src = "/local/TrafficGrid/frontend/car.svg";
+
+            // Start draw cycle
+            this.draw(this.context);
+        }
+
+        draw(ctx) {
+            // Set canvas size
+            this.canvas.width = this.size;
+            this.canvas.height = this.size;
+
+            // Adjust for zoom and camera offset.
+            ctx.translate(this.size / 2, this.size / 2);
+            ctx.scale(this.cameraZoom, this.cameraZoom);
+            ctx.translate(
+                -this.size / 2 + this.cameraOffset.x,
+                -this.size / 2 + this.cameraOffset.y
+            );
+
+            // Clear all visible contents
+            ctx.clearRect(0, 0, this.size, this.size);
+
+            // Draw street borders
+            ctx.lineWidth = 1;
+            ctx.strokeStyle = "#666";
+
+            // Draw street lines
+            let k = this.firstStreet * this.scale;
+            ctx.beginPath();
+            for (let i = 0; i < this.numberOfStreets; i++) {
+                // Draw left street borders
+                ctx.moveTo(k, 0);
+                ctx.lineTo(k, this.size);
+                ctx.moveTo(0, k);
+                ctx.lineTo(this.size, k);
+                k += this.streetSize * this.scale;
+
+                // Draw right street borders
+                ctx.moveTo(k, 0);
+                ctx.lineTo(k, this.size);
+                ctx.moveTo(0, k);
+                ctx.lineTo(this.size, k);
+                k += this.distanceBetweenStreets * this.scale;
+            }
+            ctx.stroke();
+
+            // Draw dashed lines
+            let blockSize = this.distanceBetweenStreets + this.streetSize;
+            k = (this.firstStreet + this.streetSize / 2) * this.scale;
+            for (let i = 0; i < this.numberOfStreets; i++) {
+                // Draw middle lines
+                ctx.beginPath();
+                ctx.setLineDash([2 * this.scale, 2 * this.scale]);
+                ctx.lineDashOffset = 2 * this.scale;
+                ctx.strokeStyle = "#666";
+                ctx.moveTo(k, 0);
+                ctx.lineTo(k, this.size);
+                ctx.moveTo(0, k);
+                ctx.lineTo(this.size, k);
+                ctx.stroke();
+
+                // Draw bike lanes
+                if (this.withBikeLane) {
+                    ctx.beginPath();
+                    ctx.setLineDash([this.scale, this.scale]);
+                    ctx.lineDashOffset = 0;
+                    ctx.strokeStyle = "#d67d00";
+                    // horizontal lines
+                    ctx.moveTo(k - 2 * this.scale, 0);
+                    ctx.lineTo(k - 2 * this.scale, this.size);
+                    ctx.moveTo(k + 2 * this.scale, 0);
+                    ctx.lineTo(k + 2 * this.scale, this.size);
+
+                    // vertical lines
+                    ctx.moveTo(0, k - 2 * this.scale);
+                    ctx.lineTo(this.size, k - 2 * this.scale, this.size);
+                    ctx.moveTo(0, k + 2 * this.scale);
+                    ctx.lineTo(this.size, k + 2 * this.scale);
+                    ctx.stroke();
+                }
+
+                k += blockSize * this.scale;
+            }
+            ctx.stroke();
+            ctx.setLineDash([]);
+
+            // Clear intersections
+            for (let i = 0; i < this.numberOfStreets; i++) {
+                for (let j = 0; j < this.numberOfStreets; j++) {
+                    ctx.clearRect(
+                        (i * blockSize + this.firstStreet) * this.scale,
+                        (j * blockSize + this.firstStreet) * this.scale,
+                        this.streetSize * this.scale,
+                        this.streetSize * this.scale
+                    );
+                }
+            }
+
+            // Draw vehicles
+            this.vehicles.forEach((vehicle) => {
+                let x = vehicle.x;
+                let y = vehicle.y;
+                let image, size, color;
+
+                if (vehicle.type === 0) {
+                    // Type = Car
+                    image = this.imageCar;
+                    color = "blue";
+                    size = 2;
+
+                    // Adjust grid position based on direction. The given coordinate represents the back-right corner of the car in direction of travel.
+                    switch (vehicle.dir) {
+                        case 0: // UP
+                            x -= 1;
+                            y -= 1;
+                            break;
+                        case 1: // RIGHT
+                            y -= 1;
+                            break;
+                        case 2: // DOWN
+                            break;
+                        case 3: // LEFT
+                            x -= 1;
+                            break;
+                    }
+                } else if (vehicle.type === 1) {
+                    // Type = Bike
+                    image = this.imageBike;
+                    size = 1;
+                    color = "orange";
+                }
+
+                // Draw rectangle for the vehicle's boundary.
+                size *= this.scale;
+                ctx.fillStyle = color;
+                ctx.fillRect(x * this.scale, y * this.scale, size, size);
+
+                // Add rotated icon on top of the rectangle.
+                ctx.save();
+                ctx.translate(x * this.scale + size / 2, y * this.scale + size / 2);
+                ctx.rotate(((-1 + vehicle.dir) * Math.PI) / 2);
+                ctx.translate(
+                    -x * this.scale - size / 2,
+                    -y * this.scale - size / 2
+                );
+                ctx.drawImage(image, x * this.scale, y * this.scale, size, size);
+                ctx.restore();
+            });
+
+            // Draw traffic lights
+            this.trafficLights.forEach((light) => {
+                // Lines for left <-> right traffic
+                ctx.lineWidth = 3;
+                ctx.strokeStyle = light.state === 1 ? "red" : "green";
+                ctx.beginPath();
+                ctx.moveTo(light.x * this.scale, light.y * this.scale);
+                ctx.lineTo(
+                    light.x * this.scale,
+                    (light.y + this.streetSize) * this.scale
+                );
+                ctx.moveTo(
+                    (light.x + this.streetSize) * this.scale,
+                    light.y * this.scale
+                );
+                ctx.lineTo(
+                    (light.x + this.streetSize) * this.scale,
+                    (light.y + this.streetSize) * this.scale
+                );
+                ctx.stroke();
+
+                // Lines for up <-> down traffic
+                ctx.strokeStyle = light.state === 0 ? "red" : "green";
+                ctx.beginPath();
+                ctx.moveTo(light.x * this.scale, light.y * this.scale);
+                ctx.lineTo(
+                    (light.x + this.streetSize) * this.scale,
+                    light.y * this.scale
+                );
+                ctx.moveTo(
+                    light.x * this.scale,
+                    (light.y + this.streetSize) * this.scale
+                );
+                ctx.lineTo(
+                    (light.x + this.streetSize) * this.scale,
+                    (light.y + this.streetSize) * this.scale
+                );
+                ctx.stroke();
+
+                if (this.withBikeBox) {
+                    ctx.lineWidth = 1.5;
+                    ctx.strokeStyle = "#666";
+                    ctx.beginPath();
+                    // left -> right
+                    ctx.moveTo(
+                        (light.x - 1) * this.scale,
+                        (light.y + this.streetSize / 2) * this.scale
+                    );
+                    ctx.lineTo(
+                        (light.x - 1) * this.scale,
+                        (light.y + this.streetSize - 1) * this.scale
+                    );
+                    // right -> left
+                    ctx.moveTo(
+                        (light.x + this.streetSize + 1) * this.scale,
+                        (light.y + 1) * this.scale
+                    );
+                    ctx.lineTo(
+                        (light.x + this.streetSize + 1) * this.scale,
+                        (light.y + this.streetSize / 2) * this.scale
+                    );
+                    // up -> down
+                    ctx.moveTo(
+                        (light.x + 1) * this.scale,
+                        (light.y - 1) * this.scale
+                    );
+                    ctx.lineTo(
+                        (light.x + this.streetSize / 2) * this.scale,
+                        (light.y - 1) * this.scale
+                    );
+                    // down -> up
+                    ctx.moveTo(
+                        (light.x + this.streetSize / 2) * this.scale,
+                        (light.y + this.streetSize + 1) * this.scale
+                    );
+                    ctx.lineTo(
+                        (light.x + this.streetSize - 1) * this.scale,
+                        (light.y + this.streetSize + 1) * this.scale
+                    );
+                    ctx.stroke();
+                }
+            });
+
+            // Repeat the draw cycle. This enables scrolling, zooming and more
+            window.requestAnimationFrame(() => this.draw(ctx));
+        }
+
+        getEventLocation(e) {
+            // Return x and y coordinate of a mouse or touch event
+            if (e.touches && e.touches.length == 1) {
+                return { x: e.touches[0].clientX, y: e.touches[0].clientY };
+            } else if (e.clientX && e.clientY) {
+                return { x: e.clientX, y: e.clientY };
+            } else {
+                return { x: 0, y: 0 };
+            }
+        }
+
+        onPointerDown(e) {
+            // Mouse is clicked. Start translating the map as the pointer moves.
+            this.isDragging = true;
+            this.dragStart.x =
+                this.getEventLocation(e).x / this.cameraZoom - this.cameraOffset.x;
+            this.dragStart.y =
+                this.getEventLocation(e).y / this.cameraZoom - this.cameraOffset.y;
+        }
+
+        onPointerUp(_) {
+            // Mouse is not clicked or not over the target anymore.
+            this.isDragging = false;
+            this.initialPinchDistance = null;
+            this.lastZoom = this.cameraZoom;
+        }
+
+        onPointerMove(e) {
+            // Translate the map, when the mouse button is clicked.
+            if (!this.isDragging) {
+                return;
+            }
+
+            this.setCameraOffset(
+                this.getEventLocation(e).x / this.cameraZoom - this.dragStart.x,
+                this.getEventLocation(e).y / this.cameraZoom - this.dragStart.y
+            );
+        }
+
+        setCameraOffset(newX, newY) {
+            // Calculate maximum camera offset value, in order to only show grid without border.
+            const maxOffset =
+                (this.size * (this.cameraZoom - 1)) / (2 * this.cameraZoom);
+
+            newX = Math.sign(newX) * Math.min(maxOffset, Math.abs(newX));
+            newY = Math.sign(newY) * Math.min(maxOffset, Math.abs(newY));
+
+            this.cameraOffset.x = newX;
+            this.cameraOffset.y = newY;
+        }
+
+        handleTouch(e, singleTouchHandler) {
+            // Handle touch events, which can be either moving or zooming
+            e.preventDefault();
+            if (e.touches.length == 1) {
+                singleTouchHandler.call(this, e);
+            } else if (e.type == "touchmove" && e.touches.length == 2) {
+                this.isDragging = false;
+                this.handlePinch(e);
+            }
+        }
+
+        handlePinch(e) {
+            e.preventDefault();
+
+            let touch1 = { x: e.touches[0].clientX, y: e.touches[0].clientY };
+            let touch2 = { x: e.touches[1].clientX, y: e.touches[1].clientY };
+
+            // This is distance squared, but no need for an expensive sqrt as it's only used in ratio
+            let currentDistance =
+                (touch1.x - touch2.x) ** 2 + (touch1.y - touch2.y) ** 2;
+
+            if (this.initialPinchDistance == null) {
+                this.initialPinchDistance = currentDistance;
+            } else {
+                this.adjustZoom(null, currentDistance / this.initialPinchDistance);
+            }
+        }
+
+        adjustZoom(zoomAmount, zoomFactor) {
+            if (this.isDragging) {
+                return;
+            }
+
+            // Adjust the zoom factor by the given amount or factor.
+            if (zoomAmount) {
+                this.cameraZoom -= zoomAmount;
+            } else if (zoomFactor) {
+                this.cameraZoom = zoomFactor * this.lastZoom;
+            }
+
+            this.cameraZoom = Math.min(this.cameraZoom, this.maxZoom);
+            this.cameraZoom = Math.max(this.cameraZoom, this.minZoom);
+
+            // Prevent moving out of the map.
+            this.setCameraOffset(this.cameraOffset.x, this.cameraOffset.y);
+        }
+
+        render(data) {
+            this.withBikeLane = data.with_bike_lane;
+            this.withBikeBox = data.with_bike_box;
+            if (data.layout) {
+                this.setLayout(data.layout);
+            }
+            if (data.keyframe === undefined) {
+                this.vehicles = data.vehicles;
+                this.trafficLights = data.traffic_lights;
+            } else {
+                this.applyDelta(data);
+            }
+            if (data.replay) {
+                this.updateReplay(data.replay);
+            }
+        }
+
+        updateReplay(replay) {
+            // Show the position in a recording. The slider to jump to any frame is created with the first replayed frame.
+            if (!this.scrubber) {
+                this.scrubber = document.createElement("input");
+                this.scrubber.type = "range";
+                this.scrubber.min = 0;
+                this.scrubber.style = "width: 100%; max-width: 600px; display: block;";
+                this.scrubberLabel = document.createElement("div");
+                this.canvas.after(this.scrubber, this.scrubberLabel);
+                this.scrubber.addEventListener("input", () =>
+                    this.seek(Number(this.scrubber.value))
+                );
+                ws.addEventListener("message", (message) => {
+                    const msg = JSON.parse(message.data);
+                    if (msg.type === "replay_state") {
+                        this.onReplayState(msg.data);
+                    }
+                });
+            }
+            this.scrubber.max = replay.frames - 1;
+            if (!this.seeking) {
+                this.scrubber.value = replay.frame;
+            }
+            this.scrubberLabel.innerText = `Step ${replay.step} (frame ${
+                replay.frame + 1
+            } of ${replay.frames})`;
+        }
+
+        seek(frame) {
+            // Request a frame of the recording, only one at a time while the slider is dragged
+            this.seekTarget = frame;
+            if (!this.seeking) {
+                this.seeking = true;
+                send({ type: "seek", frame: frame });
+            }
+        }
+
+        onReplayState(data) {
+            // Render the requested frame. Unlike "viz_state", this doesn't request the next step.
+            vizElements.forEach((element, index) => element.render(data[index]));
+            if (controller.finished) {
+                controller.finished = false;
+                startModelButton.firstElementChild.innerText = "Start";
+            }
+
+            // Request the latest position of the slider if it moved in the meantime
+            this.seeking = false;
+            const replay = data[vizElements.indexOf(this)].replay;
+            if (replay.frame !== Math.min(this.seekTarget, replay.frames - 1)) {
+                this.seek(this.seekTarget);
+            }
+        }
+
+        setLayout(layout) {
+            // Scale down large cities to keep the canvas within MAX_CANVAS_SIZE pixels
+            this.scale = Math.min(GRID2PX_FACTOR, MAX_CANVAS_SIZE / layout.size);
+            this.size = layout.size * this.scale;
+            this.streetSize = layout.street_width;
+            this.firstStreet = layout.first_street;
+            this.distanceBetweenStreets = layout.distance_between_streets;
+            this.numberOfStreets = layout.number_of_streets;
+            this.setCameraOffset(this.cameraOffset.x, this.cameraOffset.y);
+        }
+
+        applyDelta(data) {
+            // Apply the vehicles that appeared, moved or left since the previous frame to the local state
+            if (data.keyframe) {
+                this.vehiclesById.clear();
+            }
+
+            decodeInt32Array(data.removed).forEach((id) =>
+                this.vehiclesById.delete(id)
+            );
+
+            const vehicles = decodeInt32Array(data.vehicles);
+            for (let i = 0; i < vehicles.length; i += 2) {
+                const packed = vehicles[i + 1];
+                this.vehiclesById.set(vehicles[i], {
+                    x: packed & COORDINATE_MASK,
+                    y: (packed >> COORDINATE_BITS) & COORDINATE_MASK,
+                    type: (packed >> (2 * COORDINATE_BITS)) & 1,
+                    dir: (packed >> (2 * COORDINATE_BITS + 1)) & 3,
+                });
+            }
+            this.vehicles = this.vehiclesById;
+
+            // Traffic lights are only sent when they toggle
+            if (data.traffic_lights) {
+                this.trafficLights = data.traffic_lights;
+            }
+        }
+
+        reset() {
+            this.vehicles = [];
+            this.vehiclesById.clear();
+            this.trafficLights = [];
+        }
+    }
+
+    window.TrafficModel = TrafficModel;
+})();
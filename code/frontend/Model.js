@@ -1,17 +1,29 @@
 const GRID2PX_FACTOR = 5;
+const MAX_CANVAS_SIZE = 4000;
+
+// Bit layout of the packed vehicle state in delta frames: x | y << 14 | type << 28 | dir << 29
+const COORDINATE_BITS = 14;
+const COORDINATE_MASK = (1 << COORDINATE_BITS) - 1;
+
+function decodeInt32Array(base64) {
+    // Decode a base64 string of little-endian 32-bit integers
+    const bytes = Uint8Array.from(atob(base64), (c) => c.charCodeAt(0));
+    return new Int32Array(bytes.buffer);
+}
 
 class TrafficModel {
-    constructor(size, firstStreet) {
-        // Model parameters
-        this.size = size * GRID2PX_FACTOR;
-        this.streetSize = 4;
-        this.firstStreet = firstStreet;
-        this.firstStreetOriginal = firstStreet;
-        this.distanceBetweenStreets = 51;
-        this.numberOfStreets = 5;
+    constructor() {
+        // Street layout, which is sent with the first frame
+        this.scale = GRID2PX_FACTOR;
+        this.size = 0;
+        this.streetSize = 0;
+        this.firstStreet = 0;
+        this.distanceBetweenStreets = 0;
+        this.numberOfStreets = 0;
 
         // Storage for all vehicles and traffic lights
         this.vehicles = [];
+        this.vehiclesById = new Map();
         this.trafficLights = [];
         this.withBikeLane = false;
 
@@ -85,7 +97,7 @@ class TrafficModel {
         ctx.strokeStyle = "#666";
 
         // Draw street lines
-        let k = this.firstStreet * GRID2PX_FACTOR;
+        let k = this.firstStreet * this.scale;
         ctx.beginPath();
         for (let i = 0; i < this.numberOfStreets; i++) {
             // Draw left street borders
@@ -93,25 +105,25 @@ class TrafficModel {
             ctx.lineTo(k, this.size);
             ctx.moveTo(0, k);
             ctx.lineTo(this.size, k);
-            k += this.streetSize * GRID2PX_FACTOR;
+            k += this.streetSize * this.scale;
 
             // Draw right street borders
             ctx.moveTo(k, 0);
             ctx.lineTo(k, this.size);
             ctx.moveTo(0, k);
             ctx.lineTo(this.size, k);
-            k += this.distanceBetweenStreets * GRID2PX_FACTOR;
+            k += this.distanceBetweenStreets * this.scale;
         }
         ctx.stroke();
 
         // Draw dashed lines
         let blockSize = this.distanceBetweenStreets + this.streetSize;
-        k = (this.firstStreet + this.streetSize / 2) * GRID2PX_FACTOR;
+        k = (this.firstStreet + this.streetSize / 2) * this.scale;
         for (let i = 0; i < this.numberOfStreets; i++) {
             // Draw middle lines
             ctx.beginPath();
-            ctx.setLineDash([2 * GRID2PX_FACTOR, 2 * GRID2PX_FACTOR]);
-            ctx.lineDashOffset = 2 * GRID2PX_FACTOR;
+            ctx.setLineDash([2 * this.scale, 2 * this.scale]);
+            ctx.lineDashOffset = 2 * this.scale;
             ctx.strokeStyle = "#666";
             ctx.moveTo(k, 0);
             ctx.lineTo(k, this.size);
@@ -122,24 +134,24 @@ class TrafficModel {
             // Draw bike lanes
             if (this.withBikeLane) {
                 ctx.beginPath();
-                ctx.setLineDash([GRID2PX_FACTOR, GRID2PX_FACTOR]);
+                ctx.setLineDash([this.scale, this.scale]);
                 ctx.lineDashOffset = 0;
                 ctx.strokeStyle = "#d67d00";
                 // horizontal lines
-                ctx.moveTo(k - 2 * GRID2PX_FACTOR, 0);
-                ctx.lineTo(k - 2 * GRID2PX_FACTOR, this.size);
-                ctx.moveTo(k + 2 * GRID2PX_FACTOR, 0);
-                ctx.lineTo(k + 2 * GRID2PX_FACTOR, this.size);
+                ctx.moveTo(k - 2 * this.scale, 0);
+                ctx.lineTo(k - 2 * this.scale, this.size);
+                ctx.moveTo(k + 2 * this.scale, 0);
+                ctx.lineTo(k + 2 * this.scale, this.size);
 
                 // vertical lines
-                ctx.moveTo(0, k - 2 * GRID2PX_FACTOR);
-                ctx.lineTo(this.size, k - 2 * GRID2PX_FACTOR, this.size);
-                ctx.moveTo(0, k + 2 * GRID2PX_FACTOR);
-                ctx.lineTo(this.size, k + 2 * GRID2PX_FACTOR);
+                ctx.moveTo(0, k - 2 * this.scale);
+                ctx.lineTo(this.size, k - 2 * this.scale, this.size);
+                ctx.moveTo(0, k + 2 * this.scale);
+                ctx.lineTo(this.size, k + 2 * this.scale);
                 ctx.stroke();
             }
 
-            k += blockSize * GRID2PX_FACTOR;
+            k += blockSize * this.scale;
         }
         ctx.stroke();
         ctx.setLineDash([]);
@@ -148,10 +160,10 @@ class TrafficModel {
         for (let i = 0; i < this.numberOfStreets; i++) {
             for (let j = 0; j < this.numberOfStreets; j++) {
                 ctx.clearRect(
-                    (i * blockSize + this.firstStreet) * GRID2PX_FACTOR,
-                    (j * blockSize + this.firstStreet) * GRID2PX_FACTOR,
-                    this.streetSize * GRID2PX_FACTOR,
-                    this.streetSize * GRID2PX_FACTOR
+                    (i * blockSize + this.firstStreet) * this.scale,
+                    (j * blockSize + this.firstStreet) * this.scale,
+                    this.streetSize * this.scale,
+                    this.streetSize * this.scale
                 );
             }
         }
@@ -191,28 +203,19 @@ class TrafficModel {
             }
 
             // Draw rectangle for the vehicle's boundary.
-            size *= GRID2PX_FACTOR;
+            size *= this.scale;
             ctx.fillStyle = color;
-            ctx.fillRect(x * GRID2PX_FACTOR, y * GRID2PX_FACTOR, size, size);
+            ctx.fillRect(x * this.scale, y * this.scale, size, size);
 
             // Add rotated icon on top of the rectangle.
             ctx.save();
-            ctx.translate(
-                x * GRID2PX_FACTOR + size / 2,
-                y * GRID2PX_FACTOR + size / 2
-            );
+            ctx.translate(x * this.scale + size / 2, y * this.scale + size / 2);
             ctx.rotate(((-1 + vehicle.dir) * Math.PI) / 2);
             ctx.translate(
-                -x * GRID2PX_FACTOR - size / 2,
-                -y * GRID2PX_FACTOR - size / 2
-            );
-            ctx.drawImage(
-                image,
-                x * GRID2PX_FACTOR,
-                y * GRID2PX_FACTOR,
-                size,
-                size
+                -x * this.scale - size / 2,
+                -y * this.scale - size / 2
             );
+            ctx.drawImage(image, x * this.scale, y * this.scale, size, size);
             ctx.restore();
         });
 
@@ -222,36 +225,36 @@ class TrafficModel {
             ctx.lineWidth = 3;
             ctx.strokeStyle = light.state === 1 ? "red" : "green";
             ctx.beginPath();
-            ctx.moveTo(light.x * GRID2PX_FACTOR, light.y * GRID2PX_FACTOR);
+            ctx.moveTo(light.x * this.scale, light.y * this.scale);
             ctx.lineTo(
-                light.x * GRID2PX_FACTOR,
-                (light.y + this.streetSize) * GRID2PX_FACTOR
+                light.x * this.scale,
+                (light.y + this.streetSize) * this.scale
             );
             ctx.moveTo(
-                (light.x + this.streetSize) * GRID2PX_FACTOR,
-                light.y * GRID2PX_FACTOR
+                (light.x + this.streetSize) * this.scale,
+                light.y * this.scale
             );
             ctx.lineTo(
-                (light.x + this.streetSize) * GRID2PX_FACTOR,
-                (light.y + this.streetSize) * GRID2PX_FACTOR
+                (light.x + this.streetSize) * this.scale,
+                (light.y + this.streetSize) * this.scale
             );
             ctx.stroke();
 
             // Lines for up <-> down traffic
             ctx.strokeStyle = light.state === 0 ? "red" : "green";
             ctx.beginPath();
-            ctx.moveTo(light.x * GRID2PX_FACTOR, light.y * GRID2PX_FACTOR);
+            ctx.moveTo(light.x * this.scale, light.y * this.scale);
             ctx.lineTo(
-                (light.x + this.streetSize) * GRID2PX_FACTOR,
-                light.y * GRID2PX_FACTOR
+                (light.x + this.streetSize) * this.scale,
+                light.y * this.scale
             );
             ctx.moveTo(
-                light.x * GRID2PX_FACTOR,
-                (light.y + this.streetSize) * GRID2PX_FACTOR
+                light.x * this.scale,
+                (light.y + this.streetSize) * this.scale
             );
             ctx.lineTo(
-                (light.x + this.streetSize) * GRID2PX_FACTOR,
-                (light.y + this.streetSize) * GRID2PX_FACTOR
+                (light.x + this.streetSize) * this.scale,
+                (light.y + this.streetSize) * this.scale
             );
             ctx.stroke();
 
@@ -261,39 +264,39 @@ class TrafficModel {
                 ctx.beginPath();
                 // left -> right
                 ctx.moveTo(
-                    (light.x - 1) * GRID2PX_FACTOR,
-                    (light.y + this.streetSize / 2) * GRID2PX_FACTOR
+                    (light.x - 1) * this.scale,
+                    (light.y + this.streetSize / 2) * this.scale
                 );
                 ctx.lineTo(
-                    (light.x - 1) * GRID2PX_FACTOR,
-                    (light.y + this.streetSize - 1) * GRID2PX_FACTOR
+                    (light.x - 1) * this.scale,
+                    (light.y + this.streetSize - 1) * this.scale
                 );
                 // right -> left
                 ctx.moveTo(
-                    (light.x + this.streetSize + 1) * GRID2PX_FACTOR,
-                    (light.y + 1) * GRID2PX_FACTOR
+                    (light.x + this.streetSize + 1) * this.scale,
+                    (light.y + 1) * this.scale
                 );
                 ctx.lineTo(
-                    (light.x + this.streetSize + 1) * GRID2PX_FACTOR,
-                    (light.y + this.streetSize / 2) * GRID2PX_FACTOR
+                    (light.x + this.streetSize + 1) * this.scale,
+                    (light.y + this.streetSize / 2) * this.scale
                 );
                 // up -> down
                 ctx.moveTo(
-                    (light.x + 1) * GRID2PX_FACTOR,
-                    (light.y - 1) * GRID2PX_FACTOR
+                    (light.x + 1) * this.scale,
+                    (light.y - 1) * this.scale
                 );
                 ctx.lineTo(
-                    (light.x + this.streetSize / 2) * GRID2PX_FACTOR,
-                    (light.y - 1) * GRID2PX_FACTOR
+                    (light.x + this.streetSize / 2) * this.scale,
+                    (light.y - 1) * this.scale
                 );
                 // down -> up
                 ctx.moveTo(
-                    (light.x + this.streetSize / 2) * GRID2PX_FACTOR,
-                    (light.y + this.streetSize + 1) * GRID2PX_FACTOR
+                    (light.x + this.streetSize / 2) * this.scale,
+                    (light.y + this.streetSize + 1) * this.scale
                 );
                 ctx.lineTo(
-                    (light.x + this.streetSize - 1) * GRID2PX_FACTOR,
-                    (light.y + this.streetSize + 1) * GRID2PX_FACTOR
+                    (light.x + this.streetSize - 1) * this.scale,
+                    (light.y + this.streetSize + 1) * this.scale
                 );
                 ctx.stroke();
             }
@@ -404,22 +407,115 @@ class TrafficModel {
     render(data) {
         this.withBikeLane = data.with_bike_lane;
         this.withBikeBox = data.with_bike_box;
-        this.vehicles = data.vehicles;
-        this.trafficLights = data.traffic_lights;
-
-        if (this.withBikeLane) {
-            this.streetSize = 6;
-            this.firstStreet = this.firstStreetOriginal - 1;
-            this.distanceBetweenStreets = 50;
+        if (data.layout) {
+            this.setLayout(data.layout);
+        }
+        if (data.keyframe === undefined) {
+            this.vehicles = data.vehicles;
+            this.trafficLights = data.traffic_lights;
         } else {
-            this.streetSize = 4;
-            this.firstStreet = this.firstStreetOriginal;
-            this.distanceBetweenStreets = 51;
+            this.applyDelta(data);
+        }
+        if (data.replay) {
+            this.updateReplay(data.replay);
+        }
+    }
+
+    updateReplay(replay) {
+        // Show the position in a recording. The slider to jump to any frame is created with the first replayed frame.
+        if (!this.scrubber) {
+            this.scrubber = document.createElement("input");
+            this.scrubber.type = "range";
+            this.scrubber.min = 0;
+            this.scrubber.style = "width: 100%; max-width: 600px; display: block;";
+            this.scrubberLabel = document.createElement("div");
+            this.canvas.after(this.scrubber, this.scrubberLabel);
+            this.scrubber.addEventListener("input", () =>
+                this.seek(Number(this.scrubber.value))
+            );
+            ws.addEventListener("message", (message) => {
+                const msg = JSON.parse(message.data);
+                if (msg.type === "replay_state") {
+                    this.onReplayState(msg.data);
+                }
+            });
+        }
+        this.scrubber.max = replay.frames - 1;
+        if (!this.seeking) {
+            this.scrubber.value = replay.frame;
+        }
+        this.scrubberLabel.innerText = `Step ${replay.step} (frame ${
+            replay.frame + 1
+        } of ${replay.frames})`;
+    }
+
+    seek(frame) {
+        // Request a frame of the recording, only one at a time while the slider is dragged
+        this.seekTarget = frame;
+        if (!this.seeking) {
+            this.seeking = true;
+            send({ type: "seek", frame: frame });
+        }
+    }
+
+    onReplayState(data) {
+        // Render the requested frame. Unlike "viz_state", this doesn't request the next step.
+        vizElements.forEach((element, index) => element.render(data[index]));
+        if (controller.finished) {
+            controller.finished = false;
+            startModelButton.firstElementChild.innerText = "Start";
+        }
+
+        // Request the latest position of the slider if it moved in the meantime
+        this.seeking = false;
+        const replay = data[vizElements.indexOf(this)].replay;
+        if (replay.frame !== Math.min(this.seekTarget, replay.frames - 1)) {
+            this.seek(this.seekTarget);
+        }
+    }
+
+    setLayout(layout) {
+        // Scale down large cities to keep the canvas within MAX_CANVAS_SIZE pixels
+        this.scale = Math.min(GRID2PX_FACTOR, MAX_CANVAS_SIZE / layout.size);
+        this.size = layout.size * this.scale;
+        this.streetSize = layout.street_width;
+        this.firstStreet = layout.first_street;
+        this.distanceBetweenStreets = layout.distance_between_streets;
+        this.numberOfStreets = layout.number_of_streets;
+        this.setCameraOffset(this.cameraOffset.x, this.cameraOffset.y);
+    }
+
+    applyDelta(data) {
+        // Apply the vehicles that appeared, moved or left since the previous frame to the local state
+        if (data.keyframe) {
+            this.vehiclesById.clear();
+        }
+
+        decodeInt32Array(data.removed).forEach((id) =>
+            this.vehiclesById.delete(id)
+        );
+
+        const vehicles = decodeInt32Array(data.vehicles);
+        for (let i = 0; i < vehicles.length; i += 2) {
+            const packed = vehicles[i + 1];
+            this.vehiclesById.set(vehicles[i], {
+                x: packed & COORDINATE_MASK,
+                y: (packed >> COORDINATE_BITS) & COORDINATE_MASK,
+                type: (packed >> (2 * COORDINATE_BITS)) & 1,
+                dir: (packed >> (2 * COORDINATE_BITS + 1)) & 3,
+            });
+        }
+        this.vehicles = this.vehiclesById;
+
+        // Traffic lights are only sent when they toggle
+        if (data.traffic_lights) {
+            this.trafficLights = data.traffic_lights;
         }
     }
 
     reset() {
         this.vehicles = [];
+        this.vehiclesById.clear();
         this.trafficLights = [];
     }
 }
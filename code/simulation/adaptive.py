@@ -0,0 +1,395 @@
+"""Adaptive search for the parameters with the largest average flow.
+
+Instead of running a dense grid of `p_new_agents` values, `MaxFlowSearch` starts with a coarse grid of the searched
+parameters and repeatedly
+- halves the grid spacing around the point with the largest mean flow, until the spacing reaches the resolution, and
+- adds replicates to the points that might still have the largest flow, i.e. whose confidence interval overlaps the
+  one of the best point, while their interval is wider than the requested precision.
+The flow of a run is its average flow from `from_step` on, like the points of the flow-density plots in the notebook.
+
+Example:
+    cssm-maxflow -p bike_lane_config=0,1,2 --search p_new_agents=0.05,1.0 --max-runs 120
+"""
+import argparse
+import itertools
+import math
+
+from statistics import NormalDist, fmean, stdev
+
+from .cache import RunCache, computed_runs
+from .model import TrafficModel
+from .sweep import make_grid, parse_param
+
+
+def parse_bounds(arg: str):
+    """Parse a `name=low,high` command line argument into the name and the bounds."""
+    name, values = parse_param(arg)
+    if len(values) != 2:
+        raise argparse.ArgumentTypeError(f"Expected NAME=LOW,HIGH, got {arg!r}")
+    return name, tuple(values)
+
+
+def t_quantile(p: float, dof: int):
+    """Get the quantile of Student's t distribution. It's exact for 1, 2 and 4 degrees of freedom, which have closed
+    forms, otherwise it's approximated with the Cornish-Fisher expansion around the normal quantile, which is within
+    1% from 3 degrees of freedom for `p` up to 0.995 and more precise for more.
+    """
+    if dof == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if dof == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    if dof == 4:
+        alpha = 4 * p * (1 - p)
+        q = math.cos(math.acos(math.sqrt(alpha)) / 3) / math.sqrt(alpha)
+        return math.copysign(2 * math.sqrt(q - 1), p - 0.5)
+
+    z = NormalDist().inv_cdf(p)
+    terms = [
+        (z**3 + z) / 4,
+        (5 * z**5 + 16 * z**3 + 3 * z) / 96,
+        (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / 384,
+        (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / 92160,
+    ]
+    return z + sum(term / dof**power for power, term in enumerate(terms, 1))
+
+
+class MaxFlowSearch:
+    """Adaptive search for the largest mean average flow of the model in a box of parameter values.
+
+    The searched parameters are continuous, unless both bounds are integers, e.g. for `traffic_light_phase_length`.
+    Replicate `i` of a point is run with the seed `seed + i`, like iteration `i` of `simulation.cache.batch_run`, so
+    both share their cached runs.
+    """
+
+    def __init__(
+        self,
+        fixed: dict = None,
+        bounds: dict = None,
+        model_cls=TrafficModel,
+        initial_points: int = 5,
+        replicates: int = 3,
+        resolution: dict = None,
+        precision: float = 0.005,
+        confidence: float = 0.95,
+        max_steps: int = 300,
+        from_step: int = 100,
+        max_runs: int = 200,
+        number_processes=1,
+        cache: RunCache = None,
+        seed: int = 0,
+        display_progress: bool = True,
+    ):
+        """Initialize the search without any runs.
+
+        Args:
+            fixed: Dictionary of the other parameters of the model.
+            bounds: Dictionary of the searched parameter names and tuples of their lowest and highest value.
+                Default: `p_new_agents` from 0.05 to 1.
+            model_cls: `TrafficModel` or a subclass of it.
+            initial_points: Number of values of each searched parameter in the coarse grid.
+            replicates: Number of runs that are added to a point at once.
+            resolution: Dictionary of the smallest grid spacing of each searched parameter.
+                Default: 1/64 of the range, and at least 1 for integers.
+            precision: Largest half-width of the confidence interval of the mean flow of the points that might have
+                the largest flow.
+            confidence: Confidence level of the confidence intervals.
+            max_steps: Like `batch_run`, each run stops after `max_steps + 1` steps.
+            from_step: First step of the average flow and density of a run, numbered from 0.
+            max_runs: Largest number of runs of the search. The coarse grid is always run completely.
+            number_processes: Number of worker processes. None = number of CPUs.
+            cache: Cache of the runs. None = compute every run.
+            seed: Seed of the first replicate.
+            display_progress: Print the number of runs and the current best point of each round.
+        """
+        self.fixed = dict(fixed or {})
+        self.bounds = dict(bounds or {"p_new_agents": (0.05, 1.0)})
+        overlap = [name for name in self.bounds if name in self.fixed or name == "seed"]
+        if overlap:
+            raise ValueError(f"Searched parameters can't be fixed: {', '.join(overlap)}")
+
+        self.model_cls = model_cls
+        self.names = list(self.bounds)
+        self.integer = {
+            name: all(isinstance(value, int) for value in self.bounds[name]) for name in self.names
+        }
+        self.initial_points = initial_points
+        self.replicates = replicates
+        self.resolution = {
+            name: max(high - low, 0) / 64 if not self.integer[name] else max((high - low) // 64, 1)
+            for name, (low, high) in self.bounds.items()
+        }
+        self.resolution.update(resolution or {})
+        self.precision = precision
+        self.confidence = confidence
+        self.max_steps = max_steps
+        self.from_step = from_step
+        self.max_runs = max_runs
+        self.number_processes = number_processes
+        self.cache = cache
+        self.seed = seed
+        self.display_progress = display_progress
+
+        # Average flow and density of each run per point, a point is a tuple of the values of the searched parameters
+        self.flows = {}
+        self.densities = {}
+        self.runs = 0
+
+    def snap(self, name: str, value):
+        """Clip a value of a searched parameter to its bounds and round it to an integer or to remove float noise."""
+        low, high = self.bounds[name]
+        value = min(max(value, low), high)
+        if self.integer[name]:
+            return int(round(value))
+        return round(value, 12)
+
+    def params(self, point: tuple):
+        """Get the parameters of the model at a point."""
+        return {**self.fixed, **dict(zip(self.names, point))}
+
+    def evaluate(self, requests: list):
+        """Run additional replicates of some points.
+
+        Args:
+            requests: List of tuples of a point and the number of replicates to add to it.
+        """
+        tasks = []
+        points = []
+        for point, count in requests:
+            done = len(self.flows.get(point, [])) + sum(1 for p in points if p == point)
+            for replicate in range(done, done + count):
+                tasks.append((self.params(point), self.seed + replicate))
+                points.append(point)
+
+        results = [None] * len(tasks)
+        for i, run in computed_runs(
+            self.model_cls,
+            tasks,
+            self.number_processes,
+            self.max_steps,
+            display_progress=False,
+            cache=self.cache,
+        ):
+            results[i] = (
+                fmean(run["Average flow"][self.from_step :]),
+                fmean(run["Cell density"][self.from_step :]),
+            )
+
+        # Add the runs in the order of their seeds, whatever order they finished in
+        for point, (flow, density) in zip(points, results):
+            self.flows.setdefault(point, []).append(flow)
+            self.densities.setdefault(point, []).append(density)
+        self.runs += len(tasks)
+
+    def mean(self, point: tuple):
+        """Get the mean flow of a point."""
+        return fmean(self.flows[point])
+
+    def half_width(self, point: tuple):
+        """Get the half-width of the confidence interval of the mean flow of a point, with Student's t distribution
+        because points have only a few runs. Infinite with less than 2 runs.
+        """
+        flows = self.flows[point]
+        if len(flows) < 2:
+            return math.inf
+        t = t_quantile((1 + self.confidence) / 2, len(flows) - 1)
+        return t * stdev(flows) / math.sqrt(len(flows))
+
+    def best(self):
+        """Get the point with the largest mean flow."""
+        return max(self.flows, key=self.mean)
+
+    def contenders(self):
+        """Get the points whose confidence interval overlaps the one of the best point, so they might have the
+        largest flow, ordered by decreasing half-width.
+        """
+        best = self.best()
+        lower = self.mean(best) - self.half_width(best)
+        points = [
+            point for point in self.flows if self.mean(point) + self.half_width(point) >= lower
+        ]
+        return sorted(points, key=self.half_width, reverse=True)
+
+    def initial_grid(self):
+        """Get the points of the coarse grid and its spacing."""
+        values = {}
+        spacing = {}
+        for name, (low, high) in self.bounds.items():
+            count = max(self.initial_points, 2)
+            spacing[name] = (high - low) / (count - 1)
+            values[name] = sorted({self.snap(name, low + i * spacing[name]) for i in range(count)})
+        return list(itertools.product(*values.values())), spacing
+
+    def refinements(self, spacing: dict):
+        """Halve the spacing of the searched parameters that haven't reached their resolution yet and get the new
+        neighbours of the best point at that spacing.
+        """
+        best = self.best()
+        points = []
+        for axis, name in enumerate(self.names):
+            if spacing[name] <= self.resolution[name]:
+                continue
+            spacing[name] = max(spacing[name] / 2, self.resolution[name])
+            for sign in (-1, 1):
+                value = self.snap(name, best[axis] + sign * spacing[name])
+                point = best[:axis] + (value,) + best[axis + 1 :]
+                if point not in self.flows and point not in points:
+                    points.append(point)
+        return points
+
+    def run(self):
+        """Search the maximum until the grid reached its resolution and the contenders are precise enough, or until
+        `max_runs` runs were made.
+
+        Returns: See `result`.
+        """
+        grid, spacing = self.initial_grid()
+        self.evaluate([(point, self.replicates) for point in grid if point not in self.flows])
+
+        while self.runs < self.max_runs:
+            requests = [(point, self.replicates) for point in self.refinements(spacing)]
+            requests += [
+                (point, self.replicates)
+                for point in self.contenders()
+                if self.half_width(point) > self.precision
+            ]
+            if not requests:
+                break
+
+            # Stay within the budget, refinements come first
+            budget = self.max_runs - self.runs
+            trimmed = []
+            for point, count in requests:
+                count = min(count, budget)
+                if count <= 0:
+                    break
+                trimmed.append((point, count))
+                budget -= count
+            self.evaluate(trimmed)
+
+            if self.display_progress:
+                best = self.best()
+                print(
+                    f"{self.runs} runs, best {self.params(best)}: "
+                    f"{self.mean(best):.4f} ± {self.half_width(best):.4f}"
+                )
+
+        return self.result()
+
+    def result(self):
+        """Get the estimated maximum.
+
+        Returns: Dictionary with the parameters of the best point as "params", its mean average flow as "flow", the
+        bounds of its confidence interval as "flow_low" and "flow_high", its mean cell density as "density", its
+        number of runs as "replicates", the number of runs of the search as "runs" and the number of points that are
+        still contenders for the maximum as "contenders".
+        """
+        best = self.best()
+        flow = self.mean(best)
+        half_width = self.half_width(best)
+        return {
+            "params": self.params(best),
+            "flow": flow,
+            "flow_low": flow - half_width,
+            "flow_high": flow + half_width,
+            "density": fmean(self.densities[best]),
+            "replicates": len(self.flows[best]),
+            "runs": self.runs,
+            "contenders": len(self.contenders()),
+        }
+
+    def points(self):
+        """Get the mean flow, its half-width, the mean density and the number of runs of every point.
+
+        Returns: List of dictionaries with the searched parameters and "flow", "half_width", "density" and "runs".
+        """
+        return [
+            {
+                **dict(zip(self.names, point)),
+                "flow": self.mean(point),
+                "half_width": self.half_width(point),
+                "density": fmean(self.densities[point]),
+                "runs": len(flows),
+            }
+            for point, flows in sorted(self.flows.items())
+        ]
+
+
+def main(argv=None):
+    """Entry point of the `cssm-maxflow` command."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        type=parse_param,
+        default=[],
+        metavar="NAME=VALUE[,VALUE...]",
+        help="values of a fixed TrafficModel parameter, each combination is searched separately",
+    )
+    parser.add_argument(
+        "--search",
+        action="append",
+        type=parse_bounds,
+        default=[],
+        metavar="NAME=LOW,HIGH",
+        help="bounds of a searched parameter, can be given multiple times (default: p_new_agents=0.05,1.0)",
+    )
+    parser.add_argument(
+        "--resolution",
+        action="append",
+        type=parse_param,
+        default=[],
+        metavar="NAME=VALUE",
+        help="smallest grid spacing of a searched parameter",
+    )
+    parser.add_argument(
+        "--initial-points", type=int, default=5, help="values per searched parameter at first"
+    )
+    parser.add_argument("--replicates", type=int, default=3, help="runs added to a point at once")
+    parser.add_argument(
+        "--precision",
+        type=float,
+        default=0.005,
+        help="half-width of the confidence interval of the mean flow of the contenders",
+    )
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level")
+    parser.add_argument(
+        "--max-runs", type=int, default=200, help="largest number of runs per search"
+    )
+    parser.add_argument("--max-steps", type=int, default=300, help="steps per run")
+    parser.add_argument("--from-step", type=int, default=100, help="first averaged step of a run")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first replicate")
+    parser.add_argument("--cache", help="directory of a run cache, see simulation.cache")
+    parser.add_argument("--processes", type=int, default=None, help="default: number of CPUs")
+    args = parser.parse_args(argv)
+
+    cache = RunCache(args.cache) if args.cache else None
+    bounds = dict(args.search) or None
+    resolution = {name: values[0] for name, values in args.resolution}
+    for fixed in make_grid(dict(args.param)):
+        search = MaxFlowSearch(
+            fixed,
+            bounds,
+            initial_points=args.initial_points,
+            replicates=args.replicates,
+            resolution=resolution,
+            precision=args.precision,
+            confidence=args.confidence,
+            max_steps=args.max_steps,
+            from_step=args.from_step,
+            max_runs=args.max_runs,
+            number_processes=args.processes,
+            cache=cache,
+            seed=args.seed,
+            display_progress=False,
+        )
+        result = search.run()
+        print(
+            f"{result['params']}: flow {result['flow']:.4f} "
+            f"[{result['flow_low']:.4f}, {result['flow_high']:.4f}], "
+            f"density {result['density']:.4f}, {result['runs']} runs"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,36 @@
-import mesa
-
-from enum import Enum
+from .base import Agent
+from enum import IntEnum
 
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from .model import TrafficModel
 
+# Unit vectors for each direction (indexed by `TrafficAgent.Direction`)
+DX = (0, 1, 0, -1)
+DY = (-1, 0, 1, 0)
+
 
-class TrafficAgent(mesa.Agent):
+class TrafficAgent(Agent):
     """The main traffic agents. It's either a car or a bike.
     It has a velocity which indicates the number of cells it's moving forward in the current step.
+
+    Agents have no instance dictionary and their type and direction are integer enums, which can be used as index
+    without looking up their value, because all these are accessed for every agent in every step.
     """
 
-    class Type(Enum):
+    class Type(IntEnum):
         CAR = 0
         BIKE = 1
 
-    class Direction(Enum):
+    class Direction(IntEnum):
         UP = 0
         RIGHT = 1
         DOWN = 2
         LEFT = 3
 
+    __slots__ = ("type", "direction", "velocity", "max_velocity", "__next_pos")
+
     model: "TrafficModel"
 
     def __init__(self, unique_id, model: "TrafficModel", type: Type, dir: Direction):
@@ -34,6 +42,15 @@ class TrafficAgent(mesa.Agent):
             dir: Direction in which the agents is moving.
         """
         super().__init__(unique_id, model)
+        self.initialize(type, dir)
+
+    def initialize(self, type: Type, dir: Direction):
+        """Set type and direction of the agent and stop it. Also used to reuse an agent that left the grid.
+
+        Args:
+            type: Type car or bike that the agent represents
+            dir: Direction in which the agents is moving.
+        """
         self.type = type
         self.direction = dir
         self.velocity = 0
@@ -53,22 +70,24 @@ class TrafficAgent(mesa.Agent):
         Calculate the velocity and position for the next move.
         """
 
+        previous_velocity = self.velocity
+
         # Rules of Nagel-Schreckenberg Model: https://en.wikipedia.org/wiki/Nagel%E2%80%93Schreckenberg_model#Outline_of_the_model
         # 1. Acceleration
         self.velocity = min(self.max_velocity, self.velocity + 1)
 
         # 2. Slow down
-        for i, pos in enumerate(self.get_neighborhood()):
-            if (
-                self.model.grid[pos] != None
-                or self.model.is_red_light(pos, self.direction)
-                or self.is_car_on_bike_box(pos)
-            ):
-                self.velocity = min(i, self.velocity)
-                break
+        gap = self.get_gap()
+        if gap is not None:
+            self.velocity = min(gap, self.velocity)
 
         # 3. Randomization
-        if self.random.random() < self.model.p_slow_down:
+        draws = self.model.slow_down_draws
+        if draws is None:
+            draw = self.random.random()
+        else:
+            draw = draws[self.unique_id]
+        if draw < self.model.p_slow_down:
             self.velocity -= 1
             self.velocity = max(self.velocity, 0)
 
@@ -95,6 +114,9 @@ class TrafficAgent(mesa.Agent):
             self.__next_pos = cell
             self.velocity = 1
 
+        # Keep the velocity sum of the model up to date for the metrics
+        self.model.velocity_sums[self.type] += self.velocity - previous_velocity
+
     def advance(self):
         """Advance the agent to the position that was calculated in the `step` method.
         Remove the agent from the scheduler and grid if the next position is outside the grid.
@@ -107,6 +129,9 @@ class TrafficAgent(mesa.Agent):
             # Remove agent if it's out of bounds.
             self.model.grid.remove_agent(self)
             self.model.schedule.remove(self)
+            self.model.vehicle_counts[self.type] -= 1
+            self.model.velocity_sums[self.type] -= self.velocity
+            self.model.agent_pool.append(self)
 
         elif self.model.grid.is_cell_empty(self.__next_pos):
             self.model.grid.move_agent(self, self.__next_pos)
@@ -115,23 +140,70 @@ class TrafficAgent(mesa.Agent):
             # Error: agent wants to move, but the destination cell is not empty -> the agent stays where it is
             pass
 
-    def get_neighborhood(self):
-        """Get index to up to `max_velocity` number of cells that are in front of the agent."""
-        neighborhood = list()
+    def get_gap(self):
+        """Get number of free cells in front of the agent before the next agent, red traffic light or bike box.
+        Only up to `max_velocity` cells are considered. The lookups use the lane indexes of the grid.
 
+        Returns: None if all these cells are free, otherwise the number of free cells.
+        """
         # If it's a car, look one cell further in order to compensate for the car's "main" cell being at the end of the vehicle.
         is_car = int(self.type == self.Type.CAR)
+        start = 1 + is_car
+        limit = self.max_velocity + is_car
+
+        distances = [
+            self.model.grid.distance_to_next_agent(self.pos, self.direction, start, limit),
+            self.model.distance_to_red_light(self.pos, self.direction, start, limit),
+        ]
+
+        # Cars are not allowed to enter the bike box in front of a red traffic light
+        if is_car and self.model.with_bike_box:
+            distance = self.model.distance_to_red_light(
+                self.pos, self.direction, start + 1, limit + 1
+            )
+            if distance is not None:
+                distances.append(distance - 1)
+
+        distances = [distance for distance in distances if distance is not None]
+        if len(distances) == 0:
+            return None
+        return min(distances) - start
 
-        # Return all positions of cells that are in front of the car in the direction of travel and that are inside the grid.
-        for i in range(1, self.max_velocity + 1):
-            pos = self.next_pos(i + is_car)
+    def get_blocker(self):
+        """Get what keeps the agent from moving in the next step, whatever the random slow down is. That's the case if
+        the cell directly in front is occupied or behind a red traffic light, so the gap is 0.
+        Used by `SleepingActivation` to skip standing agents until the blocker is gone.
 
-            if self.model.grid.out_of_bounds(pos):
-                break
+        Returns: The agent in front, True for a red traffic light or None if the agent might move.
+        """
+        model = self.model
+        is_car = self.type == self.Type.CAR
+
+        # Bikes in front of a stop line may move into or out of the bike box, even if they are blocked
+        if not is_car and model.with_bike_box:
+            pos = self.pos
+            if (
+                pos in model.bike_box_entries[self.direction]
+                or pos in model.bike_box_exits[self.direction]
+            ):
+                return None
+
+        # Cars look one cell further, see `get_gap`
+        start = 1 + is_car
+        front = self.next_pos(start)
+        if model.grid.out_of_bounds(front):
+            return None
 
-            neighborhood.append(pos)
+        agent = model.grid[front]
+        if agent is not None:
+            return agent
+        if model.is_red_light(front, self.direction):
+            return True
 
-        return neighborhood
+        # Cars are not allowed to enter the bike box in front of a red traffic light
+        if is_car and model.with_bike_box and model.is_red_light(self.next_pos(3), self.direction):
+            return True
+        return None
 
     def next_pos(self, step):
         """Calculate index of position `step` number of cells before the agent.
@@ -140,7 +212,8 @@ class TrafficAgent(mesa.Agent):
             steps: Number of cells to look forward.
         """
         x, y = self.pos
-        return (self.next_x(x, step), self.next_y(y, step))
+        direction = self.direction
+        return (x + DX[direction] * step, y + DY[direction] * step)
 
     def next_x(self, cur_x, step):
         """Calculate x coordinate from the position `step` number of cells before the agent.
@@ -170,7 +243,7 @@ class TrafficAgent(mesa.Agent):
 
     def should_fill_up_bike_box(self):
         """Checks whether the car stands one cell behind a red traffic light, the next cell is occupied by another bike
-        and whether there is an empty space in the bike box.
+        and whether there is an empty space in the bike box. The cells are looked up in `TrafficModel.bike_box_entries`.
 
         Returns: False if the conditions are not met. Otherwise, position of the next empty cell in the bike box.
         """
@@ -178,38 +251,31 @@ class TrafficAgent(mesa.Agent):
         if self.type != self.Type.BIKE or not self.model.with_bike_box:
             return False
 
-        # Is it in front of a red traffic light?
-        if not self.model.is_red_light(self.next_pos(2), self.direction):
+        # Is it on the main lane for bikes two cells before a stop line?
+        entry = self.model.bike_box_entries[self.direction].get(self.pos)
+        if entry is None:
             return False
 
-        # Is the agent already waiting and is an agent in front of it?
-        if self.velocity != 0 or self.model.grid.is_cell_empty(self.next_pos(1)):
+        # Is the traffic light red?
+        red_phase, front, bike_box = entry
+        if red_phase != self.model.light_phase:
             return False
 
-        # Is it on the main lane for bikes?
-        if not self.is_on_bike_lane():
+        # Is the agent already waiting and is an agent in front of it?
+        grid = self.model.grid
+        if self.velocity != 0 or grid.is_cell_empty(front):
             return False
 
-        # Has the bike box still place for another bike?
-        x, y = self.pos
-        if self.direction == self.Direction.UP:
-            bike_box = [(x - i, y - 1) for i in range(1, 3)]
-        elif self.direction == self.Direction.RIGHT:
-            bike_box = [(x + 1, y - i) for i in range(1, 3)]
-        elif self.direction == self.Direction.DOWN:
-            bike_box = [(x + i, y + 1) for i in range(1, 3)]
-        else:  # LEFT
-            bike_box = [(x - 1, y + i) for i in range(1, 3)]
-
-        # Return first empty cell
+        # Return first empty cell of the bike box, if it has still place for another bike
         for grid_cell in bike_box:
-            if self.model.grid[grid_cell[0]][grid_cell[1]] == None:
+            if grid[grid_cell] is None:
                 return grid_cell
 
         return False
 
     def should_empty_bike_box(self):
         """Checks whether the bike is standing in a bike box in front of a traffic light that has turned green.
+        The cells are looked up in `TrafficModel.bike_box_exits`.
 
         Returns: False if the conditions are not met. None if it's not the leftmost bike in the bike box.
         Otherwise, the position where the bike should move in the next move.
@@ -219,43 +285,20 @@ class TrafficAgent(mesa.Agent):
             return False
 
         # Is it in front of a green traffic light?
-        if self.model.is_red_light(self.next_pos(1), self.direction) in [True, None]:
+        bike_box_exit = self.model.bike_box_exits[self.direction].get(self.pos)
+        if bike_box_exit is None:
+            return False
+        red_phase, pos_left, target = bike_box_exit
+        if red_phase == self.model.light_phase:
             return False
-
-        # Is there no other bike to the left?
-        x, y = self.pos
-        if self.direction == self.Direction.UP:
-            pos_left = (x - 1, y)
-        elif self.direction == self.Direction.RIGHT:
-            pos_left = (x, y - 1)
-        elif self.direction == self.Direction.DOWN:
-            pos_left = (x + 1, y)
-        else:  # LEFT
-            pos_left = (x, y + 1)
 
         # If in the cell to its left is a bike, the current agent should not move
-        on_the_left = self.model.grid[pos_left[0]][pos_left[1]]
-        if on_the_left != None and on_the_left.type == self.Type.BIKE:
+        on_the_left = self.model.grid[pos_left]
+        if on_the_left is not None and on_the_left.type == self.Type.BIKE:
             return None
 
-        # Calculate difference to main lane position
-        if self.direction in [self.Direction.UP, self.Direction.DOWN]:
-            diff = self.pos[0]
-        else:
-            diff = self.pos[1]
-        diff = (diff - self.model.first_street) % (
-            self.model.street_width + self.model.distance_between_streets
-        )
-
         # Move leftmost bike to bike lane in front of the stop line
-        if self.direction == self.Direction.UP:
-            return (x + self.model.street_width - 1 - diff, y - 1)
-        elif self.direction == self.Direction.RIGHT:
-            return (x + 1, y + self.model.street_width - 1 - diff)
-        elif self.direction == self.Direction.DOWN:
-            return (x - diff, y + 1)
-        else:  # LEFT
-            return (x - 1, y - diff)
+        return target
 
     def is_on_bike_lane(self):
         """Check whether the current agent is on the bike lane."""
@@ -270,21 +313,3 @@ class TrafficAgent(mesa.Agent):
         # Check whether the agent is in the first or last lane of a street.
         block_size = self.model.street_width + self.model.distance_between_streets
         return (u % block_size) in [0, self.model.street_width - 1]
-
-    def is_car_on_bike_box(self, pos):
-        """Check whether the agent is a car and the given position is a bike box in front of a red traffic light.
-
-        Args:
-            pos: Position on the grid to check
-
-        Returns: False or None when the conditions are not met. True if the car is not allowed to enter the given position.
-        """
-        if self.type != self.Type.CAR or not self.model.with_bike_box:
-            return False
-
-        x, y = pos
-        bike_box_size = 1
-        return self.model.is_red_light(
-            (self.next_x(x, bike_box_size), self.next_y(y, bike_box_size)),
-            self.direction,
-        )
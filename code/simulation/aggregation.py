@@ -0,0 +1,182 @@
+"""Aggregation of the collected data of many runs while they finish.
+
+Instead of keeping every step of every run, `RunAggregator` keeps the running mean and variance of each metric at each
+step per parameter cell (Welford's algorithm) and the time average of each metric per run, which are the points of the
+flow-density plots. So its memory grows with the number of parameter cells and steps, not with runs × steps:
+
+    aggregator = RunAggregator(by=["bike_lane_config"], from_step=200)
+    aggregate_runs(TrafficModel, {"bike_lane_config": [0, 1, 2]}, aggregator, iterations=10, max_steps=500)
+    aggregator.step_dataframe()  # mean and std per bike_lane_config and step
+    aggregator.run_dataframe()  # time averages per run
+"""
+import numpy
+import pandas
+
+from .cache import RunCache, finished_runs
+
+
+class StepStatistics:
+    """Running count, mean and sum of squared deviations of some metrics at each step, updated with a whole run at
+    once. The arrays grow with the largest step that was added, steps that no run reached have a count of 0.
+    """
+
+    def __init__(self):
+        """Initialize the statistics without any runs."""
+        self.count = numpy.zeros(0, dtype=int)
+        self.mean = {}
+        self.m2 = {}
+
+    def grow(self, size: int):
+        """Extend all arrays to `size` steps."""
+        extra = size - len(self.count)
+        if extra <= 0:
+            return
+        self.count = numpy.concatenate([self.count, numpy.zeros(extra, dtype=int)])
+        for arrays in (self.mean, self.m2):
+            for name, values in arrays.items():
+                arrays[name] = numpy.concatenate([values, numpy.zeros(extra)])
+
+    def add(self, steps, columns: dict):
+        """Add the values of one run.
+
+        Args:
+            steps: Array of the distinct, non-negative steps of the run.
+            columns: Dictionary of metric names and arrays with one value per step.
+        """
+        steps = numpy.asarray(steps, dtype=int)
+        if len(steps) == 0:
+            return
+        self.grow(steps.max() + 1)
+        for name in columns:
+            if name not in self.mean:
+                self.mean[name] = numpy.zeros(len(self.count))
+                self.m2[name] = numpy.zeros(len(self.count))
+
+        count = self.count[steps] + 1
+        self.count[steps] = count
+        for name, values in columns.items():
+            values = numpy.asarray(values, dtype=float)
+            mean = self.mean[name]
+            delta = values - mean[steps]
+            mean[steps] += delta / count
+            self.m2[name][steps] += delta * (values - mean[steps])
+
+    def std(self, name: str):
+        """Get the sample standard deviation (ddof=1, like pandas) of a metric at each step. NaN with less than 2
+        runs.
+        """
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(
+                self.count > 1, numpy.sqrt(self.m2[name] / (self.count - 1)), numpy.nan
+            )
+
+
+class RunAggregator:
+    """Statistics of runs per parameter cell, see the module docstring.
+
+    A parameter cell is a combination of values of the parameters in `by`, so runs with different values of other
+    parameters and different seeds are pooled, like `groupby(by + ["Step"])` on the records of all runs.
+    """
+
+    def __init__(self, by: list, metrics: list = None, from_step: int = 0):
+        """Create an empty aggregator.
+
+        Args:
+            by: Names of the parameters that define a parameter cell.
+            metrics: Names of the metrics to aggregate. None = all columns of the runs except "Step".
+            from_step: First step of the time averages per run, e.g. to skip the warm up.
+        """
+        self.by = list(by)
+        self.metrics = metrics
+        self.from_step = from_step
+        self.cells = {}
+        self.runs = []
+
+    def add(self, params: dict, columns: dict, **info):
+        """Add a finished run.
+
+        Args:
+            params: Parameters of the run, which contain at least the ones in `by`.
+            columns: Dictionary with the steps as "Step" and one array per metric.
+            info: Other values that are stored with the time averages of the run, e.g. "RunId" and "iteration".
+        """
+        metrics = self.metrics
+        if metrics is None:
+            metrics = [name for name in columns if name != "Step"]
+        values = {name: numpy.asarray(columns[name], dtype=float) for name in metrics}
+        steps = numpy.asarray(columns["Step"], dtype=int)
+
+        cell = tuple(params[name] for name in self.by)
+        if cell not in self.cells:
+            self.cells[cell] = StepStatistics()
+        self.cells[cell].add(steps, values)
+
+        selected = steps >= self.from_step
+        averages = {
+            name: column[selected].mean() if selected.any() else numpy.nan
+            for name, column in values.items()
+        }
+        self.runs.append({**info, **params, **averages})
+
+    def step_dataframe(self):
+        """Get the statistics of each parameter cell and step that at least one run reached.
+
+        Returns: DataFrame indexed by the parameters in `by` and "Step" with the number of runs as "Runs" and the columns
+        "<metric> mean" and "<metric> std" of each metric.
+        """
+        frames = []
+        for cell, statistics in self.cells.items():
+            steps = numpy.flatnonzero(statistics.count)
+            data = {name: value for name, value in zip(self.by, cell)}
+            data["Step"] = steps
+            data["Runs"] = statistics.count[steps]
+            for name in statistics.mean:
+                data[f"{name} mean"] = statistics.mean[name][steps]
+                data[f"{name} std"] = statistics.std(name)[steps]
+            frames.append(pandas.DataFrame(data))
+
+        if not frames:
+            return pandas.DataFrame(columns=self.by + ["Step", "Runs"]).set_index(
+                self.by + ["Step"]
+            )
+        return pandas.concat(frames, ignore_index=True).set_index(self.by + ["Step"]).sort_index()
+
+    def run_dataframe(self):
+        """Get the time averages of the metrics from `from_step` on with the parameters and info of each run."""
+        return pandas.DataFrame(self.runs)
+
+
+def aggregate_runs(
+    model_cls,
+    parameters: dict,
+    aggregator: RunAggregator,
+    number_processes=1,
+    iterations=1,
+    max_steps=1000,
+    display_progress=True,
+    cache: RunCache = None,
+    seed=0,
+):
+    """Run all combinations of the parameters like `simulation.cache.batch_run` and add each run to the aggregator as
+    soon as it's finished, instead of returning the records of all runs. The steps are numbered like the records of
+    `batch_run`, i.e. from 0, and "RunId" and "iteration" are stored with the time averages.
+
+    Args:
+        aggregator: Aggregator of the runs. See `simulation.cache.batch_run` for the other arguments.
+
+    Returns: The aggregator.
+    """
+    for run_id, iteration, kwargs, run in finished_runs(
+        model_cls,
+        parameters,
+        number_processes,
+        iterations,
+        max_steps,
+        display_progress,
+        cache,
+        seed,
+    ):
+        columns = {name: column for name, column in run.items() if name != "Step"}
+        columns["Step"] = numpy.arange(len(run["Step"]))
+        aggregator.add(kwargs, columns, RunId=run_id, iteration=iteration)
+    return aggregator
@@ -0,0 +1,76 @@
+"""Base classes of the model and its agents with the same behavior as `mesa.Model` and `mesa.Agent`.
+
+Importing anything from mesa runs `mesa/__init__.py`, which also imports mesa's visualization server (tornado) and
+pandas. The simulation only needs these small base classes, so headless runs, e.g. the workers of a sweep, don't load
+the web stack. mesa's server, charts and `batch_run` work with any model that has this interface.
+"""
+import random
+
+
+class Model:
+    """Base class for models, like `mesa.Model` in Mesa 1.1."""
+
+    def __new__(cls, *args, **kwargs):
+        """Create a new model object and its random number generator from the `seed` keyword argument."""
+        obj = object.__new__(cls)
+        obj._seed = kwargs.get("seed", None)
+        obj.random = random.Random(obj._seed)
+        return obj
+
+    def __init__(self, *args, **kwargs):
+        """Initialize a running model without scheduler."""
+        self.running = True
+        self.schedule = None
+        self.current_id = 0
+
+    def run_model(self):
+        """Run the model until it stops."""
+        while self.running:
+            self.step()
+
+    def step(self):
+        """Simulate one step of the model."""
+
+    def next_id(self):
+        """Return the next unique id for agents."""
+        self.current_id += 1
+        return self.current_id
+
+    def reset_randomizer(self, seed: int = None):
+        """Reset the random number generator of the model.
+
+        Args:
+            seed: New seed, None = reset with the current seed.
+        """
+        if seed is None:
+            seed = self._seed
+        self.random.seed(seed)
+        self._seed = seed
+
+
+class Agent:
+    """Base class for agents, like `mesa.Agent` in Mesa 1.1, but without instance dictionary."""
+
+    __slots__ = ("unique_id", "model", "pos")
+
+    def __init__(self, unique_id: int, model: Model):
+        """Initialize an agent that is not placed on the grid yet.
+
+        Args:
+            unique_id: Unique id of the agent.
+            model: Model that contains the agent.
+        """
+        self.unique_id = unique_id
+        self.model = model
+        self.pos = None
+
+    def step(self):
+        """Stage the changes of the agent."""
+
+    def advance(self):
+        """Apply the staged changes of the agent."""
+
+    @property
+    def random(self):
+        """Random number generator of the model."""
+        return self.model.random
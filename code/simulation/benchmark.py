@@ -0,0 +1,341 @@
+"""Benchmark of the simulation throughput for a matrix of model parameters.
+
+Every case runs in a fresh process and is measured after a warm-up, so that the traffic has built up.
+The results are written to a JSON file together with the commit and the versions of Python and numpy, so that runs
+on different commits can be compared with `--compare`.
+
+Example:
+    cssm-benchmark -o benchmark.json -p engine=numpy --compare baseline.json
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy
+
+from pathlib import Path
+
+from .model import TrafficModel
+from .profiling import create_profiler
+from .sweep import make_grid, parse_param
+
+# Default matrix: all lane configs from free flow to gridlock for both engines and two city sizes
+DEFAULT_PARAMETERS = {
+    "engine": ["agents", "numpy"],
+    "bike_lane_config": [0, 1, 2],
+    "p_new_agents": [0.1, 0.3, 0.6, 1.0],
+    "number_of_streets": [5, 10],
+}
+
+# Modules that headless runs should not import, see `simulation.base`
+HEAVY_MODULES = ["mesa", "tornado", "pandas", "pyarrow"]
+
+# "none" = no data collection, "mesa" = mesa's DataCollector, "columnar" = `ColumnarDataCollector`
+COLLECT_MODES = ["none", "mesa", "columnar"]
+
+
+class NoDataCollector:
+    """Data collector that discards all data, to measure the simulation without data collection."""
+
+    def collect(self, model: TrafficModel):
+        """Ignore the current step."""
+
+
+def create_model(params: dict, collect: str, seed: int, steps: int, profile: bool):
+    """Create a model for a benchmark case with the data collection of `collect`."""
+    # mesa's DataCollector loads mesa's visualization server and pandas, see `simulation.base`
+    max_steps = None if collect == "mesa" else steps
+    model = TrafficModel(seed=seed, max_steps=max_steps, profile=profile, **params)
+    if collect == "none":
+        model.datacollector = NoDataCollector()
+    return model
+
+
+def peak_rss():
+    """Get the peak resident memory of this process in MB."""
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(task):
+    """Measure one case. Executed in a fresh process, see `run_in_process`.
+
+    Args:
+        task: Tuple of parameters, data collection mode, seed, number of warm-up steps, measured steps,
+            repetitions and whether to profile the phases of the step. Every repetition runs the same model from the
+            start and the fastest one is reported.
+
+    Returns: Record of the results.
+    """
+    params, collect, seed, warmup, steps, repeat, profile = task
+    baseline_rss = peak_rss()
+
+    seconds = float("inf")
+    for _ in range(repeat):
+        model = create_model(params, collect, seed, warmup + steps, profile)
+        for _ in range(warmup):
+            model.step()
+        model.profiler = create_profiler(profile)
+
+        vehicle_steps = 0
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.step()
+            vehicle_steps += sum(model.vehicle_counts)
+        elapsed = time.perf_counter() - start
+        if elapsed < seconds:
+            seconds = elapsed
+            phases = model.profiler.summary() if profile else None
+
+        # Free the model before the next repetition, it's part of reference cycles
+        del model
+        gc.collect()
+
+    record = {
+        "params": params,
+        "collect": collect,
+        "seconds": seconds,
+        "steps_per_second": steps / seconds,
+        "us_per_vehicle_step": 1e6 * seconds / max(vehicle_steps, 1),
+        "mean_vehicles": vehicle_steps / steps,
+        "peak_rss_mb": peak_rss(),
+        "model_rss_mb": peak_rss() - baseline_rss,
+    }
+    if profile:
+        record["profile"] = phases
+    return record
+
+
+def send_case(connection, task):
+    """Send the record of `run_case` or the exception that it raised to the benchmark. Executed in a fresh process."""
+    try:
+        connection.send(run_case(task))
+    except Exception as error:
+        connection.send(error)
+    connection.close()
+
+
+def run_in_process(task):
+    """Measure one case in a fresh process, so that the peak memory of one case doesn't include the previous ones.
+
+    Returns: Record of `run_case`.
+    """
+    connection, worker_connection = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=send_case, args=(worker_connection, task))
+    process.start()
+    worker_connection.close()
+    try:
+        record = connection.recv()
+    except EOFError:
+        raise RuntimeError(f"Benchmark process exited with code {process.exitcode}") from None
+    finally:
+        process.join()
+    if isinstance(record, Exception):
+        raise record
+    return record
+
+
+def measure_startup(repeat=5):
+    """Measure how long a fresh Python process takes to import the model, e.g. a spawned worker of a sweep.
+
+    Args:
+        repeat: Number of processes, the fastest one is reported.
+
+    Returns: Dictionary with the time to start Python, the additional time to import `simulation.model` and the heavy
+    modules that the import loaded.
+    """
+    root = Path(__file__).resolve().parent.parent
+    script = (
+        "import json, sys, simulation.model;"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+
+    def fastest(args):
+        seconds = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = subprocess.run(args, cwd=root, capture_output=True, text=True, check=True)
+            seconds = min(seconds, time.perf_counter() - start)
+        return seconds, result.stdout
+
+    interpreter_seconds, _ = fastest([sys.executable, "-c", "pass"])
+    seconds, output = fastest([sys.executable, "-c", script])
+    return {
+        "interpreter_seconds": interpreter_seconds,
+        "import_seconds": seconds - interpreter_seconds,
+        "loaded_modules": json.loads(output),
+    }
+
+
+def case_key(record: dict):
+    """Get a key that identifies a case across benchmark files."""
+    return json.dumps({"params": record["params"], "collect": record["collect"]}, sort_keys=True)
+
+
+def get_commit():
+    """Get the hash of the checked out commit with the suffix "-dirty" if there are uncommitted changes.
+
+    Returns: None outside of a git repository.
+    """
+    try:
+        result = subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def benchmark(
+    parameters: dict,
+    collect=("none", "columnar"),
+    seed=0,
+    warmup=100,
+    steps=200,
+    repeat=1,
+    profile=False,
+):
+    """Measure all combinations of the parameters and data collection modes.
+
+    Args:
+        parameters: Dictionary of `TrafficModel` parameter names and lists of values.
+        collect: Data collection modes, see `COLLECT_MODES`.
+        seed: Seed of every case, so that all cases with the same parameters do the same work.
+        warmup: Number of steps before the measurement.
+        steps: Number of measured steps.
+        repeat: Number of repetitions of each case, the fastest one is reported.
+        profile: Record the time of each phase of the measured steps, see `StepProfiler`. The timing itself slows
+            down the agents engine.
+
+    Returns: Dictionary with the environment, the settings, the startup time and one record per case.
+    """
+    invalid = [mode for mode in collect if mode not in COLLECT_MODES]
+    if invalid:
+        raise ValueError(f"Unknown data collection modes: {', '.join(invalid)}")
+
+    tasks = [
+        (params, mode, seed, warmup, steps, repeat, profile)
+        for params in make_grid(parameters)
+        for mode in collect
+    ]
+    startup = measure_startup()
+    print(
+        f"Import of simulation.model: {1000 * startup['import_seconds']:.0f} ms"
+        f" (heavy modules: {', '.join(startup['loaded_modules']) or 'none'})"
+    )
+
+    results = []
+    for done, task in enumerate(tasks, 1):
+        record = run_in_process(task)
+        results.append(record)
+        print(
+            f"[{done}/{len(tasks)}] {record['params']} collect={record['collect']}:"
+            f" {record['steps_per_second']:.1f} steps/s,"
+            f" {record['us_per_vehicle_step']:.2f} us/vehicle-step,"
+            f" {record['peak_rss_mb']:.0f} MB"
+        )
+
+    return {
+        "commit": get_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": platform.machine(),
+        "seed": seed,
+        "warmup": warmup,
+        "steps": steps,
+        "repeat": repeat,
+        "profile": profile,
+        "startup": startup,
+        "results": results,
+    }
+
+
+def compare(results: dict, baseline: dict):
+    """Print the speedup of each case over the same case in a baseline file.
+
+    Args:
+        results: Results of `benchmark`.
+        baseline: Results of an earlier benchmark.
+    """
+    baseline_cases = {case_key(record): record for record in baseline["results"]}
+    common = [
+        (record, baseline_cases[case_key(record)])
+        for record in results["results"]
+        if case_key(record) in baseline_cases
+    ]
+    if not common:
+        print("No common cases with the baseline")
+        return
+
+    print(f"Compared to {baseline.get('commit') or 'baseline'}:")
+    if "startup" in baseline:
+        old, new = baseline["startup"]["import_seconds"], results["startup"]["import_seconds"]
+        print(f"  import of simulation.model: {1000 * old:.0f} ms -> {1000 * new:.0f} ms")
+    for record, old in common:
+        speedup = record["steps_per_second"] / old["steps_per_second"]
+        memory = record["peak_rss_mb"] - old["peak_rss_mb"]
+        print(
+            f"  {record['params']} collect={record['collect']}:"
+            f" {speedup:.2f}x steps/s, {memory:+.0f} MB peak memory"
+        )
+
+
+def main(argv=None):
+    """Entry point of the `cssm-benchmark` command."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", required=True, help="JSON file of the results")
+    parser.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        type=parse_param,
+        default=[],
+        metavar="NAME=VALUE[,VALUE...]",
+        help="values of a TrafficModel parameter, replaces the default values of this parameter",
+    )
+    parser.add_argument(
+        "--collect",
+        type=lambda value: value.split(","),
+        default=["none", "columnar"],
+        metavar="MODE[,MODE...]",
+        help=f"data collection modes: {', '.join(COLLECT_MODES)} (default: none,columnar)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of all cases")
+    parser.add_argument("--warmup", type=int, default=100, help="steps before the measurement")
+    parser.add_argument("--steps", type=int, default=200, help="measured steps per case")
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="runs per case, the fastest one is reported"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="record the time of each phase of the step"
+    )
+    parser.add_argument("--compare", help="JSON file of an earlier benchmark to compare with")
+    args = parser.parse_args(argv)
+
+    parameters = {**DEFAULT_PARAMETERS, **dict(args.param)}
+    results = benchmark(
+        parameters,
+        collect=args.collect,
+        seed=args.seed,
+        warmup=args.warmup,
+        steps=args.steps,
+        repeat=args.repeat,
+        profile=args.profile,
+    )
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
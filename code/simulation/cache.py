@@ -0,0 +1,348 @@
+"""Cache of the collected data of finished runs on the local disk.
+
+A run is identified by a hash of the `TrafficModel` parameters, the seed, the run options and a fingerprint of the
+source code of the modules that determine the results, so any change to the model invalidates the cached runs, but
+changes to e.g. the web server or the benchmark don't. Each run is stored as `.npz`
+file with one column per model reporter. When the cache grows larger than its size limit, the least recently used
+runs are removed.
+
+`batch_run` is a version of mesa's `batch_run` that only computes the runs that are not in the cache yet, e.g. the new
+points when a parameter grid is extended:
+
+    cache = RunCache("run_cache")
+    results = batch_run(TrafficModel, {"bike_lane_config": [0, 1, 2]}, iterations=10, max_steps=500, cache=cache)
+
+`finished_runs` and `computed_runs` yield the runs one by one instead, e.g. for the streaming statistics of `simulation.aggregation`.
+"""
+import hashlib
+import itertools
+import json
+import multiprocessing
+import numpy
+import os
+
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+# Default size limit of a cache, a run of 500 steps takes about 30 KB
+DEFAULT_MAX_BYTES = 512 * 1024**2
+
+# Modules of the simulation package that determine the collected data of a run
+RESULT_MODULES = [
+    "agents",
+    "base",
+    "convergence",
+    "datacollection",
+    "metrics",
+    "model",
+    "schedule",
+    "space",
+    "streams",
+    "vectorized",
+]
+
+
+@lru_cache
+def source_fingerprint():
+    """Get a hash of the source files of the `RESULT_MODULES`."""
+    digest = hashlib.sha256()
+    for name in RESULT_MODULES:
+        path = Path(__file__).parent / f"{name}.py"
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def to_json(value):
+    """Convert numpy scalars, e.g. the values of `numpy.arange`, for `json.dumps`."""
+    if isinstance(value, numpy.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class RunCache:
+    """Directory of the collected data of finished runs with a size limit."""
+
+    def __init__(self, directory, max_bytes: int = DEFAULT_MAX_BYTES):
+        """Open or create a cache.
+
+        Args:
+            directory: Directory of the cached runs.
+            max_bytes: Size limit of all cached runs, the least recently used ones are removed beyond it.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        # Size of each cached run, from the least to the most recently used one, and their total size. The directory
+        # is only scanned here, so runs that other processes add later are not counted until the cache is reopened.
+        self.sizes = OrderedDict()
+        self.size = 0
+        files = []
+        for path in self.directory.glob("*.npz"):
+            if path.name.endswith(".tmp.npz"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, file_size in sorted(files):
+            self.sizes[key] = file_size
+            self.size += file_size
+
+    def key(self, params: dict, seed: int, options: dict):
+        """Get the key of a run.
+
+        Args:
+            params: Parameters of `TrafficModel`.
+            seed: Seed of the run.
+            options: Other settings that change the results, e.g. the number of steps.
+        """
+        data = json.dumps(
+            {"params": params, "seed": seed, "options": options, "source": source_fingerprint()},
+            sort_keys=True,
+            default=to_json,
+        )
+        return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+    def path(self, key: str):
+        """Get the file of a run."""
+        return self.directory / f"{key}.npz"
+
+    def get(self, key: str):
+        """Load a run and mark it as recently used.
+
+        Returns: Dictionary of column names and arrays. None if the run is not in the cache.
+        """
+        path = self.path(key)
+        try:
+            with numpy.load(path) as data:
+                columns = {name: data[name] for name in data.files}
+            os.utime(path)
+        except FileNotFoundError:
+            self.size -= self.sizes.pop(key, 0)
+            return None
+        if key in self.sizes:
+            self.sizes.move_to_end(key)
+        return columns
+
+    def put(self, key: str, columns: dict):
+        """Store a run and remove the least recently used runs if the cache is too large.
+
+        Args:
+            key: Key of the run, see `key`.
+            columns: Dictionary of column names and arrays.
+        """
+        # Write into a temporary file first, so that a killed process never leaves a partial run behind
+        tmp = self.directory / f"{key}.tmp.npz"
+        numpy.savez(tmp, **columns)
+        path = self.path(key)
+        os.replace(tmp, path)
+
+        file_size = path.stat().st_size
+        self.size += file_size - self.sizes.pop(key, 0)
+        self.sizes[key] = file_size
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used runs until the cache fits into its size limit."""
+        while self.size > self.max_bytes and self.sizes:
+            key, file_size = self.sizes.popitem(last=False)
+            self.path(key).unlink(missing_ok=True)
+            self.size -= file_size
+
+
+def make_model_kwargs(parameters: dict):
+    """Create all combinations of the parameter values like mesa's `batch_run`. Strings and other values that are not
+    iterable are single values.
+
+    Returns: List of dictionaries with one value per parameter.
+    """
+    values = []
+    for name, value in parameters.items():
+        if isinstance(value, str):
+            values.append([(name, value)])
+            continue
+        try:
+            values.append([(name, v) for v in value])
+        except TypeError:
+            values.append([(name, value)])
+    return [dict(kwargs) for kwargs in itertools.product(*values)]
+
+
+def run_columns(task):
+    """Run the model and get its collected data. Executed in a worker.
+
+    Args:
+        task: Tuple of model class, parameters, seed and number of steps.
+
+    Returns: Dictionary with the step numbers as "Step" and one array per model reporter.
+    """
+    model_cls, kwargs, seed, steps = task
+    model = model_cls(seed=seed, max_steps=steps, **kwargs)
+    model.run_model()
+    datacollector = model.datacollector
+    return {"Step": datacollector.get_steps(), **datacollector.model_vars}
+
+
+def run_indexed(task):
+    """Run the model of a task that starts with its index, see `run_columns`. Executed in a worker.
+
+    Returns: Tuple of the index and the collected data.
+    """
+    index, task = task
+    return index, run_columns(task)
+
+
+def computed_runs(
+    model_cls,
+    runs: list,
+    number_processes=1,
+    max_steps=1000,
+    display_progress=True,
+    cache: RunCache = None,
+):
+    """Load or compute the given runs and yield each run as soon as it's loaded from the cache or finished, so that
+    the caller only needs to hold one run at a time. See `batch_run` for the other arguments.
+
+    Args:
+        runs: List of tuples of parameters and seed of each run.
+
+    Yields: Tuples of the index of the run in `runs` and its collected data (see `run_columns`). The cached runs come
+    first, the others in the order in which they finish.
+    """
+    # mesa's batch_run steps while `model.schedule.steps <= max_steps`
+    steps = max_steps + 1
+    options = {"model": f"{model_cls.__module__}.{model_cls.__qualname__}", "max_steps": steps}
+
+    keys = [None] * len(runs)
+    cached = []
+    if cache is not None:
+        for i, (kwargs, seed) in enumerate(runs):
+            keys[i] = cache.key(kwargs, seed, options)
+            if cache.path(keys[i]).exists():
+                cached.append(i)
+
+    missing = sorted(set(range(len(runs))) - set(cached))
+    if display_progress:
+        print(f"{len(cached)} of {len(runs)} runs cached, {len(missing)} to run")
+
+    for i in cached:
+        run = cache.get(keys[i])
+        if run is None:
+            # Removed by another process in the meantime
+            missing.append(i)
+            continue
+        yield i, run
+
+    if missing:
+        tasks = [(i, (model_cls, runs[i][0], runs[i][1], steps)) for i in missing]
+        with multiprocessing.Pool(number_processes) as pool:
+            for done, (i, run) in enumerate(pool.imap_unordered(run_indexed, tasks), 1):
+                if cache is not None:
+                    cache.put(keys[i], run)
+                if display_progress:
+                    print(f"[{done}/{len(missing)}]", end="\r")
+                yield i, run
+        if display_progress:
+            print()
+
+
+def finished_runs(
+    model_cls,
+    parameters: dict,
+    number_processes=1,
+    iterations=1,
+    max_steps=1000,
+    display_progress=True,
+    cache: RunCache = None,
+    seed=0,
+):
+    """Run all combinations of the parameters and yield each run as soon as it's loaded from the cache or finished.
+    See `batch_run` for the arguments.
+
+    Yields: Tuples of run id, iteration, parameters and the collected data (see `run_columns`). The cached runs come
+    first, the others in the order in which they finish.
+    """
+    if "seed" in parameters:
+        raise ValueError("The seeds of the runs are set by the seed argument")
+
+    runs = [
+        (iteration, kwargs)
+        for iteration in range(iterations)
+        for kwargs in make_model_kwargs(parameters)
+    ]
+    tasks = [(kwargs, seed + iteration) for iteration, kwargs in runs]
+    for i, run in computed_runs(
+        model_cls, tasks, number_processes, max_steps, display_progress, cache
+    ):
+        yield i, runs[i][0], runs[i][1], run
+
+
+def batch_run(
+    model_cls,
+    parameters: dict,
+    number_processes=1,
+    iterations=1,
+    data_collection_period=-1,
+    max_steps=1000,
+    display_progress=True,
+    cache: RunCache = None,
+    seed=0,
+):
+    """Run all combinations of the parameters like mesa's `batch_run` and return the same records.
+
+    In contrast to mesa, iteration `i` of each parameter combination uses the seed `seed + i`, so each run can be
+    taken from the cache. The data is collected in columns, so all values of the model reporters are floats.
+
+    Args:
+        model_cls: `TrafficModel` or a subclass of it.
+        parameters: Dictionary of parameter names and single values or lists of values.
+        number_processes: Number of worker processes for the runs that are not cached. None = number of CPUs.
+        iterations: Number of runs per parameter combination.
+        data_collection_period: Return every n-th step of each run, -1 = only the last step.
+        max_steps: Like mesa, each run stops after `max_steps + 1` steps.
+        display_progress: Print the number of cached and finished runs.
+        cache: Cache of the runs. None = compute every run.
+        seed: Seed of the first iteration.
+
+    Returns: List of dictionaries with "RunId", "iteration", "Step", the parameters and the values of the model
+    reporters for each returned step of each run.
+    """
+    runs = {}
+    for run_id, iteration, kwargs, run in finished_runs(
+        model_cls,
+        parameters,
+        number_processes,
+        iterations,
+        max_steps,
+        display_progress,
+        cache,
+        seed,
+    ):
+        runs[run_id] = (iteration, kwargs, run)
+
+    results = []
+    for run_id, (iteration, kwargs, run) in sorted(runs.items()):
+        length = len(run["Step"])
+        if data_collection_period > 0:
+            indexes = list(range(0, length, data_collection_period))
+        else:
+            indexes = []
+        if not indexes or indexes[-1] != length - 1:
+            indexes.append(length - 1)
+
+        values = {name: column.tolist() for name, column in run.items() if name != "Step"}
+        for index in indexes:
+            results.append(
+                {
+                    "RunId": run_id,
+                    "iteration": iteration,
+                    "Step": index,
+                    **kwargs,
+                    **{name: column[index] for name, column in values.items()},
+                }
+            )
+    return results
@@ -0,0 +1,124 @@
+from collections import deque
+from statistics import NormalDist, fmean, stdev
+
+from .metrics import model_reporters
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .model import TrafficModel
+
+
+class SteadyStateMonitor:
+    """Detects when the metrics of a run have settled and when their mean is estimated precisely enough.
+
+    The warm-up ends as soon as the means of the last two windows of each metric differ by less than `tolerance`.
+    Afterwards, the steady state mean of each metric is estimated with the method of batch means, with one batch per
+    window. The run can stop when the confidence interval of every estimate is narrower than `precision`.
+    Runs that never settle, e.g. in gridlock, never converge and run until they are stopped otherwise.
+    """
+
+    def __init__(
+        self,
+        metrics=("Average flow", "Cell density"),
+        window: int = 50,
+        tolerance: float = 0.05,
+        precision: float = 0.02,
+        confidence: float = 0.95,
+        min_batches: int = 5,
+    ):
+        """Initialize the monitor.
+
+        Args:
+            metrics: Names of the model reporters that are monitored.
+            window: Number of steps per window and per batch.
+            tolerance: Largest relative difference of the means of two consecutive windows at the end of the warm-up.
+            precision: Largest relative half-width of the confidence interval of the means at convergence.
+            confidence: Confidence level of the confidence interval.
+            min_batches: Smallest number of batches after the warm-up before the run can converge.
+        """
+        self.metrics = list(metrics)
+        self.window = window
+        self.tolerance = tolerance
+        self.precision = precision
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.min_batches = min_batches
+
+        # First step after the warm-up and step at which the estimates reached the requested precision
+        self.warmup_end = None
+        self.converged_step = None
+
+        self.values = {name: deque(maxlen=2 * window) for name in self.metrics}
+        self.batch_means = {name: [] for name in self.metrics}
+        self.batch_length = 0
+
+    def update(self, model: "TrafficModel"):
+        """Add the current values of the metrics.
+
+        Args:
+            model: Reference to our Traffic model
+
+        Returns: Whether the estimates have converged.
+        """
+        if self.converged_step is not None:
+            return True
+
+        for name in self.metrics:
+            self.values[name].append(model_reporters[name](model))
+
+        if self.warmup_end is None:
+            if self.is_settled():
+                self.warmup_end = model.schedule.steps + 1
+                for values in self.values.values():
+                    values.clear()
+            return False
+
+        self.batch_length += 1
+        if self.batch_length < self.window:
+            return False
+
+        # Close the current batch
+        self.batch_length = 0
+        for name in self.metrics:
+            self.batch_means[name].append(fmean(list(self.values[name])[-self.window :]))
+
+        if all(
+            self.half_width(name) <= self.precision * abs(self.mean(name)) for name in self.metrics
+        ):
+            self.converged_step = model.schedule.steps
+            return True
+        return False
+
+    def is_settled(self):
+        """Check whether the means of the last two windows are close enough for all metrics."""
+        for values in self.values.values():
+            if len(values) < 2 * self.window:
+                return False
+            values = list(values)
+            previous = fmean(values[: self.window])
+            current = fmean(values[self.window :])
+            if abs(current - previous) > self.tolerance * max(abs(current), abs(previous)):
+                return False
+        return True
+
+    def mean(self, name):
+        """Get the estimated steady state mean of a metric or None during the warm-up."""
+        if len(self.batch_means[name]) == 0:
+            return None
+        return fmean(self.batch_means[name])
+
+    def half_width(self, name):
+        """Get the half-width of the confidence interval of the mean of a metric.
+
+        Returns: Infinity if there are not enough batches yet.
+        """
+        batch_means = self.batch_means[name]
+        if len(batch_means) < max(self.min_batches, 2):
+            return float("inf")
+        return self.z * stdev(batch_means) / len(batch_means) ** 0.5
+
+    def estimates(self):
+        """Get the estimated mean and half-width of the confidence interval of each metric."""
+        return {
+            name: {"mean": self.mean(name), "half_width": self.half_width(name)}
+            for name in self.metrics
+        }
@@ -0,0 +1,124 @@
+import numpy
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .model import TrafficModel
+
+
+class ColumnarDataCollector:
+    """Data collector that stores the value of each model reporter in a preallocated numpy column.
+    In contrast to mesa's DataCollector, no Python objects are created per step and the data can be exported
+    directly to Parquet or `.npz` files.
+    """
+
+    def __init__(self, model_reporters, max_steps, start_step=0, window=None):
+        """Initialize empty columns.
+
+        Args:
+            model_reporters: Dictionary of reporter names and functions that take the model as argument.
+            max_steps: Number of steps for which the columns are preallocated. The columns grow if more steps are collected.
+            start_step: First step that is collected. Earlier calls of `collect` are ignored, e.g. during warm-up.
+            window: Keep only the values of the last `window` collected steps, so that the memory doesn't grow with
+                the steps of a model that runs until it's stopped. The columns are preallocated for twice as many
+                steps instead of `max_steps`. None = keep all steps.
+        """
+        self.model_reporters = model_reporters
+        self.start_step = start_step
+        self.window = window
+        self.length = 0
+
+        # Number of steps that were collected, including the ones that are no longer in the window
+        self.collected = 0
+
+        if window is None:
+            capacity = max(max_steps - start_step + 1, 1)
+        else:
+            capacity = 2 * max(window, 1)
+        self.steps = numpy.zeros(capacity, dtype=numpy.int64)
+        self.columns = {name: numpy.zeros(capacity) for name in model_reporters}
+
+    def __len__(self):
+        """Return the number of collected steps that are kept."""
+        return self.length - self.first
+
+    @property
+    def first(self):
+        """Row of the first kept step in the columns."""
+        if self.window is None:
+            return 0
+        return max(self.length - self.window, 0)
+
+    def collect(self, model: "TrafficModel"):
+        """Collect the values of all model reporters for the current step.
+
+        Args:
+            model: Reference to our Traffic model
+        """
+        step = model.schedule.steps
+        if step < self.start_step:
+            return
+
+        if self.length == len(self.steps):
+            if self.window is None:
+                self.grow()
+            else:
+                self.drop_old()
+
+        self.steps[self.length] = step
+        for name, reporter in self.model_reporters.items():
+            self.columns[name][self.length] = reporter(model)
+        self.length += 1
+        self.collected += 1
+
+    def grow(self):
+        """Double the capacity of all columns."""
+        capacity = 2 * len(self.steps)
+        self.steps = numpy.resize(self.steps, capacity)
+        self.columns = {
+            name: numpy.resize(column, capacity) for name, column in self.columns.items()
+        }
+
+    def drop_old(self):
+        """Move the last `window - 1` steps to the beginning of the columns to make room for the next step."""
+        keep = max(self.window - 1, 0)
+        start = self.length - keep
+        self.steps[:keep] = self.steps[start : self.length]
+        for column in self.columns.values():
+            column[:keep] = column[start : self.length]
+        self.length = keep
+
+    @property
+    def model_vars(self):
+        """Collected values of each reporter, like mesa's `DataCollector.model_vars`."""
+        return {name: column[self.first : self.length] for name, column in self.columns.items()}
+
+    def get_steps(self):
+        """Get the step numbers of the collected values."""
+        return self.steps[self.first : self.length]
+
+    def get_model_vars_dataframe(self):
+        """Create a pandas DataFrame of all collected values with the step as index."""
+        import pandas
+
+        return pandas.DataFrame(self.model_vars, index=pandas.Index(self.get_steps(), name="Step"))
+
+    def to_npz(self, path):
+        """Save all columns into an uncompressed `.npz` file. The step numbers are stored as "Step".
+
+        Args:
+            path: Path of the file.
+        """
+        numpy.savez(path, Step=self.get_steps(), **self.model_vars)
+
+    def to_parquet(self, path):
+        """Save all columns into a Parquet file. The step numbers are stored as "Step".
+
+        Args:
+            path: Path of the file.
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.table({"Step": self.get_steps(), **self.model_vars})
+        pyarrow.parquet.write_table(table, path)
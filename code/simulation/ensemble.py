@@ -0,0 +1,191 @@
+import numpy
+
+from .agents import TrafficAgent
+from .model import TrafficModel
+from .streams import SLOW_DOWN
+from .vectorized import VectorizedTraffic
+
+# Parameters of `TrafficModel` that are set by the ensemble
+ENSEMBLE_PARAMETERS = ["seed", "engine", "steady_state", "profile", "record"]
+
+
+class EnsembleTraffic(VectorizedTraffic):
+    """Vehicles of multiple replicates of the same model stored in one set of arrays.
+    Each vehicle belongs to one replicate and each replicate has its own grid in the occupancy array, so all replicates
+    are staged and advanced at once. Vehicles are sorted by replicate and by id within each replicate.
+    """
+
+    def __init__(self, models: list):
+        """Take over the vehicles of the models, which must have the same parameters and use the numpy engine.
+
+        Args:
+            models: Replicates of the model. Their own vehicles are removed.
+        """
+        vehicles = [model.vectorized for model in models]
+        self.model = models[0]
+        self.models = models
+        self.rngs = [traffic.rng for traffic in vehicles]
+        self.column_index = vehicles[0].column_index
+        self.row_index = vehicles[0].row_index
+
+        # Number of cells of the grid of each replicate
+        self.cells = len(vehicles[0].occupancy)
+        self.occupancy = numpy.full(len(models) * self.cells, -1, dtype=numpy.int32)
+
+        for name in ["id", "x", "y", "velocity", "type", "direction"]:
+            setattr(self, name, numpy.concatenate([getattr(traffic, name) for traffic in vehicles]))
+        self.replicate = numpy.repeat(
+            numpy.arange(len(models)), [len(traffic) for traffic in vehicles]
+        )
+        self.rebuild_occupancy()
+
+        for model in models:
+            model.vectorized = None
+
+    def step(self):
+        """Stage the movement of all vehicles and apply it afterwards.
+        Each replicate draws the random numbers of its vehicles from its own generator.
+        """
+        self.velocity, next_x, next_y, moving = self.stage(self.draw_slow_down())
+        self.advance(next_x, next_y, moving)
+        self.update_counters()
+
+    def draw_slow_down(self):
+        """Draw which vehicles randomly slow down in this step, see `VectorizedTraffic.draw_slow_down`."""
+        counts = numpy.bincount(self.replicate, minlength=len(self.models))
+        if self.model.streams is None:
+            draws = [rng.random(count) for rng, count in zip(self.rngs, counts)]
+        else:
+            ids = numpy.split(self.id, numpy.cumsum(counts)[:-1])
+            draws = [
+                model.streams.randoms(model.schedule.steps, SLOW_DOWN, model_ids)
+                for model, model_ids in zip(self.models, ids)
+            ]
+        return numpy.concatenate(draws) < self.model.p_slow_down
+
+    def create_agents(self, probability):
+        """Create vehicles at each end of each road of each replicate with the given probability.
+
+        Args:
+            probability: How likely it is at each end of each road that a new vehicle is created.
+        """
+        drawn = [
+            self.draw_vehicles(model, rng, probability)
+            for model, rng in zip(self.models, self.rngs)
+        ]
+        ids, x, y, type, direction = (numpy.concatenate(arrays) for arrays in zip(*drawn))
+        replicate = numpy.repeat(numpy.arange(len(self.models)), [len(d[0]) for d in drawn])
+
+        # Add vehicle if its cells are empty
+        free = self.is_free(x, y, type, direction, replicate * self.cells)
+        self.append(ids[free], x[free], y[free], type[free], direction[free])
+        self.replicate = numpy.concatenate((self.replicate, replicate[free]))
+
+        # New vehicles have the largest ids of their replicate, so sorting by replicate restores the order
+        order = numpy.argsort(self.replicate, kind="stable")
+        for name in ["id", "x", "y", "velocity", "type", "direction", "replicate"]:
+            setattr(self, name, getattr(self, name)[order])
+
+        # The grid only gains vehicles, so writing all occupied cells is enough to update it
+        self.occupancy[self.cell_index(self.x, self.y, self.cell_base())] = numpy.arange(len(self))
+        self.update_counters()
+
+    def update_counters(self):
+        """Update number of vehicles and sum of their velocities per type of each replicate."""
+        types = len(TrafficAgent.Type)
+        bins = self.replicate * types + self.type
+        size = len(self.models) * types
+        counts = numpy.bincount(bins, minlength=size).reshape(-1, types).tolist()
+        sums = numpy.bincount(bins, weights=self.velocity, minlength=size).astype(int)
+        for model, count, velocity_sum in zip(
+            self.models, counts, sums.reshape(-1, types).tolist()
+        ):
+            model.vehicle_counts = count
+            model.velocity_sums = velocity_sum
+
+    def keep(self, mask):
+        """Keep only the vehicles of the given mask and rebuild the occupancy grid.
+
+        Args:
+            mask: Boolean mask over all vehicles.
+        """
+        self.replicate = self.replicate[mask]
+        super().keep(mask)
+
+    def cell_base(self, index=slice(None)):
+        """Get the offset of the grid of the replicate of the given vehicles in the occupancy array."""
+        return self.replicate[index] * self.cells
+
+
+class TrafficEnsemble:
+    """Multiple replicates of a `TrafficModel` with the numpy engine, which are stepped together.
+
+    All vehicles of all replicates are moved at once by `EnsembleTraffic`, so the overhead per step is paid once for
+    the ensemble instead of once per replicate. Replicate `i` uses the seed `seed + i` and has the same results as
+    `TrafficModel(seed=seed + i, engine="numpy", **params)`.
+
+    The replicates are `TrafficModel` instances without vehicles of their own, which hold the parameters, counters,
+    traffic lights and collected data of each replicate.
+    """
+
+    def __init__(self, n: int, seed: int = None, **params):
+        """Create the replicates.
+
+        Args:
+            n: Number of replicates.
+            seed: Seed of the first replicate. The other replicates use the following seeds. None = random seeds.
+            **params: Parameters of `TrafficModel`, except for engine, steady_state, profile and record. All
+                replicates stop after the same number of steps, so runs can't stop at a steady state. The vehicles
+                are stored in the ensemble instead of the replicates, so they can't be recorded.
+        """
+        invalid = [name for name in params if name in ENSEMBLE_PARAMETERS]
+        if invalid:
+            raise ValueError(f"Parameters can't be set for an ensemble: {', '.join(invalid)}")
+        if n < 1:
+            raise ValueError("An ensemble needs at least one replicate")
+
+        self.models = [
+            TrafficModel(seed=None if seed is None else seed + i, engine="numpy", **params)
+            for i in range(n)
+        ]
+        self.vehicles = EnsembleTraffic(self.models)
+        self.running = True
+
+    def __len__(self):
+        """Return the number of replicates."""
+        return len(self.models)
+
+    def step(self):
+        """Simulate one step of all replicates. See `TrafficModel.step`."""
+        self.vehicles.step()
+        for model in self.models:
+            model.schedule.step()
+
+        self.vehicles.create_agents(self.models[0].p_new_agents)
+
+        for model in self.models:
+            model.end_step()
+        self.running = all(model.running for model in self.models)
+
+    def run_model(self):
+        """Run all replicates until they stop, which requires `max_steps`."""
+        while self.running:
+            self.step()
+
+    def get_model_vars(self):
+        """Get the collected values of each model reporter.
+
+        Returns: Dictionary of reporter names and arrays with one row per replicate and one column per collected step.
+        """
+        model_vars = [model.datacollector.model_vars for model in self.models]
+        return {name: numpy.array([v[name] for v in model_vars]) for name in model_vars[0]}
+
+    def get_model_vars_dataframe(self):
+        """Create a pandas DataFrame of all collected values with the replicate and the step as index."""
+        import pandas
+
+        return pandas.concat(
+            [model.datacollector.get_model_vars_dataframe() for model in self.models],
+            keys=range(len(self.models)),
+            names=["Replicate", "Step"],
+        )
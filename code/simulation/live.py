@@ -0,0 +1,128 @@
+"""Web server that steps the model in a background thread, independent of the browser.
+
+mesa's `ModularServer` steps the model once per frame that the browser requests, so the simulation runs at the
+frames per second of the browser. `LiveServer` steps the model in a worker thread as fast as possible or at a target
+number of steps per second. Every frame shows the latest state, or the state after every Nth step.
+Use `AggregatedChartModule` to chart the steps between two frames. The model runs without a limit while the browser
+requests frames, so it should only keep the data of the last steps, e.g. `TrafficModel(history=1000)`.
+"""
+import asyncio
+import threading
+import time
+
+from .visualization import FrameSocketHandler
+from mesa.visualization.ModularVisualization import ModularServer
+from tornado.escape import json_decode
+
+
+class LiveSocketHandler(FrameSocketHandler):
+    """Websocket handler that sends the latest state of the model instead of stepping it."""
+
+    async def on_message(self, message):
+        """Answer frame requests of the browser, all other messages are handled as usual."""
+        msg = json_decode(message)
+        if msg["type"] != "get_step":
+            super().on_message(message)
+            return
+
+        # Waiting for the next frame blocks, so wait in another thread to keep the server responsive
+        await asyncio.get_running_loop().run_in_executor(None, self.application.wait_for_frame)
+        if not self.application.model.running:
+            self.write_message({"type": "end"})
+        else:
+            self.write_message(self.viz_state_message)
+
+
+class LiveServer(ModularServer):
+    """mesa server that decouples the simulation loop from the frames of the browser."""
+
+    def __init__(
+        self, *args, steps_per_second=None, steps_per_frame=None, idle_timeout=2.0, **kwargs
+    ):
+        """Create the server and start the simulation thread.
+
+        Args:
+            *args: Arguments of `ModularServer`.
+            steps_per_second: Target number of steps per second, None = as fast as possible.
+            steps_per_frame: Send a frame after exactly this many steps. The simulation waits until the frame was
+                sent. None = send the latest state whenever the browser requests a frame.
+            idle_timeout: Seconds after the last frame request at which the simulation pauses, e.g. when the
+                browser was stopped or closed. Only used without `steps_per_frame`.
+            **kwargs: Keyword arguments of `ModularServer`.
+        """
+        self.steps_per_second = steps_per_second
+        self.steps_per_frame = steps_per_frame
+        self.idle_timeout = idle_timeout
+
+        # Guards the model, which is stepped by the simulation thread and rendered by the server
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.steps_since_frame = 0
+        self.last_request = None
+
+        super().__init__(*args, **kwargs)
+        # Handlers that are added later take precedence over the ones of `ModularServer`
+        self.add_handlers(r".*$", [(r"/ws", LiveSocketHandler)])
+
+        self.thread = threading.Thread(target=self.simulate, name="simulation", daemon=True)
+        self.thread.start()
+
+    def reset_model(self):
+        """Reinstantiate the model object, using the current parameters."""
+        with self.changed:
+            super().reset_model()
+            self.steps_since_frame = 0
+            self.changed.notify_all()
+
+    def render_model(self):
+        """Turn the current state of the model into a dictionary of visualizations."""
+        with self.changed:
+            state = super().render_model()
+            self.steps_since_frame = 0
+            self.changed.notify_all()
+        return state
+
+    def is_frame_ready(self):
+        """Check whether the next frame can be sent."""
+        return (
+            self.steps_per_frame is None
+            or self.steps_since_frame >= self.steps_per_frame
+            or not self.model.running
+        )
+
+    def wait_for_frame(self):
+        """Wake up the simulation and wait until the next frame can be sent."""
+        with self.changed:
+            self.last_request = time.monotonic()
+            self.changed.notify_all()
+            self.changed.wait_for(self.is_frame_ready)
+
+    def should_step(self):
+        """Check whether the simulation thread should step the model."""
+        if not self.model.running:
+            return False
+        if self.steps_per_frame is not None:
+            return self.steps_since_frame < self.steps_per_frame
+        return (
+            self.last_request is not None
+            and time.monotonic() - self.last_request < self.idle_timeout
+        )
+
+    def simulate(self):
+        """Step the model forever. Executed in the simulation thread."""
+        next_step = time.monotonic()
+        while True:
+            with self.changed:
+                # Time out to notice when the browser became idle
+                while not self.changed.wait_for(self.should_step, timeout=self.idle_timeout):
+                    pass
+                self.model.step()
+                self.steps_since_frame += 1
+                self.changed.notify_all()
+
+            if self.steps_per_second:
+                next_step = max(next_step + 1 / self.steps_per_second, time.monotonic() - 1)
+                time.sleep(max(next_step - time.monotonic(), 0))
+            else:
+                # Let the server take the lock between steps
+                time.sleep(0)
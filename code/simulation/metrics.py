@@ -4,6 +4,9 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .model import TrafficModel
 
+# All metrics are calculated from the counters of the model, which are kept up to date when vehicles are created,
+# removed or change their velocity. So no metric needs to iterate over all agents.
+
 
 def get_num_vehicles(model: "TrafficModel"):
     """Get number of vehicles.
@@ -11,7 +14,7 @@ def get_num_vehicles(model: "TrafficModel"):
     Args:
         model: Reference to our Traffic model
     """
-    return model.schedule.get_agent_count()
+    return sum(model.vehicle_counts)
 
 
 def get_num_cars(model: "TrafficModel"):
@@ -20,7 +23,7 @@ def get_num_cars(model: "TrafficModel"):
     Args:
         model: Reference to our Traffic model
     """
-    return sum(a.type == TrafficAgent.Type.CAR for a in model.schedule.agents)
+    return model.vehicle_counts[TrafficAgent.Type.CAR.value]
 
 
 def get_num_bikes(model: "TrafficModel"):
@@ -29,7 +32,7 @@ def get_num_bikes(model: "TrafficModel"):
     Args:
         model: Reference to our Traffic model
     """
-    return sum(a.type == TrafficAgent.Type.BIKE for a in model.schedule.agents)
+    return model.vehicle_counts[TrafficAgent.Type.BIKE.value]
 
 
 def get_average_velocity(model: "TrafficModel", type: TrafficAgent.Type = None):
@@ -39,10 +42,16 @@ def get_average_velocity(model: "TrafficModel", type: TrafficAgent.Type = None):
         model: Reference to our Traffic model
         vehicle_type: type of agents to filter
     """
-    velocities = [a.velocity for a in model.schedule.agents if type is None or a.type == type]
-    if len(velocities) == 0:
+    if type is None:
+        count = sum(model.vehicle_counts)
+        velocity_sum = sum(model.velocity_sums)
+    else:
+        count = model.vehicle_counts[type.value]
+        velocity_sum = model.velocity_sums[type.value]
+
+    if count == 0:
         return 0.0
-    return sum(velocities) / len(velocities)
+    return velocity_sum / count
 
 
 def get_car_average_velocity(model: "TrafficModel"):
@@ -1,22 +1,198 @@
-import mesa
+import numpy
+import pickle
+import zlib
 
+from functools import lru_cache
 from .metrics import model_reporters
-from .agents import TrafficAgent
-from .schedule import SimultaneousActivation
-from mesa.datacollection import DataCollector
-from mesa.model import Model
-from mesa.space import Coordinate, SingleGrid
+from .profiling import ProfiledTrafficAgent, create_profiler
+from .recording import TrajectoryRecorder
+from .agents import DX, DY, TrafficAgent
+from .convergence import SteadyStateMonitor
+from .datacollection import ColumnarDataCollector
+from .schedule import SimultaneousActivation, SleepingActivation
+from .base import Model
+from .space import Coordinate, LaneGrid, SparseLaneGrid
+from .streams import SLOW_DOWN, CounterRandom
+from .vectorized import VectorizedTraffic
 
-# Grid size parameters
+# Default grid size parameters
 street_width = 4
 first_street = 100
 distance_between_streets = 51
 number_of_streets = 5
-size = (
-    (first_street * 2)
-    + (number_of_streets * street_width)
-    + ((number_of_streets - 1) * distance_between_streets)
-)
+
+# Parameters that can be changed when forking a model from a snapshot
+FORK_PARAMETERS = ["p_new_agents", "p_slow_down", "traffic_light_phase_length", "car_bike_ratio"]
+FORK_RUN_OPTIONS = ["max_steps", "collect_from", "steady_state", "profile", "record", "history"]
+
+
+@lru_cache
+def street_axis(size, street_width, first_street, distance_between_streets, number_of_streets):
+    """Get the index of the street of each x or y coordinate. The layout is the same along both axes.
+
+    Returns: Read-only array indexed by the coordinate. -1 if the coordinate is not on a street.
+    """
+    block_size = distance_between_streets + street_width
+    u = numpy.arange(size) - first_street
+    street = u // block_size
+    on_street = (0 <= street) & (street < number_of_streets) & (u % block_size < street_width)
+
+    axis = numpy.where(on_street, street, -1).astype(numpy.int16)
+    axis.flags.writeable = False
+    return axis
+
+
+@lru_cache
+def stop_line_axes(size, street_width, first_street, distance_between_streets, number_of_streets):
+    """Create the stop line table of `stop_line_table` in a compact form with one row per direction and axis.
+    A cell is the first cell on an intersection in a direction if the values of both of its coordinates are at least
+    0. Then the light phase in which the traffic light at this cell is red is the sum of both values modulo 2.
+
+    Returns: Read-only array indexed by direction, axis (0 = x, 1 = y) and coordinate.
+    """
+    block_size = distance_between_streets + street_width
+    u = numpy.arange(size) - first_street
+    street = u // block_size
+    on_grid = (0 <= street) & (street < number_of_streets)
+
+    # First cell on an intersection when going in increasing (right, down) or decreasing (up, left) direction
+    forward = on_grid & (u % block_size == 0)
+    backward = on_grid & (u % block_size == street_width - 1)
+
+    # The light state of intersection (i, j) is (i + j + phase) % 2, where `1` means red for left <-> right traffic.
+    # So, for vertical traffic the light is red in phase (i + j) % 2 and for horizontal traffic in the other phase.
+    axes = numpy.full((len(TrafficAgent.Direction), 2, size), -1, dtype=numpy.int16)
+    for dir, first_x, first_y in [
+        (TrafficAgent.Direction.UP, on_grid, backward),
+        (TrafficAgent.Direction.RIGHT, forward, on_grid),
+        (TrafficAgent.Direction.DOWN, on_grid, forward),
+        (TrafficAgent.Direction.LEFT, backward, on_grid),
+    ]:
+        is_horizontal_direction = int(
+            dir in [TrafficAgent.Direction.LEFT, TrafficAgent.Direction.RIGHT]
+        )
+        axes[dir.value, 0][first_x] = street[first_x] + is_horizontal_direction
+        axes[dir.value, 1][first_y] = street[first_y]
+
+    axes.flags.writeable = False
+    return axes
+
+
+@lru_cache
+def stop_line_table(size, street_width, first_street, distance_between_streets, number_of_streets):
+    """Create a table of all cells that are the first cell on an intersection for each direction.
+    The table depends only on the street layout, so it is shared by all models with the same bike lane config.
+
+    Returns: Read-only array indexed by direction, x and y. -1 if the cell is not the first cell on an intersection
+    in this direction. Otherwise the light phase in which the traffic light at this cell is red.
+    """
+    axes = stop_line_axes(
+        size, street_width, first_street, distance_between_streets, number_of_streets
+    )
+    x, y = axes[:, 0, :, None], axes[:, 1, None, :]
+    table = numpy.where((x >= 0) & (y >= 0), (x + y) % 2, -1).astype(numpy.int8)
+
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache
+def bike_box_cells(size, street_width, first_street, distance_between_streets, number_of_streets):
+    """Create the tables of the cells at which bikes move into and out of the bike boxes for each intersection
+    approach. Only street cells are included, because vehicles never leave the streets.
+
+    Returns: Tuple of two tuples of dictionaries indexed by direction, which must not be modified:
+    - Bike box entries: cells on a bike lane two cells before a stop line, mapped to the light phase in which the
+      traffic light there is red, the cell in front and the cells of the bike box in the order in which they are filled.
+    - Bike box exits: cells directly before a stop line, mapped to the light phase in which the traffic light there is
+      red, the cell to the left and the cell on the bike lane behind the stop line, to which the leftmost bike moves.
+    """
+    layout = (size, street_width, first_street, distance_between_streets, number_of_streets)
+    streets = street_axis(*layout)
+    axes = stop_line_axes(*layout)
+    block_size = distance_between_streets + street_width
+
+    entries, exits = [], []
+    for dir in TrafficAgent.Direction:
+        dx, dy = DX[dir], DY[dir]
+        left_x, left_y = dy, -dx
+        horizontal = dir in [TrafficAgent.Direction.LEFT, TrafficAgent.Direction.RIGHT]
+
+        # Stop lines are along one axis, lanes along the other, see `stop_line_axes`
+        stop_axis = 0 if horizontal else 1
+        stops = numpy.flatnonzero(axes[dir, stop_axis] >= 0).tolist()
+        lanes = numpy.flatnonzero((axes[dir, 1 - stop_axis] >= 0) & (streets >= 0)).tolist()
+
+        # Lane of the bike lane in this direction, see `entry_cells`
+        if dir in [TrafficAgent.Direction.UP, TrafficAgent.Direction.RIGHT]:
+            bike_lane = street_width - 1
+        else:
+            bike_lane = 0
+
+        dir_entries, dir_exits = {}, {}
+        for s in stops:
+            for u in lanes:
+                x, y = (s, u) if horizontal else (u, s)
+                red_phase = int(axes[dir, 0, x] + axes[dir, 1, y]) % 2
+                lane = (u - first_street) % block_size
+                target = u - lane + bike_lane
+
+                front = (x - dx, y - dy)
+                dir_exits[front] = (
+                    red_phase,
+                    (front[0] + left_x, front[1] + left_y),
+                    (s, target) if horizontal else (target, s),
+                )
+                if lane in [0, street_width - 1]:
+                    bike_box = tuple(
+                        (front[0] + i * left_x, front[1] + i * left_y) for i in range(1, 3)
+                    )
+                    dir_entries[(x - 2 * dx, y - 2 * dy)] = (red_phase, front, bike_box)
+        entries.append(dir_entries)
+        exits.append(dir_exits)
+    return tuple(entries), tuple(exits)
+
+
+@lru_cache
+def entry_cells(
+    size, street_width, first_street, distance_between_streets, number_of_streets, with_bike_lane
+):
+    """Create a table of the cells at which new vehicles enter the grid.
+
+    Returns: Nested tuples indexed by direction, street and type of the vehicle. Each entry is a tuple of the entry
+    cell and the cell in front of it, which a car occupies as well.
+    """
+    table = []
+    for direction in TrafficAgent.Direction:
+        streets = []
+        for i in range(number_of_streets):
+            types = []
+            for type in TrafficAgent.Type:
+                # When there is a bike lane, move cars one cell towards the center
+                offset = 0
+                if with_bike_lane and type == TrafficAgent.Type.CAR:
+                    offset = 1
+
+                # Add the agent to the current road in the given direction
+                x = y = first_street + (distance_between_streets + street_width) * i + offset
+                if direction == TrafficAgent.Direction.UP:
+                    x += street_width - 1 - (2 * offset)
+                    y = size - 1
+                    front = (x, y - 1)
+                elif direction == TrafficAgent.Direction.RIGHT:
+                    x = 0
+                    y += street_width - 1 - (2 * offset)
+                    front = (x + 1, y)
+                elif direction == TrafficAgent.Direction.DOWN:
+                    y = 0
+                    front = (x, y + 1)
+                else:  # direction == LEFT
+                    x = size - 1
+                    front = (x - 1, y)
+                types.append(((x, y), front))
+            streets.append(tuple(types))
+        table.append(tuple(streets))
+    return tuple(table)
 
 
 class TrafficModel(Model):
@@ -26,9 +202,7 @@ class TrafficModel(Model):
     """
 
     # Static parameters
-    size = size
     max_id = 0
-    number_of_streets = 5
 
     def __init__(
         self,
@@ -37,6 +211,21 @@ class TrafficModel(Model):
         traffic_light_phase_length: int = 10,
         bike_lane_config: int = 0,
         car_bike_ratio=0.5,
+        engine: str = "agents",
+        max_steps: int = None,
+        collect_from: int = 0,
+        seed: int = None,
+        steady_state: dict = None,
+        number_of_streets: int = number_of_streets,
+        street_width: int = street_width,
+        first_street: int = first_street,
+        distance_between_streets: int = distance_between_streets,
+        grid_storage: str = "dense",
+        profile: bool = False,
+        activation: str = "simultaneous",
+        rng: str = "shared",
+        record: str = None,
+        history: int = None,
     ):
         """Initialize the model.
         Set all parameters for the run. This method is called after a reset.
@@ -47,9 +236,40 @@ class TrafficModel(Model):
             traffic_light_phase_length: Duration of a green phase for a traffic light.
             bike_lane_config: 0 = no bike lane, shared road. 1 = with bike lane, 2 = with bike boxes/ASLs
             car_bike_ratio: probability that a newly created agent is a car.
+            engine: "agents" = one `TrafficAgent` per vehicle, "numpy" = all vehicles stored in arrays and moved at once.
+            max_steps: Stop the model after this many steps and collect the data in preallocated columns. None = run until stopped and use mesa's DataCollector, unless `history` is set.
+            collect_from: First step for which data is collected when `max_steps` or `history` is set.
+            seed: Seed of the random number generator. It's applied by `Model.__new__`, see `simulation.base`.
+            steady_state: Stop the model when the metrics reach a steady state. Dictionary of `SteadyStateMonitor` options, {} for the defaults. None = no monitor.
+            number_of_streets: Number of horizontal and of vertical streets.
+            street_width: Number of lanes of each street without bike lanes.
+            first_street: x and y coordinate of the beginning of the first street.
+            distance_between_streets: Number of cells between two streets without bike lanes.
+            grid_storage: "dense" = store every cell of the grid, "sparse" = store only occupied cells and lookup tables
+                per axis, so memory doesn't grow with the square of the city size.
+            profile: Record the wall time and number of calls of each phase of the step in `profiler`.
+            activation: Scheduler of the agents engine. "simultaneous" = step every agent in every step, "sleeping" =
+                skip agents that are blocked in front until they can move again, with the same results.
+            rng: Random numbers of the vehicles. "shared" = drawn one after another from one generator, so they depend
+                on the order of the vehicles and differ between engines, "counter" = derived from the seed, the step and
+                the vehicle id or entry point, so all engines and activations have the same results, see
+                `simulation.streams`.
+            record: Directory of a trajectory recording of the state after every step, see `simulation.recording`.
+                None = no recording.
+            history: Keep only the data of the last `history` steps in columns, e.g. for a model that runs in the web
+                server until it's stopped. None = keep all steps.
         """
         super().__init__()
 
+        # Random numbers of the vehicles, drawn before the vectorized engines seed their own generators
+        if rng == "counter":
+            self.streams = CounterRandom(self.random.getrandbits(64))
+        elif rng == "shared":
+            self.streams = None
+        else:
+            raise ValueError(f"Unknown rng: {rng}")
+        self.slow_down_draws = None
+
         # Store model parameters
         self.p_new_agents = p_new_agents
         self.p_slow_down = p_slow_down
@@ -57,8 +277,16 @@ class TrafficModel(Model):
         self.with_bike_lane = bike_lane_config >= 1
         self.with_bike_box = bike_lane_config >= 2
         self.car_bike_ratio = car_bike_ratio
+        self.engine = engine
+        self.grid_storage = grid_storage
 
         # Define width and position of the street sections
+        self.number_of_streets = number_of_streets
+        self.size = (
+            (first_street * 2)
+            + (number_of_streets * street_width)
+            + ((number_of_streets - 1) * distance_between_streets)
+        )
         if self.with_bike_lane:
             self.street_width = street_width + 2
             self.first_street = first_street - 1
@@ -68,101 +296,317 @@ class TrafficModel(Model):
             self.first_street = first_street
             self.distance_between_streets = distance_between_streets
 
+        # Each street is one cell longer with bike lanes, so the last street moves towards the border
+        last_street_end = (
+            self.first_street
+            + (self.distance_between_streets + self.street_width) * (number_of_streets - 1)
+            + self.street_width
+        )
+        if number_of_streets < 1 or self.first_street < 1 or last_street_end >= self.size:
+            raise ValueError("Streets don't fit into the grid, increase first_street")
+
+        # Load lookup tables of the street layout
+        self.load_stop_lines()
+
+        # Number of vehicles and sum of their velocities per type, kept up to date for the metrics
+        self.vehicle_counts = [0 for _ in TrafficAgent.Type]
+        self.velocity_sums = [0 for _ in TrafficAgent.Type]
+
         # Create Grid and Scheduler
-        self.grid = SingleGrid(self.size, self.size, torus=False)
-        self.schedule = SimultaneousActivation(self)
+        self.grid = self.create_grid()
+        if activation == "simultaneous":
+            self.schedule = SimultaneousActivation(self)
+        elif activation == "sleeping":
+            self.schedule = SleepingActivation(self)
+        else:
+            raise ValueError(f"Unknown activation: {activation}")
+
+        # Agents that left the grid, which are reused for new vehicles instead of creating new objects
+        self.agent_pool = []
+
+        # With the numpy engine, vehicles are not added to the scheduler, it only keeps track of the time
+        if engine == "numpy":
+            self.vectorized = VectorizedTraffic(self)
+        elif engine == "agents":
+            self.vectorized = None
+        else:
+            raise ValueError(f"Unknown engine: {engine}")
 
         # Create traffic lights
-        num_lights = (self.size - (2 * self.first_street)) // (
-            self.distance_between_streets + self.street_width
-        ) + 1
-        self.lights = [[(i + j) % 2 for j in range(num_lights)] for i in range(num_lights)]
+        self.lights = [
+            [(i + j) % 2 for j in range(number_of_streets)] for i in range(number_of_streets)
+        ]
+
+        # All traffic lights toggle at the same time, so the number of toggles modulo 2 determines the state of all lights
+        self.light_phase = 0
+
+        self.configure_run(max_steps, collect_from, steady_state, profile, record, history)
 
         # Create an agent at each end of each road
         self.create_agents(1.0)
+        if self.recorder is not None:
+            self.recorder.record(self)
+
+    def configure_run(
+        self,
+        max_steps=None,
+        collect_from=0,
+        steady_state=None,
+        profile=False,
+        record=None,
+        history=None,
+    ):
+        """Set up data collection, profiling, recording and the conditions for stopping the run.
+
+        Args:
+            max_steps: Stop the model after this many steps and collect the data in preallocated columns. None = run until stopped and use mesa's DataCollector, unless `history` is set.
+            collect_from: First step for which data is collected when `max_steps` or `history` is set.
+            steady_state: Dictionary of `SteadyStateMonitor` options, None = no monitor.
+            profile: Record the time of each phase of the step in `profiler`, see `StepProfiler`.
+            record: Directory of a trajectory recording, see `TrajectoryRecorder`. None = no recording.
+            history: Number of the last steps whose data is kept, see `ColumnarDataCollector`. None = all steps.
+        """
+        self.profiler = create_profiler(profile)
+        self.recorder = TrajectoryRecorder(record, self) if record is not None else None
 
         # Configure data collector
-        self.datacollector = DataCollector(model_reporters)
+        self.max_steps = max_steps
+        if max_steps is None and history is None:
+            # Imported here, because mesa also loads its visualization server and pandas, see `simulation.base`
+            from mesa.datacollection import DataCollector
+
+            self.datacollector = DataCollector(model_reporters)
+        else:
+            self.datacollector = ColumnarDataCollector(
+                model_reporters, max_steps or 0, collect_from, window=history
+            )
+
+        # Configure steady state detection
+        self.steady_state = None
+        if steady_state is not None:
+            self.steady_state = SteadyStateMonitor(**steady_state)
+
+    def create_grid(self):
+        """Create an empty grid with the storage of `grid_storage`."""
+        if self.grid_storage == "dense":
+            return LaneGrid(self.size, self.size, torus=False)
+        elif self.grid_storage == "sparse":
+            return SparseLaneGrid(self.size, self.size, torus=False)
+        raise ValueError(f"Unknown grid storage: {self.grid_storage}")
+
+    def load_stop_lines(self):
+        """Load the street, stop line, entry cell and bike box tables for the street layout of this model.
+        The stop line table covers every cell of the grid, so it's only loaded for dense grid storage.
+        """
+        layout = (
+            self.size,
+            self.street_width,
+            self.first_street,
+            self.distance_between_streets,
+            self.number_of_streets,
+        )
+        self.streets = street_axis(*layout)
+        self.stop_line_axes = stop_line_axes(*layout)
+        self._stop_line_axes = memoryview(self.stop_line_axes)
+        if self.grid_storage == "dense":
+            self.stop_lines = stop_line_table(*layout)
+            self._stop_lines = memoryview(self.stop_lines)
+        else:
+            self.stop_lines = self._stop_lines = None
+        self.entries = entry_cells(*layout, self.with_bike_lane)
+        if self.with_bike_box:
+            self.bike_box_entries, self.bike_box_exits = bike_box_cells(*layout)
+        else:
+            self.bike_box_entries = self.bike_box_exits = None
+
+    def __getstate__(self):
+        """Get the state for pickling without the grid, the lookup tables and the pool of unused agents. The grid is
+        restored from the agents.
+        """
+        state = self.__dict__.copy()
+        state["agent_pool"] = []
+        state["recorder"] = None
+        for name in [
+            "bike_box_entries",
+            "bike_box_exits",
+            "entries",
+            "grid",
+            "streets",
+            "stop_line_axes",
+            "_stop_line_axes",
+            "stop_lines",
+            "_stop_lines",
+        ]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        """Restore the state from pickling and rebuild the grid and lookup tables."""
+        self.__dict__.update(state)
+        self.load_stop_lines()
+
+        self.grid = self.create_grid()
+        for agent in self.schedule.agents:
+            pos, agent.pos = agent.pos, None
+            self.grid.place_agent(agent, pos)
+        if self.vectorized is not None:
+            self.vectorized.rebuild_occupancy()
+
+    def snapshot(self):
+        """Serialize the complete state of the model, i.e. grid, agents, traffic lights, `max_id` and random state.
+
+        Returns: Compressed bytes, which can be passed to `fork` in this or another process.
+        """
+        return zlib.compress(pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def fork(cls, snapshot: bytes, seed: int = None, **params):
+        """Create a new model from a snapshot, e.g. to share a warmed-up state across parameter variants.
+        The new model continues at the step of the snapshot with fresh data collection.
+
+        Args:
+            snapshot: Bytes created by `snapshot`.
+            seed: New seed for the random number generator. None = continue with the random state of the snapshot.
+            params: Parameters to change: p_new_agents, p_slow_down, traffic_light_phase_length, car_bike_ratio and
+                max_steps, collect_from, steady_state, profile, record and history like in `__init__`.
+        """
+        model = pickle.loads(zlib.decompress(snapshot))
+
+        run_options = {name: params.pop(name) for name in FORK_RUN_OPTIONS if name in params}
+        invalid = [name for name in params if name not in FORK_PARAMETERS]
+        if invalid:
+            raise ValueError(f"Parameters can't be changed when forking: {', '.join(invalid)}")
+        for name, value in params.items():
+            setattr(model, name, value)
+
+        if seed is not None:
+            model.reset_randomizer(seed)
+            if model.streams is not None:
+                model.streams = CounterRandom(model.random.getrandbits(64))
+            if model.vectorized is not None:
+                model.vectorized.rng = numpy.random.default_rng(model.random.getrandbits(64))
+
+        model.running = True
+        model.configure_run(**run_options)
+        if model.recorder is not None:
+            model.recorder.record(model)
+        return model
 
     def step(self):
         """Simulate one step of the model."""
+        profiler = self.profiler
+        with profiler.phase("step"):
+            # Move agents to their next position
+            with profiler.phase("move"):
+                if self.vectorized is not None:
+                    self.vectorized.step()
+                elif self.streams is not None:
+                    self.draw_slow_down()
+                self.schedule.step()
+
+            # Create some new agents
+            with profiler.phase("create_agents"):
+                self.create_agents(self.p_new_agents)
 
-        # Move agents to their next position
-        self.schedule.step()
+            self.end_step()
+
+    def draw_slow_down(self):
+        """Draw the counter-based random numbers of the slow down of all agents at once, which is faster than one at a
+        time. `TrafficAgent.step` looks them up in `slow_down_draws` by the id of the agent.
+        """
+        ids = [agent.unique_id for agent in self.schedule.agents]
+        draws = self.streams.randoms(self.schedule.steps, SLOW_DOWN, ids)
+        self.slow_down_draws = dict(zip(ids, draws.tolist()))
 
-        # Create some new agents
-        self.create_agents(self.p_new_agents)
+    def end_step(self):
+        """Collect the data of the step, toggle the traffic lights and check whether the run is over."""
+        profiler = self.profiler
 
         # Collect data
-        self.datacollector.collect(self)
+        with profiler.phase("collect"):
+            self.datacollector.collect(self)
+            if self.steady_state is not None and self.steady_state.update(self):
+                self.running = False
 
         # Toggle traffic lights
-        if int(self.schedule.time) % self.traffic_light_phase_length == 0:
-            for row in self.lights:
-                for i, _ in enumerate(row):
-                    row[i] ^= 1
+        with profiler.phase("lights"):
+            if int(self.schedule.time) % self.traffic_light_phase_length == 0:
+                for row in self.lights:
+                    for i, _ in enumerate(row):
+                        row[i] ^= 1
+                self.light_phase ^= 1
+
+        if self.max_steps is not None and self.schedule.steps >= self.max_steps:
+            self.running = False
+
+        # Append the state after the step to the recording
+        if self.recorder is not None:
+            with profiler.phase("record"):
+                self.recorder.record(self)
+                if not self.running:
+                    self.recorder.close()
 
     def create_agents(self, probability):
         """Create agents at each end of each road with the given probability.
+        The entry cells are checked before an agent is taken from the pool of agents that left the grid or created.
 
         Args:
             probability: How likely it is at each end of each road that a new agent is created.
         """
+        if self.vectorized is not None:
+            self.vectorized.create_agents(probability)
+            return
+
+        # Agents that time their checks for the profiler
+        agent_class = ProfiledTrafficAgent if self.profiler.enabled else TrafficAgent
+        grid = self.grid
+
+        # Counter-based random numbers are drawn for all entry points at once, see `CounterRandom.entry_draws`
+        draws = None
+        if self.streams is not None:
+            draws = self.streams.entry_draws(self.schedule.steps, self.number_of_streets).tolist()
+
         # For each street direction (4 * num_streets in total)
         # Add an agent at the beginning of a street
         for direction in TrafficAgent.Direction:
+            entries = self.entries[direction]
             for i in range(self.number_of_streets):
-                if self.random.random() > probability:
+                if draws is None:
+                    new_vehicle = self.random.random()
+                else:
+                    new_vehicle, vehicle_type = draws[direction][i]
+                if new_vehicle > probability:
                     continue
 
                 # Choose car or bike with probability `car_bike_ratio`
-                if self.random.random() < self.car_bike_ratio:
+                if draws is None:
+                    vehicle_type = self.random.random()
+                if vehicle_type < self.car_bike_ratio:
                     type = TrafficAgent.Type.CAR
                 else:
                     type = TrafficAgent.Type.BIKE
 
-                # Create a new agent with a unique ID.
+                # Every agent that is drawn gets a unique ID, even if it can't be placed
                 self.max_id += 1
-                agent = TrafficAgent(
-                    self.max_id,
-                    self,
-                    type,
-                    direction,
-                )
-
-                # When there is a bike lane, move cars one cell towards the center
-                offset = 0
-                if self.with_bike_lane and agent.type == TrafficAgent.Type.CAR:
-                    offset = 1
 
-                # Add the agent to the current road in the given direction
-                x = y = (
-                    self.first_street
-                    + (self.distance_between_streets + self.street_width) * i
-                    + offset
-                )
-                if direction == TrafficAgent.Direction.UP:
-                    x += self.street_width - 1 - (2 * offset)
-                    y = self.size - 1
-                elif direction == TrafficAgent.Direction.RIGHT:
-                    x = 0
-                    y += self.street_width - 1 - (2 * offset)
-                elif direction == TrafficAgent.Direction.DOWN:
-                    y = 0
-                else:  # direction == LEFT
-                    x = self.size - 1
-
-                # Add agent if cell is empty
-                if self.grid.is_cell_empty((x, y)) and (
-                    agent.type != TrafficAgent.Type.CAR
-                    or self.grid.is_cell_empty((agent.next_x(x, 1), agent.next_y(y, 1)))
+                # Add agent if cell is empty, cars also need the cell in front of it
+                # Silently fail if an existing agent is in the way
+                # This should be rare with the longer first streets
+                pos, front = entries[i][type]
+                if not grid.is_cell_empty(pos) or (
+                    type == TrafficAgent.Type.CAR and not grid.is_cell_empty(front)
                 ):
-                    self.grid.place_agent(agent, (x, y))
-                    self.schedule.add(agent)
+                    continue
+
+                if self.agent_pool:
+                    agent = self.agent_pool.pop()
+                    agent.unique_id = self.max_id
+                    agent.initialize(type, direction)
                 else:
-                    # Silently fail if an existing agent is in the way
-                    # This should be rare with the longer first streets
-                    pass
+                    agent = agent_class(self.max_id, self, type, direction)
+                grid.place_agent(agent, pos)
+                self.schedule.add(agent)
+                self.vehicle_counts[type] += 1
 
     def is_red_light(self, pos: Coordinate, dir: TrafficAgent.Direction):
         """Check whether the traffic light at that position in this direction has turned red.
@@ -176,24 +620,78 @@ class TrafficModel(Model):
         Otherwise a Boolean whether the traffic light at this position is red or not.
         """
         x, y = pos
-        x -= self.first_street
-        y -= self.first_street
-        block_size = self.distance_between_streets + self.street_width
+        if not (0 <= x < self.size and 0 <= y < self.size):
+            return None
 
-        # If position is not the first cell on intersection in direction of travel
-        if (
-            (dir == TrafficAgent.Direction.UP and y % block_size != self.street_width - 1)
-            or (dir == TrafficAgent.Direction.RIGHT and x % block_size != 0)
-            or (dir == TrafficAgent.Direction.DOWN and y % block_size != 0)
-            or (dir == TrafficAgent.Direction.LEFT and x % block_size != self.street_width - 1)
-            or not (0 <= x // block_size < self.number_of_streets)
-            or not (0 <= y // block_size < self.number_of_streets)
-        ):
+        if self._stop_lines is not None:
+            red_phase = self._stop_lines[dir, x, y]
+        else:
+            u = self._stop_line_axes[dir, 0, x]
+            v = self._stop_line_axes[dir, 1, y]
+            red_phase = -1 if u < 0 or v < 0 else (u + v) % 2
+        if red_phase < 0:
             return None
+        return red_phase == self.light_phase
 
-        # `1` means the traffic light is red for left <-> right traffic
-        is_horizontal_direction = int(
-            dir in [TrafficAgent.Direction.LEFT, TrafficAgent.Direction.RIGHT]
-        )
+    def red_phases(self, dir, x, y):
+        """Vectorized lookup in the stop line table, see `stop_line_table`.
+
+        Args:
+            dir: Array of direction values.
+            x, y: Arrays of coordinates inside the grid.
+
+        Returns: Array of the light phase in which the traffic light at each position is red, -1 if the position is not
+        the first cell on an intersection in the direction.
+        """
+        if self.stop_lines is not None:
+            return self.stop_lines[dir, x, y]
+        u = self.stop_line_axes[dir, 0, x]
+        v = self.stop_line_axes[dir, 1, y]
+        return numpy.where((u < 0) | (v < 0), -1, (u + v) % 2)
+
+    def red_mask(self):
+        """Get all cells that are the first cell on an intersection behind a red traffic light.
+
+        Returns: Boolean array indexed by direction, x and y.
+        """
+        if self.stop_lines is not None:
+            return self.stop_lines == self.light_phase
+        u, v = self.stop_line_axes[:, 0, :, None], self.stop_line_axes[:, 1, None, :]
+        return (u >= 0) & (v >= 0) & ((u + v) % 2 == self.light_phase)
+
+    def distance_to_red_light(self, pos: Coordinate, dir: TrafficAgent.Direction, start, limit):
+        """Get the distance to the nearest red traffic light in front of a position.
+        Only the stop lines of the lane are visited instead of every cell in front of the position.
+
+        Args:
+            pos: Position as tuple (x, y)
+            dir: Direction at which the agent is moving.
+            start: Smallest distance to consider.
+            limit: Largest distance to consider.
+
+        Returns: None if there is no red traffic light between `start` and `limit` cells in front of the position.
+        Otherwise, the distance to the first cell on the intersection behind the red traffic light.
+        """
+        x, y = pos
+        block_size = self.distance_between_streets + self.street_width
+        forward = dir in [TrafficAgent.Direction.RIGHT, TrafficAgent.Direction.DOWN]
+        horizontal = dir in [TrafficAgent.Direction.LEFT, TrafficAgent.Direction.RIGHT]
+        sign = 1 if forward else -1
+        u = x if horizontal else y
+
+        # Distance to the first stop line at least `start` cells in front of the position
+        if forward:
+            distance = start + (self.first_street - (u + start)) % block_size
+        else:
+            offset = self.first_street + self.street_width - 1
+            distance = start + (u - start - offset) % block_size
 
-        return self.lights[x // block_size][y // block_size] == is_horizontal_direction
+        while distance <= limit:
+            if horizontal:
+                stop_line = (x + sign * distance, y)
+            else:
+                stop_line = (x, y + sign * distance)
+            if self.is_red_light(stop_line, dir):
+                return distance
+            distance += block_size
+        return None
@@ -0,0 +1,125 @@
+import contextlib
+import time
+
+from .agents import TrafficAgent
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .model import TrafficModel
+
+# Phases of `TrafficModel.step`. The phases of moving the vehicles are nested in "move".
+PHASES = [
+    "step",
+    "move",
+    "move.slow_down",
+    "move.bike_box",
+    "move.advance",
+    "create_agents",
+    "collect",
+    "lights",
+    "record",
+]
+
+# Shared context manager of `NoProfiler.phase`
+NO_PHASE = contextlib.nullcontext()
+
+
+class NoProfiler:
+    """Profiler of models without profiling, which does nothing and costs close to nothing."""
+
+    enabled = False
+
+    def phase(self, name):
+        """Return a context manager that does nothing."""
+        return NO_PHASE
+
+    def add(self, name, seconds):
+        """Ignore the time of a phase."""
+
+
+class StepProfiler:
+    """Wall time and number of calls of each phase of `TrafficModel.step`.
+
+    The model times its phases with `phase`. Vehicle level phases, which run once per vehicle with the agents engine,
+    are timed by `ProfiledTrafficAgent` with `add`.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        """Initialize all phases with zero time and calls."""
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager that adds its wall time to the phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """Add one call with the given wall time to the phase `name`."""
+        self.seconds[name] += seconds
+        self.calls[name] += 1
+
+    def summary(self):
+        """Get the total time, the number of calls and the mean time per step of each phase that was called.
+
+        Returns: Dictionary of phase names and dictionaries with "seconds", "calls" and "ms_per_step".
+        """
+        steps = max(self.calls["step"], 1)
+        return {
+            name: {
+                "seconds": self.seconds[name],
+                "calls": self.calls[name],
+                "ms_per_step": 1000 * self.seconds[name] / steps,
+            }
+            for name in PHASES
+            if self.calls[name] > 0
+        }
+
+    def __str__(self):
+        """Return the summary as table."""
+        lines = [f"{'phase':<16}{'calls':>10}{'seconds':>12}{'ms/step':>10}"]
+        for name, phase in self.summary().items():
+            lines.append(
+                f"{name:<16}{phase['calls']:>10}{phase['seconds']:>12.3f}{phase['ms_per_step']:>10.3f}"
+            )
+        return "\n".join(lines)
+
+
+class ProfiledTrafficAgent(TrafficAgent):
+    """`TrafficAgent` that adds the time of its gap and bike box checks to the profiler of the model.
+    Models only create these agents when profiling is on, so that other models don't pay for the timing.
+    """
+
+    __slots__ = ()
+
+    def get_gap(self):
+        """See `TrafficAgent.get_gap`, timed as phase "move.slow_down"."""
+        start = time.perf_counter()
+        gap = super().get_gap()
+        self.model.profiler.add("move.slow_down", time.perf_counter() - start)
+        return gap
+
+    def should_fill_up_bike_box(self):
+        """See `TrafficAgent.should_fill_up_bike_box`, timed as phase "move.bike_box"."""
+        start = time.perf_counter()
+        cell = super().should_fill_up_bike_box()
+        self.model.profiler.add("move.bike_box", time.perf_counter() - start)
+        return cell
+
+    def should_empty_bike_box(self):
+        """See `TrafficAgent.should_empty_bike_box`, timed as phase "move.bike_box"."""
+        start = time.perf_counter()
+        cell = super().should_empty_bike_box()
+        self.model.profiler.add("move.bike_box", time.perf_counter() - start)
+        return cell
+
+
+def create_profiler(profile: bool):
+    """Create the profiler of a model, which only records anything if `profile` is set."""
+    return StepProfiler() if profile else NoProfiler()
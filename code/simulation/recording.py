@@ -0,0 +1,213 @@
+"""Trajectory recordings of runs, which can be browsed later without running the model again.
+
+A recording is a directory with
+- `meta.json`: the street layout and the parameters of the run,
+- `frames.bin`: one frame per recorded step, the state of the traffic lights (one byte per intersection) followed by
+  the vehicle table (one `VEHICLE_DTYPE` row per vehicle, sorted by id),
+- `index.bin`: one `INDEX_DTYPE` row per frame with the step, the offset of the frame in `frames.bin`, the number of
+  vehicles and the light phase.
+Both binary files only grow at their end and the index has fixed-size rows, so `Recording` memory-maps them and reads
+any frame without reading the ones before it, even while the run is still being recorded.
+
+Record a run with `TrafficModel(record="recordings/run")` and browse it with `CSSM_REPLAY=recordings/run python run.py`.
+"""
+import json
+import numpy
+
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .model import TrafficModel
+
+META_FILE = "meta.json"
+FRAMES_FILE = "frames.bin"
+INDEX_FILE = "index.bin"
+FORMAT_VERSION = 1
+
+# Packed rows of the vehicle table and of the index, little-endian
+VEHICLE_DTYPE = numpy.dtype(
+    [("id", "<i4"), ("x", "<i2"), ("y", "<i2"), ("type", "u1"), ("dir", "u1"), ("velocity", "u1")]
+)
+INDEX_DTYPE = numpy.dtype(
+    [("step", "<i8"), ("offset", "<i8"), ("vehicles", "<i4"), ("light_phase", "u1")]
+)
+
+
+def vehicle_table(model: "TrafficModel"):
+    """Get the id, position, type, direction and velocity of all vehicles of the model, sorted by id."""
+    if model.vectorized is not None:
+        vehicles = model.vectorized
+        table = numpy.empty(len(vehicles.id), dtype=VEHICLE_DTYPE)
+        table["id"] = vehicles.id
+        table["x"] = vehicles.x
+        table["y"] = vehicles.y
+        table["type"] = vehicles.type
+        table["dir"] = vehicles.direction
+        table["velocity"] = vehicles.velocity
+    else:
+        table = numpy.array(
+            [
+                (
+                    agent.unique_id,
+                    agent.pos[0],
+                    agent.pos[1],
+                    agent.type,
+                    agent.direction,
+                    agent.velocity,
+                )
+                for agent in model.schedule.agents
+            ],
+            dtype=VEHICLE_DTYPE,
+        )
+    return table[numpy.argsort(table["id"], kind="stable")]
+
+
+class TrajectoryRecorder:
+    """Appends the state of a model after each step to a recording, see the module docstring."""
+
+    def __init__(self, directory, model: "TrafficModel"):
+        """Create the recording and write its metadata. An existing recording in the directory is replaced.
+
+        Args:
+            directory: Directory of the recording.
+            model: The recorded model, which provides the street layout and the parameters.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        meta = {
+            "format": FORMAT_VERSION,
+            "layout": {
+                "size": model.size,
+                "first_street": model.first_street,
+                "street_width": model.street_width,
+                "distance_between_streets": model.distance_between_streets,
+                "number_of_streets": model.number_of_streets,
+            },
+            "with_bike_lane": model.with_bike_lane,
+            "with_bike_box": model.with_bike_box,
+            "params": {
+                "p_new_agents": model.p_new_agents,
+                "p_slow_down": model.p_slow_down,
+                "traffic_light_phase_length": model.traffic_light_phase_length,
+                "car_bike_ratio": model.car_bike_ratio,
+                "engine": model.engine,
+            },
+        }
+        with open(self.directory / META_FILE, "w") as file:
+            json.dump(meta, file, indent=2)
+
+        self.frames = open(self.directory / FRAMES_FILE, "wb")
+        self.index = open(self.directory / INDEX_FILE, "wb")
+        self.offset = 0
+
+    def record(self, model: "TrafficModel"):
+        """Append the current state of the model as a frame."""
+        lights = numpy.array(model.lights, dtype=numpy.uint8).tobytes()
+        table = vehicle_table(model)
+        vehicles = table.tobytes()
+        row = numpy.array(
+            [(model.schedule.steps, self.offset, len(table), model.light_phase)], dtype=INDEX_DTYPE
+        )
+
+        # The frame is complete on disk before its index row, so readers never see a partial frame
+        self.frames.write(lights)
+        self.frames.write(vehicles)
+        self.frames.flush()
+        self.index.write(row.tobytes())
+        self.index.flush()
+        self.offset += len(lights) + len(vehicles)
+
+    def close(self):
+        """Close the files of the recording."""
+        self.frames.close()
+        self.index.close()
+
+
+class Frame:
+    """State of a model at a recorded step. The vehicles have the same attributes as `VectorizedTraffic`, so
+    `TrafficGrid` can render a frame like the vehicles of the numpy engine.
+    """
+
+    def __init__(self, step: int, light_phase: int, lights, vehicles):
+        """Create a frame from the rows of a recording.
+
+        Args:
+            step: Number of steps of the model.
+            light_phase: `TrafficModel.light_phase`.
+            lights: Array of the states of the traffic lights indexed by x and y of the intersection.
+            vehicles: Array of `VEHICLE_DTYPE` rows.
+        """
+        self.step = step
+        self.light_phase = light_phase
+        self.lights = lights
+        self.table = vehicles
+        self.id = vehicles["id"].astype(numpy.int64)
+        self.x = vehicles["x"].astype(numpy.int64)
+        self.y = vehicles["y"].astype(numpy.int64)
+        self.type = vehicles["type"].astype(numpy.int8)
+        self.direction = vehicles["dir"].astype(numpy.int8)
+        self.velocity = vehicles["velocity"].astype(numpy.int64)
+
+
+class Recording:
+    """Read-only access to the frames of a recording through memory maps."""
+
+    def __init__(self, directory):
+        """Open a recording.
+
+        Args:
+            directory: Directory of the recording.
+        """
+        self.directory = Path(directory)
+        with open(self.directory / META_FILE) as file:
+            self.meta = json.load(file)
+        if self.meta["format"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported recording format: {self.meta['format']}")
+        self.number_of_streets = self.meta["layout"]["number_of_streets"]
+        self.refresh()
+
+    def refresh(self):
+        """Map the files again to see the frames that were recorded since they were opened.
+
+        Returns: The number of frames.
+        """
+        self.index = self.map(INDEX_FILE, INDEX_DTYPE)
+        self.frames = self.map(FRAMES_FILE, numpy.uint8)
+        return len(self.index)
+
+    def map(self, name: str, dtype):
+        """Memory-map the complete rows of a file of the recording. Empty files can't be mapped."""
+        path = self.directory / name
+        rows = path.stat().st_size // numpy.dtype(dtype).itemsize
+        if rows == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+
+    def __len__(self):
+        """Get the number of frames."""
+        return len(self.index)
+
+    def steps(self):
+        """Get the step of each frame."""
+        return self.index["step"]
+
+    def find(self, step: int):
+        """Get the number of the first frame at or after a step, or of the last frame if the step wasn't recorded."""
+        return min(int(numpy.searchsorted(self.index["step"], step)), len(self) - 1)
+
+    def frame(self, number: int):
+        """Read a frame.
+
+        Args:
+            number: Number of the frame, from 0 to `len(recording) - 1`.
+        """
+        step, offset, count, light_phase = self.index[number].tolist()
+        lights_size = self.number_of_streets**2
+        lights = self.frames[offset : offset + lights_size].reshape(
+            self.number_of_streets, self.number_of_streets
+        )
+        start = offset + lights_size
+        vehicles = self.frames[start : start + count * VEHICLE_DTYPE.itemsize].view(VEHICLE_DTYPE)
+        return Frame(step, light_phase, lights, vehicles)
@@ -0,0 +1,135 @@
+"""Web server that replays a trajectory recording instead of running the model, see `simulation.recording`.
+
+The recording is memory-mapped, so the server starts immediately and jumps to any step without reading the steps
+before it. The frontend plays the frames with the usual start, step and reset buttons and jumps with the slider below
+the grid, which sends a "seek" message. Frames that are recorded while the server runs are picked up at the end.
+"""
+from .base import Model
+from .recording import Recording
+from .visualization import FrameSocketHandler, TrafficGrid
+from mesa.visualization.ModularVisualization import ModularServer
+from mesa.visualization.UserParam import Slider
+from tornado.escape import json_decode
+from tornado.web import StaticFileHandler
+
+
+class ReplayModel(Model):
+    """Model that shows the frames of a recording. It has the attributes that `TrafficGrid` renders, with the
+    current frame in place of the vehicles of the numpy engine.
+    """
+
+    def __init__(self, recording: str, start_step: int = 0, steps_per_frame: int = 1):
+        """Open a recording and show the frame of the start step.
+
+        Args:
+            recording: Directory of the recording.
+            start_step: First shown step, the next recorded one if it wasn't recorded.
+            steps_per_frame: Number of recorded frames that each step of the replay advances.
+        """
+        super().__init__()
+        self.recording = Recording(recording)
+        if len(self.recording) == 0:
+            raise ValueError(f"Recording without frames: {recording}")
+        self.steps_per_frame = steps_per_frame
+
+        meta = self.recording.meta
+        for name, value in meta["layout"].items():
+            setattr(self, name, value)
+        self.with_bike_lane = meta["with_bike_lane"]
+        self.with_bike_box = meta["with_bike_box"]
+
+        self.seek(self.recording.find(start_step))
+
+    def seek(self, number: int):
+        """Show a frame.
+
+        Args:
+            number: Number of the frame, clipped to the recorded frames.
+        """
+        if number >= len(self.recording):
+            self.recording.refresh()
+        self.number = max(0, min(number, len(self.recording) - 1))
+
+        frame = self.recording.frame(self.number)
+        self.vectorized = frame
+        self.lights = frame.lights
+        self.light_phase = frame.light_phase
+        self.steps = frame.step
+
+    def step(self):
+        """Show the next frame and stop after the last one."""
+        number = self.number + self.steps_per_frame
+        if number >= len(self.recording) and self.recording.refresh() <= number:
+            self.running = False
+        self.seek(number)
+
+
+class ReplayGrid(TrafficGrid):
+    """`TrafficGrid` that also sends the position in the recording for the slider of the frontend."""
+
+    def render(self, model: ReplayModel):
+        """Return the frame of the model and the current frame, recorded step and number of frames."""
+        data = super().render(model)
+        data["replay"] = {
+            "frame": model.number,
+            "frames": len(model.recording),
+            "step": model.steps,
+        }
+        return data
+
+
+class ReplaySocketHandler(FrameSocketHandler):
+    """Websocket handler that also jumps to the frames that the frontend seeks."""
+
+    def on_message(self, message):
+        """Answer "seek" messages with the state of the requested frame, all other messages are handled as usual.
+        The answer has its own type, because the frontend would request the next step after each "viz_state".
+        """
+        msg = json_decode(message)
+        if msg["type"] != "seek":
+            super().on_message(message)
+            return
+
+        model = self.application.model
+        model.seek(int(msg["frame"]))
+        model.running = True
+        self.write_message({"type": "replay_state", "data": self.render_model()})
+
+
+class ReplayServer(ModularServer):
+    """mesa server that plays a recording with random access."""
+
+    def __init__(self, recording: str, elements=None, name="Traffic Model (replay)", **kwargs):
+        """Create the server.
+
+        Args:
+            recording: Directory of the recording.
+            elements: Visualization elements that only need the attributes of `ReplayModel`, e.g. `ReplayGrid`.
+                None = only the grid.
+            name: Title of the page.
+            **kwargs: Keyword arguments of `ModularServer`.
+        """
+        frames = len(Recording(recording))
+        model_params = {
+            "recording": recording,
+            "steps_per_frame": Slider(
+                "Recorded steps per frame",
+                1,
+                1,
+                max(min(frames // 10, 100), 1),
+                1,
+                "Number of recorded frames that each step of the replay advances",
+            ),
+        }
+        if elements is None:
+            elements = [ReplayGrid(delta=True)]
+        super().__init__(ReplayModel, elements, name, model_params, **kwargs)
+        # Handlers that are added later take precedence over the ones of `ModularServer`. Model.js loads its images
+        # from the directory of `TrafficGrid`, which mesa only maps for elements of that exact class.
+        self.add_handlers(
+            r".*$",
+            [
+                (r"/ws", ReplaySocketHandler),
+                (r"/local/TrafficGrid/(.*)", StaticFileHandler, {"path": ReplayGrid.local_dir}),
+            ],
+        )
@@ -1,4 +1,35 @@
-from mesa.time import BaseScheduler
+class BaseScheduler:
+    """Scheduler that keeps the agents in the order in which they were added, like `mesa.time.BaseScheduler`, which
+    can't be imported without mesa's visualization server, see `simulation.base`.
+    """
+
+    def __init__(self, model) -> None:
+        """Create a new, empty scheduler."""
+        self.model = model
+        self.steps = 0
+        self.time = 0
+        self._agents = {}
+
+    def add(self, agent) -> None:
+        """Add an agent to the schedule."""
+        if agent.unique_id in self._agents:
+            raise Exception(
+                f"Agent with unique id {repr(agent.unique_id)} already added to scheduler"
+            )
+        self._agents[agent.unique_id] = agent
+
+    def remove(self, agent) -> None:
+        """Remove an agent from the schedule."""
+        del self._agents[agent.unique_id]
+
+    def get_agent_count(self) -> int:
+        """Return the current number of agents in the schedule."""
+        return len(self._agents)
+
+    @property
+    def agents(self) -> list:
+        """List of all agents in the order in which they were added."""
+        return list(self._agents.values())
 
 
 class SimultaneousActivation(BaseScheduler):
@@ -22,3 +53,64 @@ class SimultaneousActivation(BaseScheduler):
             agent.advance()
         self.steps += 1
         self.time += 1
+
+
+class SleepingActivation(SimultaneousActivation):
+    """`SimultaneousActivation` that doesn't step agents which can't move, e.g. in the queues in front of red lights.
+
+    An agent that stands still after a step and is blocked by the agent in front or by a red traffic light is put to
+    sleep, see `TrafficAgent.get_blocker`. It's woken when the agent in front moves or leaves the grid, or when the
+    traffic lights toggle. Until then, every step would end with velocity 0, so the agent keeps its state.
+
+    The random slow down of a sleeping agent is still drawn from the shared random number generator, even though it
+    has no effect, so that all other agents draw the same numbers and a run has the same results as with
+    `SimultaneousActivation`. Counter-based random numbers don't depend on the other agents, so they are skipped.
+    """
+
+    def __init__(self, model) -> None:
+        """Create a new, empty scheduler."""
+        super().__init__(model)
+        self.asleep = set()
+        # Sleeping agents behind each agent and in front of red traffic lights
+        self.followers = {}
+        self.at_lights = []
+        self.light_phase = None
+
+    def step(self) -> None:
+        """Step all agents that are awake, then advance them and put the blocked ones to sleep."""
+        model = self.model
+        asleep = self.asleep
+
+        if model.light_phase != self.light_phase:
+            self.light_phase = model.light_phase
+            asleep.difference_update(self.at_lights)
+            self.at_lights = []
+
+        draw = model.random.random if model.streams is None else None
+        awake = []
+        for agent in list(self._agents.values()):
+            if agent in asleep:
+                if draw is not None:
+                    draw()
+            else:
+                agent.step()
+                awake.append(agent)
+
+        for agent in awake:
+            pos = agent.pos
+            agent.advance()
+            if agent.pos != pos:
+                followers = self.followers.pop(agent, None)
+                if followers is not None:
+                    asleep.difference_update(followers)
+            elif agent.velocity == 0:
+                blocker = agent.get_blocker()
+                if blocker is True:
+                    self.at_lights.append(agent)
+                    asleep.add(agent)
+                elif blocker is not None:
+                    self.followers.setdefault(blocker, []).append(agent)
+                    asleep.add(agent)
+
+        self.steps += 1
+        self.time += 1
@@ -1,8 +1,10 @@
-from .model import TrafficModel, size, first_street
-from .visualization import TrafficGrid
-from mesa.visualization.modules import ChartModule
-from mesa.visualization.ModularVisualization import ModularServer
-from mesa.visualization.UserParam import Slider, StaticText
+import os
+
+from .live import LiveServer
+from .model import TrafficModel
+from .replay import ReplayServer
+from .visualization import AggregatedChartModule, ProfileChartModule, TrafficGrid, TrafficServer
+from mesa.visualization.UserParam import Choice, Slider, StaticText
 
 # Set model parameters
 model_params = {
@@ -47,6 +49,24 @@ model_params = {
         0.1,
         "Ratio of cars and bikes that are created each round",
     ),
+    "number_of_streets": Slider(
+        "Number of streets",
+        5,
+        1,
+        20,
+        1,
+        "Number of horizontal and of vertical streets",
+    ),
+    "engine": Choice(
+        "Simulation engine",
+        "agents",
+        ["agents", "numpy"],
+        "agents = one mesa agent per vehicle, numpy = all vehicles moved at once",
+    ),
+    # Only store occupied cells, so that large cities start quickly
+    "grid_storage": "sparse",
+    # The model runs until the server stops, so only keep the data of the last steps, which the charts show
+    "history": 1000,
 }
 
 # Set colors of the data series in the charts
@@ -54,24 +74,56 @@ BIKE_COLOR = "orange"
 CAR_COLOR = "blue"
 
 # Initialize visualization modules
-grid = TrafficGrid(size, first_street)
-num_chart = ChartModule(
+grid = TrafficGrid(delta=True)
+num_chart = AggregatedChartModule(
     [{"Label": "Cars", "Color": CAR_COLOR}, {"Label": "Bikes", "Color": BIKE_COLOR}]
 )
-velocity_chart = ChartModule(
+velocity_chart = AggregatedChartModule(
     [
         {"Label": "Car average velocity", "Color": CAR_COLOR},
         {"Label": "Bike average velocity", "Color": BIKE_COLOR},
     ]
 )
-density_chart = ChartModule([{"Label": "Cell density", "Color": "#FF3C33"}])
-flow_chart = ChartModule([{"Label": "Average flow", "Color": "#FF3C33"}])
+density_chart = AggregatedChartModule([{"Label": "Cell density", "Color": "#FF3C33"}])
+flow_chart = AggregatedChartModule([{"Label": "Average flow", "Color": "#FF3C33"}])
+
+# Step the model in the background, independent of the frames of the browser, if one of these is set:
+# CSSM_STEPS_PER_SECOND = target steps per second (0 = as fast as possible),
+# CSSM_STEPS_PER_FRAME = send a frame every N steps (unset = send the latest state at the frame rate of the browser)
+steps_per_second = os.getenv("CSSM_STEPS_PER_SECOND")
+steps_per_frame = os.getenv("CSSM_STEPS_PER_FRAME")
+
+# Show the time of the phases of the step if CSSM_PROFILE is set
+elements = [grid, num_chart, velocity_chart, density_chart, flow_chart]
+if os.getenv("CSSM_PROFILE"):
+    model_params["profile"] = True
+    profile_chart = ProfileChartModule(
+        [
+            {"Label": "move.slow_down", "Color": "#1f77b4"},
+            {"Label": "move.bike_box", "Color": "#ff7f0e"},
+            {"Label": "move.advance", "Color": "#2ca02c"},
+            {"Label": "create_agents", "Color": "#d62728"},
+            {"Label": "collect", "Color": "#9467bd"},
+            {"Label": "lights", "Color": "#8c564b"},
+        ]
+    )
+    elements.append(profile_chart)
+
+# Replay a recording instead of running the model if CSSM_REPLAY is set to its directory, see `simulation.recording`
+replay = os.getenv("CSSM_REPLAY")
 
 # Start Mesa's server module
-server = ModularServer(
-    TrafficModel,
-    [grid, num_chart, velocity_chart, density_chart, flow_chart],
-    "Traffic Model",
-    model_params,
-)
+if replay:
+    server = ReplayServer(replay)
+elif steps_per_second is None and steps_per_frame is None:
+    server = TrafficServer(TrafficModel, elements, "Traffic Model", model_params)
+else:
+    server = LiveServer(
+        TrafficModel,
+        elements,
+        "Traffic Model",
+        model_params,
+        steps_per_second=float(steps_per_second or 0) or None,
+        steps_per_frame=int(steps_per_frame) if steps_per_frame else None,
+    )
 server.port = 8521  # The default port
@@ -0,0 +1,186 @@
+from bisect import bisect_left, bisect_right, insort
+from typing import Tuple
+
+from .agents import TrafficAgent
+
+# Position as tuple (x, y), like mesa's `Coordinate`
+Coordinate = Tuple[int, int]
+
+
+class Grid:
+    """Base class of grids with the interface of mesa's `SingleGrid` as far as it's used by the model.
+    mesa's grids can't be imported without mesa's visualization server, see `simulation.base`.
+    """
+
+    def __init__(self, width: int, height: int, torus: bool):
+        """Create a new empty grid.
+
+        Args:
+            width, height: The width and height of the grid
+            torus: Not supported, must be False.
+        """
+        if torus:
+            raise ValueError(f"{type(self).__name__} does not support torus grids")
+        self.width = width
+        self.height = height
+        self.torus = torus
+
+    def out_of_bounds(self, pos: Coordinate):
+        """Check whether a position is outside the grid."""
+        x, y = pos
+        return x < 0 or x >= self.width or y < 0 or y >= self.height
+
+    def is_cell_empty(self, pos: Coordinate):
+        """Check whether a cell is empty."""
+        return self[pos] is None
+
+    def move_agent(self, agent, pos: Coordinate):
+        """Move an agent from its current position to a new position."""
+        self.remove_agent(agent)
+        self.place_agent(agent, pos)
+
+
+class DenseGrid(Grid):
+    """Grid that stores every cell in a list per column, like mesa's `SingleGrid` without its set of empty cells."""
+
+    def __init__(self, width: int, height: int, torus: bool):
+        """Create a new empty grid.
+
+        Args:
+            width, height: The width and height of the grid
+            torus: Not supported, must be False.
+        """
+        super().__init__(width, height, torus)
+        self.cells = [[None] * height for _ in range(width)]
+
+    def __getitem__(self, pos: Coordinate):
+        """Get the agent at a position given as tuple (x, y) or None if the cell is empty."""
+        x, y = pos
+        return self.cells[x][y]
+
+    def place_agent(self, agent, pos: Coordinate):
+        """Place the agent at the specified location and set its pos variable."""
+        x, y = pos
+        if self.cells[x][y] is not None:
+            raise Exception("Cell not empty")
+        self.cells[x][y] = agent
+        agent.pos = pos
+
+    def remove_agent(self, agent):
+        """Remove the agent from the grid and set its pos variable to None."""
+        if agent.pos is None:
+            return
+        x, y = agent.pos
+        self.cells[x][y] = None
+        agent.pos = None
+
+
+class SparseGrid(Grid):
+    """Grid that only stores the occupied cells in a dictionary. `DenseGrid` allocates every cell, so its memory grows
+    with the square of the grid size, even though vehicles only ever occupy street cells.
+    """
+
+    def __init__(self, width: int, height: int, torus: bool):
+        """Create a new empty grid.
+
+        Args:
+            width, height: The width and height of the grid
+            torus: Not supported, must be False.
+        """
+        super().__init__(width, height, torus)
+        self.cells = {}
+
+    def __getitem__(self, pos: Coordinate):
+        """Get the agent at a position given as tuple (x, y) or None if the cell is empty."""
+        return self.cells.get(pos)
+
+    def is_cell_empty(self, pos: Coordinate):
+        """Check whether a cell is empty."""
+        return pos not in self.cells
+
+    def place_agent(self, agent, pos: Coordinate):
+        """Place the agent at the specified location and set its pos variable."""
+        if pos in self.cells:
+            raise Exception("Cell not empty")
+        self.cells[pos] = agent
+        agent.pos = pos
+
+    def remove_agent(self, agent):
+        """Remove the agent from the grid and set its pos variable to None."""
+        if agent.pos is None:
+            return
+        del self.cells[agent.pos]
+        agent.pos = None
+
+
+class LaneIndex:
+    """Mixin for grids that additionally keeps an ordered index of the occupied cells of each row and column.
+    As all traffic moves in straight lanes, the next agent in front of a position can be found with a binary search
+    instead of probing the grid cell by cell.
+    """
+
+    def __init__(self, width: int, height: int, torus: bool):
+        """Create a new grid with empty lane indexes.
+
+        Args:
+            width, height: The width and height of the grid
+            torus: Boolean whether the grid wraps or not.
+        """
+        super().__init__(width, height, torus)
+
+        # Sorted y coordinates of the agents in each column and sorted x coordinates of the agents in each row
+        self.columns = [[] for _ in range(width)]
+        self.rows = [[] for _ in range(height)]
+
+    def place_agent(self, agent, pos: Coordinate):
+        """Place the agent at the specified location and add it to the lane indexes."""
+        super().place_agent(agent, pos)
+        x, y = pos
+        insort(self.columns[x], y)
+        insort(self.rows[y], x)
+
+    def remove_agent(self, agent):
+        """Remove the agent from the grid and from the lane indexes."""
+        if agent.pos is not None:
+            x, y = agent.pos
+            column = self.columns[x]
+            del column[bisect_left(column, y)]
+            row = self.rows[y]
+            del row[bisect_left(row, x)]
+        super().remove_agent(agent)
+
+    def distance_to_next_agent(self, pos: Coordinate, dir: TrafficAgent.Direction, start, limit):
+        """Get the distance to the nearest agent in front of a position.
+
+        Args:
+            pos: Position as tuple (x, y)
+            dir: Direction in which to look.
+            start: Smallest distance to consider.
+            limit: Largest distance to consider.
+
+        Returns: None if there is no agent between `start` and `limit` cells in front of the position.
+        Otherwise, the distance to the nearest agent.
+        """
+        x, y = pos
+        if dir == TrafficAgent.Direction.UP or dir == TrafficAgent.Direction.DOWN:
+            lane, u = self.columns[x], y
+        else:
+            lane, u = self.rows[y], x
+
+        if dir == TrafficAgent.Direction.UP or dir == TrafficAgent.Direction.LEFT:
+            i = bisect_right(lane, u - start) - 1
+            if i >= 0 and lane[i] >= u - limit:
+                return u - lane[i]
+        else:
+            i = bisect_left(lane, u + start)
+            if i < len(lane) and lane[i] <= u + limit:
+                return lane[i] - u
+        return None
+
+
+class LaneGrid(LaneIndex, DenseGrid):
+    """`DenseGrid` with lane indexes, see `LaneIndex`."""
+
+
+class SparseLaneGrid(LaneIndex, SparseGrid):
+    """`SparseGrid` with lane indexes, see `LaneIndex`."""
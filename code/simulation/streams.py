@@ -0,0 +1,76 @@
+"""Counter-based random numbers for `TrafficModel(rng="counter")`.
+
+Each random number is a hash of the key of the model, the step, the purpose of the number and the vehicle id or entry
+point that it's drawn for. So the numbers don't depend on the order in which vehicles are processed, and all engines,
+activations and ensembles get the same numbers, however they batch or split the vehicles.
+The hash is the finalizer of SplitMix64, implemented for Python integers, which derive the state of a step, and for
+numpy arrays, which derive the numbers of the entities.
+"""
+import numpy
+
+MASK = (1 << 64) - 1
+GAMMA = 0x9E3779B97F4A7C15
+
+# Purposes of random numbers, each one is an independent stream
+SLOW_DOWN = 0
+NEW_VEHICLE = 1
+VEHICLE_TYPE = 2
+
+
+def mix(z: int):
+    """Hash a 64 bit integer with the finalizer of SplitMix64."""
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK
+    return z ^ (z >> 31)
+
+
+def mix_array(z):
+    """Vectorized version of `mix` for an array of type uint64."""
+    z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return z ^ (z >> numpy.uint64(31))
+
+
+class CounterRandom:
+    """Random numbers in [0, 1) that are a function of a key, the step, a stream and an entity."""
+
+    def __init__(self, key: int):
+        """Create the random numbers of a model.
+
+        Args:
+            key: 64 bit key, which is drawn from the random number generator of the model, so it depends on the seed.
+        """
+        self.key = key
+
+    def base(self, step: int, stream: int):
+        """Get the state from which the numbers of all entities in a step and stream are derived."""
+        return mix((mix(self.key ^ ((stream + 1) * GAMMA & MASK)) + step) & MASK)
+
+    def randoms(self, step: int, stream: int, entities):
+        """Get the random numbers of the given entities.
+
+        Args:
+            step: Step of the model.
+            stream: Purpose of the numbers, e.g. `SLOW_DOWN`.
+            entities: Array of non-negative vehicle ids or indexes of entry points.
+        """
+        z = numpy.uint64(self.base(step, stream)) + (
+            numpy.asarray(entities, dtype=numpy.uint64) + numpy.uint64(1)
+        ) * numpy.uint64(GAMMA)
+        return (mix_array(z) >> numpy.uint64(11)).astype(numpy.float64) * 2.0**-53
+
+    def entry_draws(self, step: int, number_of_streets: int):
+        """Get the random numbers of the entry points of the roads, which decide whether a vehicle is created and
+        whether it's a car.
+
+        Returns: Array indexed by direction, street and 0 = creation, 1 = type.
+        """
+        entities = numpy.arange(4 * number_of_streets)
+        draws = numpy.stack(
+            [
+                self.randoms(step, NEW_VEHICLE, entities),
+                self.randoms(step, VEHICLE_TYPE, entities),
+            ],
+            axis=-1,
+        )
+        return draws.reshape(4, number_of_streets, 2)
@@ -0,0 +1,349 @@
+"""Headless parameter sweeps over `TrafficModel` on a process pool.
+
+Every finished run is written to its own `.npz` file in the output directory and recorded in `index.jsonl`.
+A sweep that was interrupted can be restarted with the same arguments and skips all runs that are already recorded.
+
+Example:
+    cssm-sweep -o results -p bike_lane_config=0,1,2 -p traffic_light_phase_length=20,25,30 --iterations 10
+"""
+import argparse
+import hashlib
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+from pathlib import Path
+from .model import FORK_PARAMETERS, FORK_RUN_OPTIONS, TrafficModel
+
+INDEX_FILE = "index.jsonl"
+RUNS_DIR = "runs"
+
+
+def parse_value(value: str):
+    """Parse a parameter value from the command line as int, float, bool or string."""
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def parse_param(arg: str):
+    """Parse a `name=value1,value2,...` command line argument into the name and a list of values."""
+    name, sep, values = arg.partition("=")
+    if not sep or not values:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUE[,VALUE...], got {arg!r}")
+    return name.strip(), [parse_value(value.strip()) for value in values.split(",")]
+
+
+def make_grid(parameters: dict):
+    """Create all combinations of the given parameter values.
+
+    Args:
+        parameters: Dictionary of parameter names and lists of values. The seed and the options of the run, like
+            `max_steps`, are set by the runner for all runs and can't be part of the grid.
+
+    Returns: List of dictionaries with one value per parameter.
+    """
+    valid = inspect.signature(TrafficModel.__init__).parameters
+    invalid = [name for name in parameters if name not in valid or name == "self"]
+    if invalid:
+        raise ValueError(f"Unknown TrafficModel parameters: {', '.join(invalid)}")
+    options = [name for name in parameters if name == "seed" or name in FORK_RUN_OPTIONS]
+    if options:
+        raise ValueError(f"Run options can't be swept, set them for all runs: {', '.join(options)}")
+
+    names = sorted(parameters)
+    return [
+        dict(zip(names, values)) for values in itertools.product(*(parameters[n] for n in names))
+    ]
+
+
+def run_key(params: dict, seed: int, options: dict):
+    """Get a unique key for a run, which is also used as its file name."""
+    data = json.dumps({"params": params, "seed": seed, **options}, sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+def read_index(output: Path):
+    """Read keys of all finished runs from the index file of the output directory."""
+    index = output / INDEX_FILE
+    if not index.exists():
+        return set()
+
+    finished = set()
+    with open(index) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a killed sweep might be incomplete
+                continue
+            if (output / record["file"]).exists():
+                finished.add(record["key"])
+    return finished
+
+
+def warm_up(task):
+    """Run the model for the warm-up steps and take a snapshot. Executed in a worker.
+
+    Args:
+        task: Tuple of parameters, seed and number of steps.
+
+    Returns: Snapshot of the model, see `TrafficModel.snapshot`.
+    """
+    params, seed, steps = task
+    # With `max_steps`, the model uses the columnar collector instead of importing mesa's. No step is collected, so
+    # the snapshot doesn't carry the warm-up data into every fork.
+    model = TrafficModel(seed=seed, max_steps=steps, collect_from=steps + 1, **params)
+    for _ in range(steps):
+        model.step()
+    return model.snapshot()
+
+
+def run(task):
+    """Run the model for one parameter combination and seed and save the collected data. Executed in a worker.
+
+    Args:
+        task: Tuple of output directory, run key, parameters, seed, options that are the same for all runs, the
+            parameters of the warm-up run (None = no warm-up) and a snapshot of the warm-up run to fork the model from
+            (None = start from an empty grid).
+
+    Returns: Record for the index file.
+    """
+    output, key, params, seed, options, warmup_params, snapshot = task
+    start = time.perf_counter()
+
+    if snapshot is None:
+        model = TrafficModel(seed=seed, **options, **params)
+    else:
+        forked = {name: value for name, value in params.items() if name in FORK_PARAMETERS}
+        model = TrafficModel.fork(snapshot, **forked, **options)
+    model.run_model()
+
+    # Write into a temporary file first, so that a killed sweep never leaves a partial result behind
+    file = Path(RUNS_DIR) / f"{key}.npz"
+    tmp = output / RUNS_DIR / f"{key}.tmp.npz"
+    model.datacollector.to_npz(tmp)
+    os.replace(tmp, output / file)
+
+    record = {
+        "key": key,
+        "params": params,
+        "seed": seed,
+        "steps": model.schedule.steps,
+        "file": str(file),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    if warmup_params is not None:
+        record["warmup_params"] = warmup_params
+    if model.steady_state is not None:
+        record["warmup_end"] = model.steady_state.warmup_end
+        record["converged_step"] = model.steady_state.converged_step
+        record["estimates"] = model.steady_state.estimates()
+    if model.profiler.enabled:
+        record["profile"] = model.profiler.summary()
+    return record
+
+
+def sweep(
+    output,
+    parameters: dict,
+    iterations=1,
+    seed=0,
+    max_steps=500,
+    collect_from=0,
+    steady_state=None,
+    warmup=0,
+    processes=None,
+    profile=False,
+):
+    """Run all combinations of the parameters `iterations` times and stream the results into `output`.
+
+    Args:
+        output: Directory of the results.
+        parameters: Dictionary of `TrafficModel` parameter names and lists of values.
+        iterations: Number of runs per parameter combination, each with its own seed.
+        seed: Seed of the first iteration. The other iterations use the following seeds.
+        max_steps: Number of steps of each run, which includes the warm-up steps of forked runs.
+        collect_from: First step for which data is collected.
+        steady_state: Options of the `SteadyStateMonitor` to stop runs early, None = always run `max_steps` steps.
+        warmup: Number of steps of a shared warm-up. Runs that differ only in parameters that can be changed by
+            `TrafficModel.fork` are forked from the same warm-up run per seed, which uses the first of these
+            parameter combinations in the grid, see `warm_up_params`. 0 = every run starts from an empty grid.
+        processes: Number of worker processes. None = number of CPUs.
+        profile: Record the time of each phase of the step in the index file, see `StepProfiler`.
+    """
+    output = Path(output)
+    (output / RUNS_DIR).mkdir(parents=True, exist_ok=True)
+
+    options = {"max_steps": max_steps, "collect_from": collect_from, "steady_state": steady_state}
+    if profile:
+        options["profile"] = True
+
+    grid = make_grid(parameters)
+    warm_ups = warm_up_params(grid) if warmup else {}
+
+    finished = read_index(output)
+    tasks = []
+    for params in grid:
+        # The parameters of the warm-up are part of the key, because the run forks from the state that they created
+        warmup_params = warm_ups.get(fixed_params(params))
+        key_options = options
+        if warmup:
+            key_options = {**options, "warmup": warmup, "warmup_params": warmup_params}
+        for i in range(iterations):
+            key = run_key(params, seed + i, key_options)
+            tasks.append((output, key, params, seed + i, options, warmup_params, None))
+    tasks = [task for task in tasks if task[1] not in finished]
+    total = len(tasks) + len(finished)
+    print(f"{len(finished)} of {total} runs already finished, {len(tasks)} to go")
+
+    with multiprocessing.Pool(processes) as pool, open(output / INDEX_FILE, "a") as index:
+        if warmup and tasks:
+            tasks = fork_from_warm_up(pool, tasks, warmup)
+
+        for done, record in enumerate(pool.imap_unordered(run, tasks), len(finished) + 1):
+            index.write(json.dumps(record) + "\n")
+            index.flush()
+            os.fsync(index.fileno())
+            print(
+                f"[{done}/{total}] seed={record['seed']} {record['params']}"
+                f" ({record['steps']} steps, {record['seconds']}s)"
+            )
+
+
+def fixed_params(params: dict):
+    """Get the parameters that can't be changed when forking a model, as string to group runs by."""
+    return json.dumps(
+        {name: value for name, value in params.items() if name not in FORK_PARAMETERS},
+        sort_keys=True,
+    )
+
+
+def warm_up_params(grid: list):
+    """Choose the parameters of the warm-up of each group of parameter combinations that only differ in parameters
+    that can be changed when forking. It's the first combination of the group in the whole grid, so it doesn't depend
+    on which runs of an interrupted sweep are already finished.
+
+    Args:
+        grid: Parameter combinations of `make_grid`.
+
+    Returns: Dictionary of the groups, see `fixed_params`, and the parameters of their warm-ups.
+    """
+    warm_ups = {}
+    for params in grid:
+        warm_ups.setdefault(fixed_params(params), params)
+    return warm_ups
+
+
+def fork_from_warm_up(pool, tasks, steps):
+    """Run one warm-up per seed and warm-up parameters of the tasks.
+
+    Args:
+        pool: Process pool for the warm-up runs.
+        tasks: Tasks of `run` with the parameters of their warm-ups.
+        steps: Number of warm-up steps.
+
+    Returns: Tasks of `run` with the snapshots of their warm-up runs.
+    """
+    warm_ups = {}
+    for _, _, _, seed, _, warmup_params, _ in tasks:
+        warm_ups.setdefault((fixed_params(warmup_params), seed), (warmup_params, seed, steps))
+
+    print(f"Warming up {len(warm_ups)} models for {steps} steps")
+    snapshots = dict(zip(warm_ups, pool.map(warm_up, warm_ups.values())))
+
+    return [
+        (
+            output,
+            key,
+            params,
+            seed,
+            options,
+            warmup_params,
+            snapshots[(fixed_params(warmup_params), seed)],
+        )
+        for output, key, params, seed, options, warmup_params, _ in tasks
+    ]
+
+
+def main(argv=None):
+    """Entry point of the `cssm-sweep` command."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", required=True, help="directory of the results")
+    parser.add_argument(
+        "-p",
+        "--param",
+        action="append",
+        type=parse_param,
+        default=[],
+        metavar="NAME=VALUE[,VALUE...]",
+        help="values of a TrafficModel parameter, can be given multiple times",
+    )
+    parser.add_argument("--grid", help="JSON file with a dictionary of parameter names and values")
+    parser.add_argument("--iterations", type=int, default=1, help="runs per combination")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first iteration")
+    parser.add_argument(
+        "--max-steps", type=int, default=500, help="steps per run, including the --warmup steps"
+    )
+    parser.add_argument("--collect-from", type=int, default=0, help="first collected step")
+    parser.add_argument(
+        "--steady-state",
+        action="store_true",
+        help="stop runs early when flow and density have settled, --max-steps is the upper limit",
+    )
+    parser.add_argument(
+        "--precision",
+        type=float,
+        default=0.02,
+        help="relative half-width of the confidence interval for --steady-state",
+    )
+    parser.add_argument(
+        "--confidence", type=float, default=0.95, help="confidence level for --steady-state"
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=0,
+        help="steps of a warm-up shared by runs that only differ in p_new_agents, p_slow_down,"
+        " traffic_light_phase_length or car_bike_ratio",
+    )
+    parser.add_argument("--processes", type=int, default=None, help="default: number of CPUs")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="record the time of each phase of the step in the index file",
+    )
+    args = parser.parse_args(argv)
+
+    parameters = {}
+    if args.grid:
+        with open(args.grid) as file:
+            parameters.update(
+                {name: v if isinstance(v, list) else [v] for name, v in json.load(file).items()}
+            )
+    parameters.update(dict(args.param))
+
+    sweep(
+        args.output,
+        parameters,
+        iterations=args.iterations,
+        seed=args.seed,
+        max_steps=args.max_steps,
+        collect_from=args.collect_from,
+        steady_state=(
+            {"precision": args.precision, "confidence": args.confidence}
+            if args.steady_state
+            else None
+        ),
+        warmup=args.warmup,
+        processes=args.processes,
+        profile=args.profile,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+import numpy
+
+from .agents import TrafficAgent
+from .streams import SLOW_DOWN
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .model import TrafficModel
+
+CAR = TrafficAgent.Type.CAR.value
+BIKE = TrafficAgent.Type.BIKE.value
+
+# Unit vectors for each direction (indexed by `TrafficAgent.Direction.value`)
+DX = numpy.array([0, 1, 0, -1])
+DY = numpy.array([-1, 0, 1, 0])
+
+# Unit vectors pointing to the left of each direction of travel
+LEFT_DX = numpy.array([-1, 0, 1, 0])
+LEFT_DY = numpy.array([0, -1, 0, 1])
+
+# Max velocity of cars (5) and bikes (3), indexed by type
+MAX_VELOCITY = numpy.array([5, 3])
+
+
+class VectorizedTraffic:
+    """All vehicles of a model stored as arrays instead of `TrafficAgent` objects.
+    Applies the same rules as `TrafficAgent.step` and `TrafficAgent.advance` to all vehicles at once.
+
+    Vehicles are kept in the order of their ids, which is the order in which the scheduler activates agents.
+    """
+
+    def __init__(self, model: "TrafficModel"):
+        """Initialize an empty street network.
+
+        Args:
+            model: Model that owns the vehicles.
+        """
+        self.model = model
+        self.rng = numpy.random.default_rng(model.random.getrandbits(64))
+
+        self.id = numpy.zeros(0, dtype=numpy.int64)
+        self.x = numpy.zeros(0, dtype=numpy.int64)
+        self.y = numpy.zeros(0, dtype=numpy.int64)
+        self.velocity = numpy.zeros(0, dtype=numpy.int64)
+        self.type = numpy.zeros(0, dtype=numpy.int8)
+        self.direction = numpy.zeros(0, dtype=numpy.int8)
+
+        # Cells are numbered column by column. With sparse grid storage only the street cells are numbered: first the
+        # columns of the vertical streets, then the rows of the horizontal streets without the intersections.
+        if model.grid_storage == "sparse":
+            on_street = model.streets >= 0
+            road_columns = road_rows = on_street
+        else:
+            road_columns = numpy.ones(model.size, dtype=bool)
+            road_rows = numpy.zeros(model.size, dtype=bool)
+        self.column_index = numpy.where(road_columns, numpy.cumsum(road_columns) - 1, -1)
+        self.row_index = numpy.where(
+            road_rows, road_columns.sum() + numpy.cumsum(road_rows) - 1, -1
+        )
+        num_cells = (road_columns.sum() + road_rows.sum()) * model.size
+
+        # Index of the vehicle in each cell, -1 for empty cells
+        self.occupancy = numpy.full(num_cells, -1, dtype=numpy.int32)
+
+    def __len__(self):
+        """Return the number of vehicles on the grid."""
+        return len(self.id)
+
+    def step(self):
+        """Stage the movement of all vehicles and apply it afterwards."""
+        self.velocity, next_x, next_y, moving = self.stage(self.draw_slow_down())
+        with self.model.profiler.phase("move.advance"):
+            self.advance(next_x, next_y, moving)
+        self.update_counters()
+
+    def draw_slow_down(self):
+        """Draw which vehicles randomly slow down in this step.
+
+        Returns: Mask of the vehicles in id order.
+        """
+        model = self.model
+        if model.streams is None:
+            draws = self.rng.random(len(self))
+        else:
+            draws = model.streams.randoms(model.schedule.steps, SLOW_DOWN, self.id)
+        return draws < model.p_slow_down
+
+    def stage(self, slow_down, index=slice(None)):
+        """Calculate velocity and next position of the vehicles. See `TrafficAgent.step`.
+
+        Args:
+            slow_down: Mask of all vehicles that randomly slow down.
+            index: Indexes of the vehicles to stage, all vehicles by default.
+
+        Returns: Tuple of the new velocity, the next x and y coordinates and a mask of the vehicles that want to move.
+        """
+        model = self.model
+        x, y, direction, type = (
+            self.x[index],
+            self.y[index],
+            self.direction[index],
+            self.type[index],
+        )
+        base = self.cell_base(index)
+        dx, dy = DX[direction], DY[direction]
+        is_car = (type == CAR).astype(numpy.int64)
+        max_velocity = MAX_VELOCITY[type]
+
+        with model.profiler.phase("move.slow_down"):
+            # 1. Acceleration
+            velocity = numpy.minimum(max_velocity, self.velocity[index] + 1)
+
+            # 2. Slow down
+            searching = numpy.ones(len(x), dtype=bool)
+            for i in range(1, MAX_VELOCITY.max() + 1):
+                searching &= i <= max_velocity
+                cx = x + dx * (i + is_car)
+                cy = y + dy * (i + is_car)
+                searching &= self.in_bounds(cx, cy)
+                blocked = searching & (
+                    (self.occupant(cx, cy, base) >= 0)
+                    | (self.light_state(cx, cy, direction) == 1)
+                    | (
+                        (is_car == 1)
+                        & model.with_bike_box
+                        & (self.light_state(cx + dx, cy + dy, direction) == 1)
+                    )
+                )
+                velocity[blocked] = numpy.minimum(i - 1, velocity[blocked])
+                searching &= ~blocked
+
+        # 3. Randomization
+        slow_down = slow_down[index]
+        velocity[slow_down] = numpy.maximum(velocity[slow_down] - 1, 0)
+
+        # 4. Motion
+        next_x = x + dx * velocity
+        next_y = y + dy * velocity
+        moving = velocity > 0
+
+        # EXTRA: Bike boxes
+        if model.with_bike_box:
+            with model.profiler.phase("move.bike_box"):
+                is_bike = type == BIKE
+
+                # Fill up the bike box in front of a red traffic light
+                fill = (
+                    is_bike
+                    & (self.light_state(x + 2 * dx, y + 2 * dy, direction) == 1)
+                    & (velocity == 0)
+                    & (self.occupant(x + dx, y + dy, base) >= 0)
+                    & self.is_on_bike_lane(x, y, direction)
+                )
+                ldx, ldy = LEFT_DX[direction], LEFT_DY[direction]
+                for i in range(1, 3):
+                    bx = x + dx + i * ldx
+                    by = y + dy + i * ldy
+                    free = fill & (self.occupant(bx, by, base) < 0)
+                    next_x[free] = bx[free]
+                    next_y[free] = by[free]
+                    moving |= free
+                    fill &= ~free
+
+                # Empty the bike box in front of a green traffic light, leftmost bike first
+                empty = is_bike & (self.light_state(x + dx, y + dy, direction) == 0)
+                left = self.occupant(x + ldx, y + ldy, base)
+                wait = empty & (left >= 0) & (self.type[left] == BIKE)
+                velocity[wait] = 0
+                moving &= ~wait
+
+                start = empty & ~wait
+                block_size = model.street_width + model.distance_between_streets
+                vertical = (direction == 0) | (direction == 2)
+                diff = (numpy.where(vertical, x, y) - model.first_street) % block_size
+                lane = numpy.where(
+                    (direction == 0) | (direction == 1), model.street_width - 1 - diff, -diff
+                )
+                next_x[start] = (x + dx + numpy.where(vertical, lane, 0))[start]
+                next_y[start] = (y + dy + numpy.where(vertical, 0, lane))[start]
+                velocity[start] = 1
+                moving |= start
+
+        return velocity, next_x, next_y, moving
+
+    def advance(self, next_x, next_y, moving):
+        """Move all vehicles to their staged positions. See `TrafficAgent.advance`.
+        Vehicles are advanced in id order: a vehicle only moves if its destination is empty at its turn.
+
+        Args:
+            next_x: Staged x coordinates.
+            next_y: Staged y coordinates.
+            moving: Mask of the vehicles that want to move.
+        """
+        leaving = moving & ~self.in_bounds(next_x, next_y)
+        moving = moving & ~leaving
+
+        # A move can only fail when its destination is occupied at the start of the step or is claimed by another
+        # vehicle. These conflicts are resolved one by one, all other moves succeed.
+        target = numpy.where(moving, self.cell_index(next_x, next_y, self.cell_base()), -1)
+        occupant = numpy.where(target >= 0, self.occupancy[target], -1)
+        _, inverse, counts = numpy.unique(target, return_inverse=True, return_counts=True)
+        conflict = moving & ((occupant >= 0) | (counts[inverse] > 1))
+
+        moved = moving & ~conflict
+        vacated = moved | leaving
+        claimed = set()
+        for i in numpy.flatnonzero(conflict):
+            o = occupant[i]
+            if (o < 0 or (o < i and vacated[o])) and target[i] not in claimed:
+                claimed.add(target[i])
+                moved[i] = vacated[i] = True
+
+        self.x = numpy.where(moved, next_x, self.x)
+        self.y = numpy.where(moved, next_y, self.y)
+        self.keep(~leaving)
+
+    def create_agents(self, probability):
+        """Create vehicles at each end of each road with the given probability. See `TrafficModel.create_agents`.
+
+        Args:
+            probability: How likely it is at each end of each road that a new vehicle is created.
+        """
+        ids, x, y, type, direction = self.draw_vehicles(self.model, self.rng, probability)
+
+        # Add vehicle if its cells are empty
+        free = self.is_free(x, y, type, direction)
+        n = len(self)
+        self.append(ids[free], x[free], y[free], type[free], direction[free])
+        self.occupancy[self.cell_index(x[free], y[free])] = numpy.arange(n, len(self))
+        self.update_counters()
+
+    @staticmethod
+    def draw_vehicles(model: "TrafficModel", rng, probability):
+        """Draw the vehicles that are created at the ends of the roads of a model and assign their ids.
+
+        Args:
+            model: Model whose `max_id` is increased.
+            rng: Random number generator of the model.
+            probability: How likely it is at each end of each road that a new vehicle is created.
+
+        Returns: Tuple of the ids, x and y coordinates, types and directions of the new vehicles.
+        """
+        streets = model.number_of_streets
+        if model.streams is None:
+            draws = rng.random((len(TrafficAgent.Direction), streets, 2))
+        else:
+            draws = model.streams.entry_draws(model.schedule.steps, streets)
+
+        created = draws[:, :, 0] <= probability
+        direction, street = numpy.nonzero(created)
+        type = numpy.where(draws[direction, street, 1] < model.car_bike_ratio, CAR, BIKE)
+
+        # Every vehicle that is drawn gets an id, even if it can't be placed
+        ids = model.max_id + 1 + numpy.arange(len(direction))
+        model.max_id += len(direction)
+
+        # When there is a bike lane, move cars one cell towards the center
+        offset = numpy.where(model.with_bike_lane & (type == CAR), 1, 0)
+        x = y = (
+            model.first_street
+            + (model.distance_between_streets + model.street_width) * street
+            + offset
+        )
+        lane = x + model.street_width - 1 - 2 * offset
+        edge = numpy.where((direction == 0) | (direction == 3), model.size - 1, 0)
+        x = numpy.where(direction == 0, lane, numpy.where(direction == 2, x, edge))
+        y = numpy.where(direction == 1, lane, numpy.where(direction == 3, y, edge))
+        return ids, x, y, type.astype(numpy.int8), direction.astype(numpy.int8)
+
+    def is_free(self, x, y, type, direction, base=0):
+        """Check for new vehicles whether their cells are empty. Cars need two empty cells.
+
+        Args:
+            x, y: Coordinates of the new vehicles.
+            type: Types of the new vehicles.
+            direction: Directions of the new vehicles.
+            base: See `cell_base`.
+        """
+        return (self.occupant(x, y, base) < 0) & (
+            (type != CAR) | (self.occupant(x + DX[direction], y + DY[direction], base) < 0)
+        )
+
+    def append(self, ids, x, y, type, direction):
+        """Append new vehicles that stand still without adding them to the occupancy grid."""
+        self.id = numpy.concatenate((self.id, ids))
+        self.x = numpy.concatenate((self.x, x))
+        self.y = numpy.concatenate((self.y, y))
+        self.velocity = numpy.concatenate((self.velocity, numpy.zeros(len(ids), dtype=numpy.int64)))
+        self.type = numpy.concatenate((self.type, type))
+        self.direction = numpy.concatenate((self.direction, direction))
+
+    def update_counters(self):
+        """Update number of vehicles and sum of their velocities per type of the model."""
+        types = len(TrafficAgent.Type)
+        self.model.vehicle_counts = numpy.bincount(self.type, minlength=types).tolist()
+        self.model.velocity_sums = (
+            numpy.bincount(self.type, weights=self.velocity, minlength=types).astype(int).tolist()
+        )
+
+    def keep(self, mask):
+        """Keep only the vehicles of the given mask and rebuild the occupancy grid.
+
+        Args:
+            mask: Boolean mask over all vehicles.
+        """
+        self.id = self.id[mask]
+        self.x = self.x[mask]
+        self.y = self.y[mask]
+        self.velocity = self.velocity[mask]
+        self.type = self.type[mask]
+        self.direction = self.direction[mask]
+        self.rebuild_occupancy()
+
+    def rebuild_occupancy(self):
+        """Rebuild the occupancy grid from the positions of all vehicles."""
+        self.occupancy.fill(-1)
+        self.occupancy[self.cell_index(self.x, self.y, self.cell_base())] = numpy.arange(len(self))
+
+    def __getstate__(self):
+        """Get the state for pickling without the occupancy grid, which is restored from the positions."""
+        state = self.__dict__.copy()
+        state["occupancy"] = len(self.occupancy)
+        return state
+
+    def __setstate__(self, state):
+        """Restore the state from pickling with an empty occupancy grid, see `rebuild_occupancy`."""
+        self.__dict__.update(state)
+        self.occupancy = numpy.full(state["occupancy"], -1, dtype=numpy.int32)
+
+    def in_bounds(self, x, y):
+        """Check which of the given positions are inside the grid."""
+        return (x >= 0) & (x < self.model.size) & (y >= 0) & (y < self.model.size)
+
+    def cell_base(self, index=slice(None)):
+        """Get the offset of the cells of the given vehicles in the occupancy array.
+        It's 0 because there is only one grid, see `EnsembleTraffic` for multiple grids.
+
+        Args:
+            index: Indexes of the vehicles, all vehicles by default.
+        """
+        return 0
+
+    def cell_index(self, x, y, base=0):
+        """Get the number of each of the given cells in the occupancy array, -1 for cells that are outside the grid or
+        not stored.
+
+        Args:
+            x, y: Coordinates of the cells.
+            base: Offset of the grid of the cells in the occupancy array, see `cell_base`.
+        """
+        size = self.model.size
+        inside = self.in_bounds(x, y)
+        x, y = numpy.where(inside, x, 0), numpy.where(inside, y, 0)
+        column, row = self.column_index[x], self.row_index[y]
+        index = numpy.where(
+            column >= 0, column * size + y, numpy.where(row >= 0, row * size + x, -1)
+        )
+        return numpy.where(inside & (index >= 0), index + base, -1)
+
+    def occupant(self, x, y, base=0):
+        """Get index of the vehicle at each of the given positions, -1 for empty or outside cells."""
+        index = self.cell_index(x, y, base)
+        return numpy.where(index >= 0, self.occupancy[index], -1)
+
+    def light_state(self, x, y, direction):
+        """Vectorized version of `TrafficModel.is_red_light`.
+
+        Returns: -1 where the position is not the first cell on an intersection in this direction.
+        Otherwise 1 if the traffic light is red and 0 if it's green.
+        """
+        inside = self.in_bounds(x, y)
+        red_phase = self.model.red_phases(
+            direction, numpy.where(inside, x, 0), numpy.where(inside, y, 0)
+        )
+        red_phase = numpy.where(inside, red_phase, -1)
+        return numpy.where(red_phase < 0, -1, red_phase == self.model.light_phase)
+
+    def is_on_bike_lane(self, x, y, direction):
+        """Vectorized version of `TrafficAgent.is_on_bike_lane` for the vehicles at the given positions."""
+        model = self.model
+        vertical = (direction == 0) | (direction == 2)
+        u = numpy.where(vertical, x, y) - model.first_street
+        u %= model.street_width + model.distance_between_streets
+        return (u == 0) | (u == model.street_width - 1)
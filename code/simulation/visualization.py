@@ -1,5 +1,25 @@
+import base64
+import numpy
+
 from .model import TrafficModel
-from mesa.visualization.ModularVisualization import VisualizationElement, CHART_JS_FILE
+from mesa.visualization.ModularVisualization import (
+    CHART_JS_FILE,
+    ModularServer,
+    SocketHandler,
+    VisualizationElement,
+)
+from mesa.visualization.modules import ChartModule
+from statistics import fmean
+
+# Bit layout of the packed vehicle state in delta frames: x | y << 14 | type << 28 | dir << 29
+COORDINATE_BITS = 14
+TYPE_SHIFT = 2 * COORDINATE_BITS
+DIR_SHIFT = TYPE_SHIFT + 1
+
+
+def encode(array):
+    """Encode an array as base64 string of little-endian 32-bit integers, which the frontend reads as Int32Array."""
+    return base64.b64encode(numpy.ascontiguousarray(array, dtype="<i4").tobytes()).decode()
 
 
 class TrafficGrid(VisualizationElement):
@@ -10,43 +30,278 @@ class TrafficGrid(VisualizationElement):
     package_includes = [CHART_JS_FILE]
     local_includes = ["Model.js"]
 
-    def __init__(self, size, first_street):
-        """Initialize visualization class
+    def __init__(self, delta=False):
+        """Initialize visualization class. The street layout is sent with the frames.
 
         Args:
-            size: size of the grid
-            first_street: x and y coordinate of the beginning of the first street.
+            delta: Send only the vehicles that appeared, moved or left since the previous frame, packed into integers.
+                Traffic lights are only sent when they toggle. The previous frame is kept per connection if the
+                server uses `FrameSocketHandler`, e.g. `TrafficServer`, otherwise all connections share it.
         """
-        self.js_code = f"elements.push(new TrafficModel({size}, {first_street}));"
+        self.js_code = "elements.push(new TrafficModel());"
+        self.delta = delta
+
+        # Connection that the next frame is rendered for, which is set by `FrameSocketHandler`, and the previous frame
+        # of each connection in delta mode: the model, the ids and packed state of the vehicles and the light phase
+        self.connection = None
+        self.previous = {}
+
+    def disconnect(self, connection):
+        """Forget the previous frame of a closed connection."""
+        self.previous.pop(connection, None)
 
     def render(self, model: TrafficModel):
         """Return a list of all agents with their type (car or bike) and coordinates.
-        Also return a list of all traffic lights and their state and whether there are bike lanes and boxes.
+        Also return a list of all traffic lights and their state, the street layout and whether there are bike lanes
+        and boxes.
         """
-        agents = [
-            {
-                "type": agent.type.value,
-                "x": agent.pos[0],
-                "y": agent.pos[1],
-                "dir": agent.direction.value,
-            }
-            for agent in model.schedule.agents
-        ]
-        lights = [
-            {
-                "state": model.lights[x][y],
-                "x": model.first_street + (model.distance_between_streets + model.street_width) * x,
-                "y": model.first_street + (model.distance_between_streets + model.street_width) * y,
-            }
-            for x in range(model.number_of_streets)
-            for y in range(model.number_of_streets)
-        ]
+        if self.delta:
+            return self.render_delta(model)
+
+        if model.vectorized is not None:
+            vehicles = model.vectorized
+            agents = [
+                {"type": type, "x": x, "y": y, "dir": dir}
+                for type, x, y, dir in zip(
+                    vehicles.type.tolist(),
+                    vehicles.x.tolist(),
+                    vehicles.y.tolist(),
+                    vehicles.direction.tolist(),
+                )
+            ]
+        else:
+            agents = [
+                {
+                    "type": agent.type.value,
+                    "x": agent.pos[0],
+                    "y": agent.pos[1],
+                    "dir": agent.direction.value,
+                }
+                for agent in model.schedule.agents
+            ]
         withBikeLane = model.with_bike_lane
         withBikeBox = model.with_bike_box
 
         return {
             "vehicles": agents,
-            "traffic_lights": lights,
+            "traffic_lights": self.get_lights(model),
+            "layout": self.get_layout(model),
             "with_bike_lane": withBikeLane,
             "with_bike_box": withBikeBox,
         }
+
+    def render_delta(self, model: TrafficModel):
+        """Return the changes since the previous frame.
+        Vehicles that appeared or moved are sent as pairs of id and packed state, vehicles that left as ids.
+        The first frame of a model and of a connection is a keyframe that contains all vehicles, traffic lights and
+        the street layout.
+        """
+        ids, packed = self.get_vehicles(model)
+
+        previous = self.previous.get(self.connection)
+        keyframe = previous is None or model is not previous[0]
+        if keyframe:
+            changed = numpy.ones(len(ids), dtype=bool)
+            removed = numpy.zeros(0, dtype=numpy.int64)
+        else:
+            # Vehicles are sorted by id in both frames
+            _, previous_ids, previous_packed, light_phase = previous
+            i = numpy.searchsorted(previous_ids, ids)
+            known = i < len(previous_ids)
+            known[known] = previous_ids[i[known]] == ids[known]
+            changed = ~known
+            changed[known] = previous_packed[i[known]] != packed[known]
+            removed = previous_ids[~numpy.isin(previous_ids, ids, assume_unique=True)]
+
+        data = {
+            "keyframe": keyframe,
+            "vehicles": encode(numpy.column_stack((ids[changed], packed[changed]))),
+            "removed": encode(removed),
+            "with_bike_lane": model.with_bike_lane,
+            "with_bike_box": model.with_bike_box,
+        }
+        if keyframe:
+            data["layout"] = self.get_layout(model)
+        if keyframe or model.light_phase != light_phase:
+            data["traffic_lights"] = self.get_lights(model)
+
+        self.previous[self.connection] = (model, ids, packed, model.light_phase)
+        return data
+
+    def get_vehicles(self, model: TrafficModel):
+        """Get ids and packed state (position, type and direction) of all vehicles, sorted by id."""
+        if model.vectorized is not None:
+            vehicles = model.vectorized
+            ids, x, y = vehicles.id, vehicles.x, vehicles.y
+            type, dir = vehicles.type.astype(numpy.int64), vehicles.direction.astype(numpy.int64)
+        else:
+            agents = model.schedule.agents
+            ids = numpy.fromiter((agent.unique_id for agent in agents), numpy.int64, len(agents))
+            x, y, type, dir = (
+                numpy.array(
+                    [
+                        (agent.pos[0], agent.pos[1], agent.type.value, agent.direction.value)
+                        for agent in agents
+                    ],
+                    dtype=numpy.int64,
+                )
+                .reshape(-1, 4)
+                .T
+            )
+
+        packed = x | (y << COORDINATE_BITS) | (type << TYPE_SHIFT) | (dir << DIR_SHIFT)
+        order = numpy.argsort(ids, kind="stable")
+        return ids[order], packed[order]
+
+    def get_layout(self, model: TrafficModel):
+        """Get size of the grid and position and width of the streets, which depend on the bike lane config."""
+        return {
+            "size": model.size,
+            "first_street": model.first_street,
+            "street_width": model.street_width,
+            "distance_between_streets": model.distance_between_streets,
+            "number_of_streets": model.number_of_streets,
+        }
+
+    def get_lights(self, model: TrafficModel):
+        """Get position and state of all traffic lights."""
+        return [
+            {
+                "state": int(model.lights[x][y]),
+                "x": model.first_street + (model.distance_between_streets + model.street_width) * x,
+                "y": model.first_street + (model.distance_between_streets + model.street_width) * y,
+            }
+            for x in range(model.number_of_streets)
+            for y in range(model.number_of_streets)
+        ]
+
+
+class FrameSocketHandler(SocketHandler):
+    """Websocket handler that tells each `TrafficGrid` which connection a frame is rendered for, so that the frames
+    of one browser tab don't depend on the frames sent to another one.
+    """
+
+    def render_model(self):
+        """Render the current state of the model for this connection."""
+        for element in self.application.visualization_elements:
+            if isinstance(element, TrafficGrid):
+                element.connection = self
+        return self.application.render_model()
+
+    @property
+    def viz_state_message(self):
+        """Message with the current state of the model for this connection."""
+        return {"type": "viz_state", "data": self.render_model()}
+
+    def on_close(self):
+        """Forget the previous frame of this connection."""
+        for element in self.application.visualization_elements:
+            if isinstance(element, TrafficGrid):
+                element.disconnect(self)
+
+
+class TrafficServer(ModularServer):
+    """mesa server that renders the frames per connection with `FrameSocketHandler`."""
+
+    def __init__(self, *args, **kwargs):
+        """Create the server.
+
+        Args:
+            *args: Arguments of `ModularServer`.
+            **kwargs: Keyword arguments of `ModularServer`.
+        """
+        super().__init__(*args, **kwargs)
+        # Handlers that are added later take precedence over the ones of `ModularServer`
+        self.add_handlers(r".*$", [(r"/ws", FrameSocketHandler)])
+
+
+class AggregatedChartModule(ChartModule):
+    """Line chart that shows the aggregate of all steps since the previous frame instead of only the latest step.
+    Useful with `LiveServer`, which may step the model multiple times per frame.
+    """
+
+    def __init__(self, series, aggregate=fmean, **kwargs):
+        """Create a new line chart.
+
+        Args:
+            series: List of dictionaries with the names of the model reporters and their colors, see `ChartModule`.
+            aggregate: Function that aggregates the list of values of a reporter since the previous frame.
+            **kwargs: Other arguments of `ChartModule`.
+        """
+        super().__init__(series, **kwargs)
+        self.aggregate = aggregate
+
+        # Number of collected steps at the previous frame
+        self.model = None
+        self.rendered = 0
+
+    def render(self, model: TrafficModel):
+        """Return the aggregated value of each series since the previous frame."""
+        if model is not self.model:
+            self.model = model
+            self.rendered = 0
+
+        datacollector = getattr(model, self.data_collector_name)
+        model_vars = datacollector.model_vars
+        # A `ColumnarDataCollector` with a window only keeps the values of the last steps
+        collected = getattr(datacollector, "collected", None)
+        if collected is None:
+            collected = max((len(values) for values in model_vars.values()), default=0)
+
+        current_values = []
+        for s in self.series:
+            values = model_vars.get(s["Label"], [])
+            if len(values) == 0:
+                current_values.append(0)
+            elif collected == self.rendered:
+                # No new step since the previous frame
+                current_values.append(values[-1])
+            else:
+                current_values.append(self.aggregate(values[self.rendered - collected :]))
+        self.rendered = collected
+        return current_values
+
+
+class ProfileChartModule(ChartModule):
+    """Line chart of the mean time per step of the phases of the step since the previous frame, in milliseconds.
+    Requires a model with `profile=True`, see `StepProfiler`.
+    """
+
+    def __init__(self, series, **kwargs):
+        """Create a new line chart.
+
+        Args:
+            series: List of dictionaries with the names of the phases as "Label" and their colors, see `ChartModule`.
+            **kwargs: Other arguments of `ChartModule`.
+        """
+        super().__init__(series, **kwargs)
+
+        # Total time and number of steps of the profiler and values at the previous frame
+        self.model = None
+        self.seconds = {}
+        self.steps = 0
+        self.values = [0 for _ in self.series]
+
+    def render(self, model: TrafficModel):
+        """Return the mean time per step of each phase since the previous frame."""
+        profiler = model.profiler
+        if not profiler.enabled:
+            return [0 for _ in self.series]
+
+        if model is not self.model:
+            self.model = model
+            self.seconds = {}
+            self.steps = 0
+
+        steps = profiler.calls["step"] - self.steps
+        if steps == 0:
+            # No new step since the previous frame
+            return self.values
+
+        self.values = [
+            1000 * (profiler.seconds[s["Label"]] - self.seconds.get(s["Label"], 0.0)) / steps
+            for s in self.series
+        ]
+        self.seconds = dict(profiler.seconds)
+        self.steps = profiler.calls["step"]
+        return self.values
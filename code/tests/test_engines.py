@@ -0,0 +1,99 @@
+"""Regression tests that the engines, activations and grid storages of `TrafficModel` run exactly the same simulation.
+
+Each test runs a model with a fixed seed and compares a hash of the id, position, velocity, type and direction of
+every vehicle after the last step. The hashes of the agents engine with shared random numbers are the ones of the
+original model, before the other engines and options were added.
+"""
+import hashlib
+import numpy
+import pytest
+
+from simulation.ensemble import TrafficEnsemble
+from simulation.model import TrafficModel
+
+SEED = 7
+STEPS = 100
+PARAMS = {"p_new_agents": 0.4, "max_steps": STEPS}
+
+# Hash of the vehicles of the agents engine for each random number generation and bike lane config
+EXPECTED = {
+    ("shared", 0): "cb4a8e9d3e0253fb",
+    ("shared", 1): "26a142990985d4aa",
+    ("shared", 2): "9faac6a30a54171c",
+    ("counter", 0): "e4514c208ee9281a",
+    ("counter", 1): "2b58eb76aa3e9121",
+    ("counter", 2): "d16e68023d5a6f90",
+}
+
+# Hash of the vehicles of the numpy engine with shared random numbers, which it draws in another order
+EXPECTED_NUMPY = {0: "8a7117bae9e7c40b", 1: "c9d79efc3235ad1c", 2: "ffdc77c4b38d1cf4"}
+
+
+def vehicles_hash(state):
+    """Hash an array with one row of id, x, y, velocity, type and direction per vehicle, independent of their order."""
+    state = numpy.asarray(state, dtype=numpy.int64).reshape(-1, 6)
+    state = state[numpy.argsort(state[:, 0], kind="stable")].T
+    return hashlib.sha256(numpy.ascontiguousarray(state, dtype="<i8").tobytes()).hexdigest()[:16]
+
+
+def model_hash(model: TrafficModel):
+    """Hash the vehicles of a model with any engine."""
+    if model.vectorized is not None:
+        v = model.vectorized
+        return vehicles_hash(numpy.column_stack((v.id, v.x, v.y, v.velocity, v.type, v.direction)))
+    return vehicles_hash(
+        [
+            (a.unique_id, *a.pos, a.velocity, a.type.value, a.direction.value)
+            for a in model.schedule.agents
+        ]
+    )
+
+
+def run(seed=SEED, **params):
+    """Run a model for `STEPS` steps and hash its vehicles."""
+    model = TrafficModel(seed=seed, **PARAMS, **params)
+    model.run_model()
+    return model_hash(model)
+
+
+@pytest.mark.parametrize("bike_lane_config", [0, 1, 2])
+@pytest.mark.parametrize("rng", ["shared", "counter"])
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"activation": "sleeping"}, {"grid_storage": "sparse"}],
+    ids=["simultaneous", "sleeping", "sparse"],
+)
+def test_agents_engine(bike_lane_config, rng, options):
+    assert (
+        run(bike_lane_config=bike_lane_config, rng=rng, **options)
+        == EXPECTED[rng, bike_lane_config]
+    )
+
+
+@pytest.mark.parametrize("bike_lane_config", [0, 1, 2])
+@pytest.mark.parametrize("grid_storage", ["dense", "sparse"])
+def test_numpy_engine(bike_lane_config, grid_storage):
+    params = {"bike_lane_config": bike_lane_config, "grid_storage": grid_storage, "engine": "numpy"}
+    assert run(**params) == EXPECTED_NUMPY[bike_lane_config]
+    assert run(rng="counter", **params) == EXPECTED["counter", bike_lane_config]
+
+
+@pytest.mark.parametrize("bike_lane_config", [0, 1, 2])
+@pytest.mark.parametrize("rng", ["shared", "counter"])
+def test_ensemble(bike_lane_config, rng):
+    ensemble = TrafficEnsemble(3, seed=SEED, bike_lane_config=bike_lane_config, rng=rng, **PARAMS)
+    ensemble.run_model()
+
+    vehicles = ensemble.vehicles
+    state = numpy.column_stack(
+        (vehicles.id, vehicles.x, vehicles.y, vehicles.velocity, vehicles.type, vehicles.direction)
+    )
+    hashes = [vehicles_hash(state[vehicles.replicate == i]) for i in range(len(ensemble))]
+
+    # Replicate `i` is the same simulation as the numpy engine with seed `SEED + i`
+    expected = EXPECTED_NUMPY if rng == "shared" else {c: EXPECTED[rng, c] for c in range(3)}
+    assert hashes[0] == expected[bike_lane_config]
+    assert hashes[1:] == [
+        run(seed=SEED + i, bike_lane_config=bike_lane_config, rng=rng, engine="numpy")
+        for i in range(1, len(ensemble))
+    ]